@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from duty_rules import component_rules
+
+# -----------------------------------------------------------------------------
+# CBP Merchandise Processing Fee and Harbor Maintenance Fee.
+# The MPF is charged per customs entry: the ad valorem rate applies to the value
+# of all lines of the entry and the minimum/maximum limits apply to that total,
+# not to each line. The entry fee is then shared over its lines by value so the
+# line fees add up to what CBP charges. The HMF has no limits and is costed per line.
+# Rates and limits come from the duty rules, which is where the MOT decides
+# whether a line pays HMF (OCEAN in the bundled table).
+# Lines are grouped by 'Entry Number', a line without one is an entry of its own.
+# -----------------------------------------------------------------------------
+
+# Per-line fee parameters from the duty rules, kept with the line results so fees can be
+# recomputed for a whole entry without matching the rules again
+FEE_PARAMETER_COLUMNS = ['MPF Rate', 'MPF Minimum', 'MPF Maximum', 'HMF Rate']
+
+ENTRY_COLUMN = 'Entry Number'
+
+#==============================================================================================
+def fee_parameters(matched, line_count):
+    # MPF rate and limits and HMF rate per line from match_rules output, NaN where no rule applies
+    mpf = component_rules(matched, 'mpf', line_count)
+    hmf = component_rules(matched, 'hmf', line_count)
+    return pd.DataFrame({
+        'MPF Rate': mpf['rate'].to_numpy(dtype=float),
+        'MPF Minimum': mpf['minimum'].to_numpy(dtype=float),
+        'MPF Maximum': mpf['maximum'].to_numpy(dtype=float),
+        'HMF Rate': hmf['rate'].to_numpy(dtype=float),
+    })
+#==============================================================================================
+def entry_groups(entry_numbers, line_count):
+    # Entry id per line, 0..entries-1, blank entry numbers get an entry of their own
+    if entry_numbers is None:
+        return np.arange(line_count)
+    numbers = pd.Series(entry_numbers, dtype=object).where(lambda s: s.astype(str).str.strip() != '')
+    groups, uniques = pd.factorize(numbers)
+    unnumbered = groups < 0
+    groups[unnumbered] = len(uniques) + np.arange(unnumbered.sum())
+    return groups
+#==============================================================================================
+def entry_fees(value, parameters, entry_numbers=None, groups=None):
+    # MPF and HMF per line for a frame of lines, returns two arrays.
+    # parameters has the FEE_PARAMETER_COLUMNS (NaN rows pay no fee), entry_numbers groups the lines.
+    # groups can be given instead, as from entry_groups, when the caller has them already.
+    value = np.nan_to_num(np.asarray(value, dtype=float), nan=0.0)
+    rate, minimum, maximum, hmf_rate = (parameters[column].to_numpy(dtype=float) for column in FEE_PARAMETER_COLUMNS)
+    charged = ~(np.isnan(rate) & np.isnan(minimum))
+    value = np.where(charged, value, 0.0)
+
+    if groups is None:
+        groups = entry_groups(entry_numbers, len(value))
+    entry_count = groups.max() + 1 if len(groups) else 0
+    entry_value = np.bincount(groups, weights=value, minlength=entry_count)
+    entry_lines = np.bincount(groups, weights=charged, minlength=entry_count)
+
+    # An entry takes the rate and limits of its first charged line
+    order = np.lexsort((~charged, groups))
+    first = order[np.unique(groups[order], return_index=True)[1]]
+    entry_mpf = np.fmin(np.fmax(rate[first] * entry_value, minimum[first]), maximum[first])
+    entry_mpf = np.nan_to_num(entry_mpf, nan=0.0)
+
+    # Share the entry fee by value, or evenly when the entry has no value
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(entry_value[groups] > 0, value / entry_value[groups], charged / entry_lines[groups])
+    mpf = np.nan_to_num(entry_mpf[groups] * share, nan=0.0)
+    hmf = np.nan_to_num(hmf_rate * value, nan=0.0)
+    return mpf, hmf
@@ -0,0 +1,131 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# General Rate of Duty parsing.
+# A rate string such as "Free", "6.5%", "2.5¢/kg", "$1.035/kg + 17%" or "2%-5%"
+# is parsed once into a ParsedRate and cached by string. Costing a line is then
+# plain arithmetic on the components:
+#   duty = ad_valorem * value + per_kg * weight + per_liter * weight + per_unit * quantity
+# Entry lines carry no volume, so per-liter rates are costed against the weight column.
+# -----------------------------------------------------------------------------
+
+# ad_valorem is a fraction of value, the per_* components are USD per unit of measure.
+# error is None for a good rate, otherwise a message saying why it could not be parsed.
+ParsedRate = namedtuple('ParsedRate', ['ad_valorem', 'per_kg', 'per_liter', 'per_unit', 'error'])
+
+ZERO_RATE = ParsedRate(0.0, 0.0, 0.0, 0.0, None)
+
+# Units of measure accepted after the '/', mapped to the component they feed and a multiplier
+RATE_UNITS = {
+    'kg': ('per_kg', 1.0),
+    'g': ('per_kg', 1000.0),
+    't': ('per_kg', 0.001),
+    'liter': ('per_liter', 1.0),
+    'litre': ('per_liter', 1.0),
+    'l': ('per_liter', 1.0),
+    'each': ('per_unit', 1.0),
+    'unit': ('per_unit', 1.0),
+    'no.': ('per_unit', 1.0),
+    'no': ('per_unit', 1.0),
+    'pc': ('per_unit', 1.0),
+    'pcs': ('per_unit', 1.0),
+    'item': ('per_unit', 1.0),
+    'pr.': ('per_unit', 0.5),
+    'pr': ('per_unit', 0.5),
+    'doz.': ('per_unit', 1.0 / 12),
+    'doz': ('per_unit', 1.0 / 12),
+}
+
+# One term of a rate: an optional '$', a number, then '%' or '¢' and an optional '/unit'
+_AMOUNT = r'\$?\s*\d+(?:\.\d+)?\s*(?:%|¢|c)?'
+_TERM_PATTERN = re.compile(
+    r'^(?P<dollar>\$)?\s*(?P<amount>\d+(?:\.\d+)?)\s*(?P<symbol>%|¢|c)?\s*(?:/\s*(?P<unit>[a-z.]+))?$'
+)
+# A range like "2%-5%" or "1.5¢/kg to 3¢/kg", costed at its upper bound
+_RANGE_PATTERN = re.compile(r'^(?P<low>.+?)\s*(?:-|–|\bto\b)\s*(?P<high>' + _AMOUNT + r'.*)$')
+
+#==============================================================================================
+def _parse_term(term):
+    # Parse one term of a compound rate into its component dict
+    match = _TERM_PATTERN.match(term)
+    if not match:
+        return None
+    amount = float(match.group('amount'))
+    symbol = match.group('symbol')
+    unit = match.group('unit')
+
+    if symbol == '%':
+        if unit:
+            return None
+        return {'ad_valorem': amount / 100}
+
+    if symbol in ('¢', 'c'):
+        amount /= 100  # Convert cents to dollars
+    elif not match.group('dollar') and not unit:
+        # A bare number is a percentage
+        return {'ad_valorem': amount / 100}
+
+    # A currency amount without a unit is assumed to be per kg
+    component, multiplier = RATE_UNITS.get(unit or 'kg', (None, None))
+    if component is None:
+        return None
+    return {component: amount * multiplier}
+#==============================================================================================
+@lru_cache(maxsize=None)
+def _parse_rate_string(rate_str):
+    # Drop special program lists such as "Free (A+,AU,...)" and footnote references such as "6.5% 1/"
+    text = re.sub(r'\s*\(.*\)$', '', rate_str.strip().lower())
+    text = re.sub(r'\s+\d+/$', '', text)
+    if text in ('', 'nan', 'none', 'free', '0', '0%'):
+        return ZERO_RATE
+
+    components = {'ad_valorem': 0.0, 'per_kg': 0.0, 'per_liter': 0.0, 'per_unit': 0.0}
+    for term in text.split('+'):
+        term = term.strip()
+        range_match = _RANGE_PATTERN.match(term)
+        if range_match and _parse_term(range_match.group('low')) is not None:
+            term = range_match.group('high').strip()
+        parsed = _parse_term(term)
+        if parsed is None:
+            return ParsedRate(0.0, 0.0, 0.0, 0.0, f"Unrecognised rate term '{term}' in '{rate_str}'")
+        for component, amount in parsed.items():
+            components[component] += amount
+    return ParsedRate(error=None, **components)
+#==============================================================================================
+def parse_rate(rate):
+    # Parse a General Rate of Duty value (string or number) into a ParsedRate, cached by string
+    if isinstance(rate, float) and np.isnan(rate):
+        return ZERO_RATE
+    return _parse_rate_string(str(rate))
+#==============================================================================================
+def rate_components(rates):
+    # Parse a column of rates into an (n, 4) array of ParsedRate components per line and an
+    # error message per line or None. Each distinct rate string is parsed once; lines with a
+    # bad rate get NaN components.
+    codes, uniques = pd.factorize(pd.Series(rates, dtype=object).astype(str), use_na_sentinel=False)
+    parsed = [parse_rate(rate) for rate in uniques]
+    table = np.array([rate[:4] for rate in parsed], dtype=float).reshape(-1, 4)
+    table[[rate.error is not None for rate in parsed]] = np.nan
+    errors = np.array([rate.error for rate in parsed], dtype=object)[codes]
+    return table[codes], errors
+#==============================================================================================
+def duty_fraction(components, value, weight, quantity=1):
+    # Duty as a fraction of value from rate_components and value/weight/quantity arrays
+    value = np.asarray(value, dtype=float)
+    weight = np.asarray(weight, dtype=float)
+    quantity = np.broadcast_to(np.asarray(quantity, dtype=float), value.shape)
+    specific = components[:, 1] * weight + components[:, 2] * weight + components[:, 3] * quantity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return components[:, 0] + specific / value
+#==============================================================================================
+def evaluate_rates(rates, value, weight, quantity=1):
+    # Evaluate a column of rates against value/weight/quantity arrays.
+    # Returns (duty as a fraction of value, error message per line or None).
+    # Lines with a bad rate come back as NaN.
+    components, errors = rate_components(rates)
+    return duty_fraction(components, value, weight, quantity), errors
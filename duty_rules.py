@@ -0,0 +1,152 @@
+import os
+import re
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# Country-aware duty rules.
+# Which duties and fees apply to a line is read from a rules table (duty_rules.csv
+# next to this file, or the file named by DUTY_RULES_PATH) instead of being written
+# into the calculation. One row per rule:
+#   rule            schedule   - take the component from the tariff schedule column
+#                   additional - a fixed ad valorem rate, e.g. a Section 301 list
+#                   exemption  - the component does not apply, e.g. a Section 232 exemption
+#                   preference - replaces the General Rate of Duty, e.g. an FTA rate
+#                   mpf        - Merchandise Processing Fee, ad valorem with a minimum and maximum
+#                   hmf        - Harbor Maintenance Fee, ad valorem
+#   component       china, aluminum, steel, general, mpf or hmf (see RULE_TYPES)
+#   country         country of origin the rule applies to, '*' for every country
+#   hts_prefix      HTS code prefix the rule applies to, blank for every code
+#   mot             method of transportation, '*' for every one
+#   rate            fraction of value (0.25 for 25%)
+#   minimum/maximum USD limits, mpf rules only
+#   effective_from/effective_to  dates the rule is in force, blank for open ended
+#
+# For every line and component the most specific rule in force wins: the longest
+# HTS prefix first, then a named country over '*', then a named MOT over '*', and
+# the later row in the file on a tie. Rules are matched with one join per prefix
+# length, not per line, so a whole manifest is resolved at once.
+# -----------------------------------------------------------------------------
+
+RULES_PATH = os.environ.get('DUTY_RULES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'duty_rules.csv'))
+
+RULE_COLUMNS = ['rule', 'component', 'country', 'hts_prefix', 'mot', 'rate', 'minimum', 'maximum',
+                'effective_from', 'effective_to', 'description']
+
+# Rule types and the components each one may set
+RULE_TYPES = {
+    'schedule': ('china', 'aluminum', 'steel'),
+    'additional': ('china', 'aluminum', 'steel'),
+    'exemption': ('china', 'aluminum', 'steel'),
+    'preference': ('general',),
+    'mpf': ('mpf',),
+    'hmf': ('hmf',),
+}
+
+# Schedule column a 'schedule' rule reads for each component
+SCHEDULE_COLUMNS = {'china': 'China Duties', 'aluminum': 'Aluminum', 'steel': 'Steel'}
+
+# Wildcard for the country and mot columns
+ANY = '*'
+
+#==============================================================================================
+def _match_key(values):
+    # Countries and MOTs are compared without case or surrounding spaces
+    return pd.Series(values, dtype=object).fillna('').astype(str).str.strip().str.casefold().to_numpy(dtype=object)
+#==============================================================================================
+def compile_rules(rules):
+    # Check a rules frame and add the columns match_rules needs, raises ValueError listing bad rows
+    rules = rules.reindex(columns=RULE_COLUMNS).reset_index(drop=True)
+    for column in ('rule', 'component', 'country', 'hts_prefix', 'mot', 'description'):
+        rules[column] = rules[column].astype(object).fillna('').astype(str).str.strip()
+    rules['rule'] = rules['rule'].str.lower()
+    rules['component'] = rules['component'].str.lower()
+    rules['country'] = rules['country'].replace('', ANY)
+    rules['mot'] = rules['mot'].replace('', ANY)
+    rules['hts_prefix'] = rules['hts_prefix'].map(lambda prefix: re.sub(r'\D', '', prefix))
+    for column in ('rate', 'minimum', 'maximum'):
+        rules[column] = pd.to_numeric(rules[column], errors='coerce')
+    for column in ('effective_from', 'effective_to'):
+        rules[column] = pd.to_datetime(rules[column], errors='coerce')
+
+    problems = []
+    for row, rule in rules.iterrows():
+        if rule['component'] not in RULE_TYPES.get(rule['rule'], ()):
+            problems.append(f"row {row + 2}: unknown rule '{rule['rule']}' for component '{rule['component']}'")
+        elif rule['rule'] in ('additional', 'preference', 'hmf') and pd.isna(rule['rate']):
+            problems.append(f"row {row + 2}: '{rule['rule']}' rule without a rate")
+        elif rule['rule'] == 'mpf' and pd.isna(rule['rate']) and pd.isna(rule['minimum']):
+            problems.append(f"row {row + 2}: 'mpf' rule without a rate or minimum")
+    if problems:
+        raise ValueError("Invalid duty rules: " + "; ".join(problems))
+
+    rules['country_key'] = _match_key(rules['country'])
+    rules['mot_key'] = _match_key(rules['mot'])
+    rules['prefix_len'] = rules['hts_prefix'].str.len()
+    rules['specificity'] = rules['prefix_len'] * 4 + (rules['country'] != ANY) * 2 + (rules['mot'] != ANY)
+    rules['order'] = np.arange(len(rules))
+    return rules
+#==============================================================================================
+def load_rules(path=None):
+    # Read and compile a rules CSV, text columns are kept as text so prefixes keep their zeros
+    return compile_rules(pd.read_csv(path or RULES_PATH, dtype=str, keep_default_na=False))
+#==============================================================================================
+@lru_cache(maxsize=None)
+def default_rules():
+    # The bundled rules table, read once per process
+    return load_rules()
+#==============================================================================================
+def match_rules(rules, hts_codes, countries, mots, entry_dates=None):
+    # Winning rule per line and component for a batch of lines.
+    # rules comes from compile_rules, entry_dates is one date per line or a single date (default today).
+    # Returns a frame with one row per (line, component) that has a rule in force, where line
+    # is the position of the line in the batch.
+    hts_codes = pd.Series(hts_codes, dtype=object).fillna('').astype(str).to_numpy(dtype=object)
+    lines = pd.DataFrame({
+        'line': np.arange(len(hts_codes)),
+        'hts_code': hts_codes,
+        'country_key': _match_key(countries),
+        'line_mot': _match_key(mots),
+    })
+    if entry_dates is None or np.ndim(entry_dates) == 0:
+        entry_dates = [entry_dates] * len(lines)
+    # Lines without a usable date are costed with the rules in force today
+    entry_dates = pd.to_datetime(pd.Series(list(entry_dates), dtype=object), errors='coerce')
+    lines['entry_date'] = entry_dates.fillna(pd.Timestamp(date.today())).to_numpy()
+    code_length = lines['hts_code'].str.len()
+
+    rule_fields = rules.drop(columns=['description', 'prefix_len'])
+    matches = []
+    for length in rules['prefix_len'].unique():
+        level_rules = rule_fields[rules['prefix_len'] == length]
+        keyed = lines[code_length >= length].assign(hts_prefix=lambda frame: frame['hts_code'].str[:length])
+        anywhere = level_rules['country'] == ANY
+        matches.append(keyed.merge(level_rules[~anywhere], on=['hts_prefix', 'country_key']))
+        matches.append(keyed.merge(level_rules[anywhere].drop(columns='country_key'), on='hts_prefix'))
+    if not matches:
+        return pd.DataFrame(columns=['line', 'component', 'rule', 'rate', 'minimum', 'maximum'])
+    matched = pd.concat(matches, ignore_index=True)
+
+    in_force = ((matched['mot'] == ANY) | (matched['mot_key'] == matched['line_mot'])) \
+        & (matched['effective_from'].isna() | (matched['effective_from'] <= matched['entry_date'])) \
+        & (matched['effective_to'].isna() | (matched['entry_date'] <= matched['effective_to']))
+    winners = matched[in_force].sort_values(['specificity', 'order']).drop_duplicates(['line', 'component'], keep='last')
+    return winners[['line', 'component', 'rule', 'rate', 'minimum', 'maximum']].reset_index(drop=True)
+#==============================================================================================
+def rule_periods(rules, entry_dates):
+    # Number of the period between two rule start/end dates that each date falls in, so lines
+    # with the same period have the same rules in force. Missing dates mean today, as in match_rules.
+    boundaries = pd.concat([rules['effective_from'], rules['effective_to'] + pd.Timedelta(days=1)]).dropna().unique()
+    if entry_dates is None or np.ndim(entry_dates) == 0:
+        entry_dates = [entry_dates]
+    entry_dates = pd.to_datetime(pd.Series(list(entry_dates), dtype=object), errors='coerce')
+    entry_dates = entry_dates.fillna(pd.Timestamp(date.today())).to_numpy(dtype='datetime64[ns]')
+    return np.searchsorted(np.sort(boundaries.astype('datetime64[ns]')), entry_dates, side='right')
+#==============================================================================================
+def component_rules(matched, component, line_count):
+    # Rule, rate and limits of one component for every line of the batch, NaN where no rule applies
+    rules = matched[matched['component'] == component].set_index('line')
+    return rules[['rule', 'rate', 'minimum', 'maximum']].reindex(range(line_count))
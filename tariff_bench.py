@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from duty_rates import evaluate_rates
+from tariff_engine import build_prefix_index, build_tariff_index, calculate_tariffs, lookup_tariffs
+from tariff_export import add_total_row, to_excel
+from tariff_ingest import iter_manifest, merge_all_data, normalize_hts_codes
+from tariff_part_cache import PartCache, calculate_tariffs_cached
+
+# -----------------------------------------------------------------------------
+# Benchmarks for ingestion, merge, lookup, rate evaluation, calculation and export.
+# Synthetic schedules are generated in the shapes the app expects (ADD/CVD case
+# lists with HSCODE, China/Aluminum/Steel sheets with HTS, a general rate file with
+# 'General Rate of Duty') along with manifests, then each stage is timed on its own.
+#
+#   python tariff_bench.py --rows 1000 100000 --lines 10000 --save-baseline baseline.json
+#   python tariff_bench.py --rows 1000 100000 --lines 10000 --baseline baseline.json
+#
+# Times are the best of --repeat runs. Peak memory comes from one extra run under
+# tracemalloc, so it does not slow the timed runs. merge_all_data parses workbooks in
+# worker processes whose memory is not part of its peak.
+# Generated files are kept in --data-dir and reused by later runs with the same sizes.
+# -----------------------------------------------------------------------------
+
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'tariff_bench')
+
+# Rate strings in the forms found in the General Rate of Duty column
+GENERAL_RATES = ['Free', '2.5%', '6.5%', '3.9%', '$1.035/kg + 17%', '2.5¢/kg', '3%-5%', '25¢/doz. + 4%', 0.02]
+SPECIFIC_RATES = [0.25, 0.075, 0.1, None]
+COUNTRIES = ['China', 'USA', 'Mexico', 'Canada', 'Germany', 'Italy', 'India']
+MODES = ['AIR', 'TRUCK', 'OCEAN', 'COURIER']
+
+# Lines per customs entry in the generated manifests
+ENTRY_LINES = 20
+
+#==============================================================================================
+def synthetic_codes(rows, rng):
+    # rows distinct 8 digit HTS codes spread over the whole range, formatted like the schedules
+    stride = 90000000 // max(rows, 1)
+    codes = 10000000 + np.arange(rows, dtype=np.int64) * stride + rng.integers(0, stride, size=rows)
+    text = pd.Series(codes.astype(str))
+    return (text.str[:4] + '.' + text.str[4:6] + '.' + text.str[6:]).tolist()
+#==============================================================================================
+def _write_workbook(path, sheets):
+    # sheets maps sheet name to (header, rows), written in write-only mode to keep large files cheap
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, (header, rows) in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        worksheet.append(header)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(path)
+#==============================================================================================
+def generate_schedules(rows, directory, seed=0):
+    # Write the five schedule workbooks for rows codes, returns their paths in upload order
+    rng = np.random.default_rng(seed)
+    codes = synthetic_codes(rows, rng)
+    general = rng.choice(np.array(GENERAL_RATES, dtype=object), size=rows)
+    china = rng.choice(np.array(SPECIFIC_RATES, dtype=object), size=rows)
+    half = rows // 2
+
+    workbooks = {
+        # The general export carries no duty columns, so China, Aluminum and Steel duties are
+        # only reached through the specific duty workbooks, like with real uploads
+        'general_rates.xlsx': {'Sheet1': (['HTS Number', 'General Rate of Duty', 'Description'],
+                                          zip(codes, general, ('Synthetic line',) * rows))},
+        'china.xlsx': {'China': (['HTS', 'China'], zip(codes, china))},
+        'aluminum.xlsx': {'Aluminum': (['HTS', 'Aluminum'], zip(codes, rng.choice(np.array(SPECIFIC_RATES, dtype=object), size=rows)))},
+        'steel.xlsx': {'Steel': (['HTS', 'Steel'], zip(codes, rng.choice(np.array(SPECIFIC_RATES, dtype=object), size=rows)))},
+        'addcvd.xlsx': {'ADD cases': (['HSCODE', 'Case'], ((code, 'A-000-000') for code in codes[:half])),
+                        'CVD cases': (['HSCODE', 'Case'], ((code, 'C-000-000') for code in codes[half:]))},
+    }
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, sheets in workbooks.items():
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            # Written under another name first so an interrupted run never leaves a file to reuse
+            _write_workbook(f"{path}.tmp", sheets)
+            os.replace(f"{path}.tmp", path)
+        paths.append(path)
+    return paths
+#==============================================================================================
+def generate_manifest(lines, schedule_rows, path, seed=0):
+    # Write a CSV manifest: most lines use listed codes, some only share a heading, some are unknown
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed + 1)
+    listed = np.array(synthetic_codes(schedule_rows, np.random.default_rng(seed)), dtype=object)
+    codes = rng.choice(listed, size=lines)
+    kind = rng.random(lines)
+    codes = np.where(kind < 0.1, pd.Series(codes).str[:7].to_numpy(dtype=object) + '.99', codes)
+    codes = np.where(kind > 0.95, np.array(synthetic_codes(lines, rng), dtype=object), codes)
+    manifest = pd.DataFrame({
+        'SLB Part Number': [f"P{number:07d}" for number in range(lines)],
+        'US HTS': codes,
+        'COO': rng.choice(COUNTRIES, size=lines),
+        'Value': rng.lognormal(7, 1.5, size=lines).round(2),
+        'Weight': rng.lognormal(2, 1, size=lines).round(2),
+        'MOT': rng.choice(MODES, size=lines),
+        'Entry Number': [f"E{number // ENTRY_LINES:06d}" for number in range(lines)],
+    })
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    manifest.to_csv(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+    return path
+#==============================================================================================
+def measure(function, repeat=3):
+    # Best wall time of repeat runs and the peak traced allocation of one more run, in MB.
+    # Returns (seconds, peak_mb, result of the last run).
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        result = function()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak_mb, result
+#==============================================================================================
+def run_benchmarks(schedule_rows, manifest_lines, data_dir=DATA_DIR, repeat=3, report=print):
+    # Time every stage for one schedule size and one manifest size, returns {stage: measurement}
+    directory = os.path.join(data_dir, f"schedules_{schedule_rows}")
+    schedules = generate_schedules(schedule_rows, directory)
+    manifest = generate_manifest(manifest_lines, schedule_rows, os.path.join(directory, f"manifest_{manifest_lines}.csv"))
+
+    stages = {}
+
+    def stage(name, function):
+        seconds, peak_mb, result = measure(function, repeat)
+        stages[name] = {'seconds': seconds, 'peak_mb': peak_mb}
+        report(f"  {name:<16} {seconds:10.4f} s {peak_mb:10.1f} MB")
+        return result
+
+    report(f"{schedule_rows} schedule rows, {manifest_lines} manifest lines")
+    merged_data = stage('merge_all_data', lambda: merge_all_data(schedules))
+
+    def build_indexes():
+        tariff_index = build_tariff_index(merged_data)
+        return tariff_index, build_prefix_index(tariff_index)
+    tariff_index, prefix_index = stage('build_index', build_indexes)
+
+    def read_manifest():
+        entries = pd.concat([chunk for chunk, _ in iter_manifest(manifest)], ignore_index=True)
+        entries['US HTS'] = normalize_hts_codes(entries['US HTS']).fillna('')
+        return entries
+    entries = stage('read_manifest', read_manifest)
+
+    tariffs = stage('lookup', lambda: lookup_tariffs(tariff_index, entries['US HTS'], prefix_index))
+    stage('evaluate_rates', lambda: evaluate_rates(tariffs['General_Rate_of_Duty'], entries['Value'], entries['Weight']))
+    results = stage('calculate', lambda: calculate_tariffs(entries, tariff_index, prefix_index))
+
+    # Calculation with every part already in a part cache, as on a repeated manifest
+    with tempfile.TemporaryDirectory() as store_dir:
+        part_cache = PartCache(store_dir)
+        calculate_tariffs_cached(entries, tariff_index, prefix_index, part_cache, 'bench')
+        stage('calculate_cached', lambda: calculate_tariffs_cached(entries, tariff_index, prefix_index, part_cache, 'bench'))
+    stage('to_excel', lambda: to_excel(add_total_row(results)))
+    return stages
+#==============================================================================================
+def compare(results, baseline, tolerance):
+    # Ratio of every timing to the baseline, returns (report lines, regressed stage names)
+    lines, regressions = [], []
+    for name, measurement in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            lines.append(f"  {name:<40} new")
+            continue
+        ratio = measurement['seconds'] / previous['seconds'] if previous['seconds'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  SLOWER'
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            flag = '  faster'
+        lines.append(f"  {name:<40} {ratio:6.2f}x time, {measurement['peak_mb'] - previous['peak_mb']:+8.1f} MB{flag}")
+    return lines, regressions
+#==============================================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tariff ingestion, lookup, calculation and export on synthetic data.")
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000, 10000, 100000], help="Schedule sizes (rows per workbook)")
+    parser.add_argument('--lines', nargs='+', type=int, default=[10000], help="Manifest sizes (lines)")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage, the best one is kept")
+    parser.add_argument('--data-dir', default=DATA_DIR, help=f"Where generated files are kept (default: {DATA_DIR})")
+    parser.add_argument('--output', default=None, help="Also write the report to this file, e.g. bench_output.txt")
+    parser.add_argument('--save-baseline', default=None, help="Write the results as JSON, to compare later runs against")
+    parser.add_argument('--baseline', default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Relative slowdown reported as a regression (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    report_lines = []
+
+    def report(line):
+        print(line, flush=True)
+        report_lines.append(line)
+
+    results = {}
+    for rows in args.rows:
+        for lines in args.lines:
+            for name, measurement in run_benchmarks(rows, lines, args.data_dir, args.repeat, report).items():
+                results[f"{name}@{rows}x{lines}"] = measurement
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        report(f"Compared with {args.baseline}:")
+        comparison, regressions = compare(results, baseline, args.tolerance)
+        for line in comparison:
+            report(line)
+        if regressions:
+            report(f"{len(regressions)} stage(s) slower than the baseline by more than {args.tolerance:.0%}")
+            status = 1
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write('\n'.join(report_lines) + '\n')
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+
+from duty_rules import RULES_PATH, load_rules
+from tariff_engine import INPUT_COLUMNS, build_prefix_index, build_tariff_index
+from tariff_export import EXPORT_FORMATS, export_results
+from tariff_ingest import cost_manifest
+from tariff_part_cache import PartCache, calculate_tariffs_cached
+from tariff_snapshots import calculate_tariffs_as_of
+from tariff_store import load_merged, store_key
+
+# -----------------------------------------------------------------------------
+# Headless tariff costing, for cron jobs and containers. Does not import streamlit.
+#
+#   python tariff_cli.py --schedules general.xlsx china_301.xlsx addcvd.xlsx \
+#       --manifest parts.csv --output costed.xlsx
+#   python tariff_cli.py --as-of-snapshots --manifest parts.csv --output costed.csv
+#
+# The schedules go through the same merge_all_data logic and on-disk store as
+# the app. With --as-of-snapshots each line is costed against the tariff snapshot
+# in force on its Entry Date instead (see tariff_snapshots.py).
+# The output format follows the extension: .xlsx, .csv or .parquet.
+# -----------------------------------------------------------------------------
+
+OUTPUT_FORMATS = tuple(EXPORT_FORMATS)
+
+#==============================================================================================
+def write_results(results, path):
+    contents = export_results(results, os.path.splitext(path)[1].lower())
+    with open(path, 'wb') as handle:
+        handle.write(contents)
+#==============================================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cost a shipment manifest against the tariff schedules without Streamlit.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--schedules', nargs='+', help="Schedule workbooks, in the same order they are uploaded in the app")
+    source.add_argument('--as-of-snapshots', action='store_true',
+                        help="Cost each line against the saved tariff snapshot in force on its Entry Date")
+    parser.add_argument('--manifest', required=True, help="CSV or XLSX manifest with the columns: " + ", ".join(INPUT_COLUMNS))
+    parser.add_argument('--output', required=True, help="Output file, " + "/".join(OUTPUT_FORMATS))
+    parser.add_argument('--store-dir', default=None, help="Tariff store directory (default: the app's store)")
+    parser.add_argument('--rules', default=None, help=f"Duty rules CSV (default: {RULES_PATH})")
+    parser.add_argument('--part-cache', action='store_true',
+                        help="Reuse and add to the part-level cache in the store directory, shared with the app")
+    args = parser.parse_args(argv)
+
+    if os.path.splitext(args.output)[1].lower() not in OUTPUT_FORMATS:
+        parser.error(f"--output must end in one of: {', '.join(OUTPUT_FORMATS)}")
+
+    try:
+        rules = load_rules(args.rules)
+        part_cache = PartCache(args.store_dir) if args.part_cache else None
+        if args.as_of_snapshots:
+            results, unparsed_rates = cost_manifest(args.manifest, None, None, rules, calculate=lambda batch:
+                                                    calculate_tariffs_as_of(batch, args.store_dir, rules, part_cache, write=False))
+        else:
+            merged_data = load_merged(args.schedules, args.store_dir)
+            tariff_index = build_tariff_index(merged_data)
+            prefix_index = build_prefix_index(tariff_index)
+            calculate = None
+            if part_cache is not None:
+                schedule_key = store_key(args.schedules)
+                calculate = lambda batch: calculate_tariffs_cached(batch, tariff_index, prefix_index, part_cache, schedule_key, rules, write=False)
+            results, unparsed_rates = cost_manifest(args.manifest, tariff_index, prefix_index, rules, calculate=calculate)
+        # New parts of every batch are written to the part cache at once
+        if part_cache is not None:
+            part_cache.flush()
+        write_results(results, args.output)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    for rate_error in unparsed_rates:
+        print(f"Warning: {rate_error}", file=sys.stderr)
+    print(f"Costed {len(results)} lines, Total Tariffs & Fees to be Paid (USD): "
+          f"{results['Tariffs & Fees to be Paid (USD)'].sum()}, written to {args.output}")
+    if part_cache is not None and part_cache.hits + part_cache.misses:
+        print(f"Part cache: {part_cache.hits} of {part_cache.hits + part_cache.misses} parts found "
+              f"({part_cache.hits / (part_cache.hits + part_cache.misses):.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
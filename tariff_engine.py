@@ -0,0 +1,373 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from cbp_fees import ENTRY_COLUMN, FEE_PARAMETER_COLUMNS, entry_fees, fee_parameters
+from duty_rates import duty_fraction, rate_components
+from duty_rules import SCHEDULE_COLUMNS, component_rules, default_rules, match_rules
+
+# -----------------------------------------------------------------------------
+# Tariff lookup and calculation logic shared by the Streamlit app.
+# Nothing in here imports streamlit, so it can be used and timed on its own.
+# -----------------------------------------------------------------------------
+
+# Fields returned by a tariff lookup, with the value used when the HTS code
+# (or the whole column) is not present in the merged schedule
+TARIFF_FIELDS = {
+    'General_Rate_of_Duty': '0%',
+    'China Duties': 0,
+    'Aluminum': 0,
+    'Steel': 0,
+    'ADD/CVD Flag': '',
+}
+
+# HTS levels tried when a code is not listed exactly: statistical suffix, tariff line,
+# subheading and heading
+HTS_LEVELS = (10, 8, 6, 4)
+
+# Sorted HTS codes of a tariff index and the row each one came from, see build_prefix_index
+PrefixIndex = namedtuple('PrefixIndex', ['codes', 'positions'])
+
+#==============================================================================================
+def build_tariff_index(merged_data):
+    # Build a lookup table with one row per HTS code, indexed by the code so that
+    # resolving a code is a hash probe instead of a scan of the whole column.
+    # The first row wins for duplicated codes, same as the old .iloc[0] lookup.
+    fields = list(TARIFF_FIELDS)
+    if merged_data is None or 'HTS_Code' not in merged_data.columns:
+        return pd.DataFrame(columns=fields, index=pd.Index([], name='HTS_Code'))
+
+    index = merged_data.drop_duplicates(subset='HTS_Code', keep='first').set_index('HTS_Code')
+
+    # ADD/CVD files only carry the 'ADD/CVD' label, use it as the flag when there is no flag column
+    if 'ADD/CVD Flag' not in index.columns and 'ADD/CVD' in index.columns:
+        index['ADD/CVD Flag'] = index['ADD/CVD']
+
+    index = index.reindex(columns=fields)
+    for field, default in TARIFF_FIELDS.items():
+        if field not in merged_data.columns and field != 'ADD/CVD Flag':
+            index[field] = default
+    index['ADD/CVD Flag'] = index['ADD/CVD Flag'].astype(object).fillna('')
+    return index
+#==============================================================================================
+def build_prefix_index(tariff_index):
+    # Sorted array of the listed HTS codes for binary search, positions maps each
+    # sorted code back to its row in tariff_index. Built once per merged dataset.
+    codes = np.asarray(tariff_index.index.astype(str), dtype=str)
+    order = np.argsort(codes, kind='stable')
+    return PrefixIndex(codes[order], order)
+#==============================================================================================
+def match_hts_levels(prefix_index, hts_codes):
+    # Every listed line each query code falls under, most specific first, with a binary search
+    # per level: the exact code, then its 10, 8, 6 and 4 digit prefixes. Returns one
+    # (row positions in tariff_index, -1 where not listed; digits matched) pair per level.
+    queries = np.asarray(pd.Series(hts_codes, dtype=object).fillna('').astype(str), dtype=str)
+    lengths = np.char.str_len(queries)
+    sorted_codes = prefix_index.codes
+    matches = []
+    for level in (None,) + HTS_LEVELS:
+        positions = np.full(len(queries), -1, dtype=np.int64)
+        if level is None:
+            todo = np.flatnonzero(lengths > 0)
+            candidates = queries[todo]
+        else:
+            todo = np.flatnonzero(lengths > level)
+            candidates = queries[todo].astype(f'<U{level}')
+        if len(todo) and len(sorted_codes):
+            slots = np.searchsorted(sorted_codes, candidates).clip(max=len(sorted_codes) - 1)
+            hit = sorted_codes[slots] == candidates
+            positions[todo[hit]] = prefix_index.positions[slots[hit]]
+        matches.append((positions, lengths if level is None else np.full(len(queries), level)))
+    return matches
+#==============================================================================================
+def resolve_hts_codes(prefix_index, hts_codes):
+    # Most specific listed line for every query code, see match_hts_levels.
+    # Returns (row positions in tariff_index, -1 when nothing matched; digits matched, 0 when nothing matched).
+    matches = match_hts_levels(prefix_index, hts_codes)
+    positions = np.full(len(matches[0][0]), -1, dtype=np.int64)
+    levels = np.zeros(len(positions), dtype=np.int64)
+    for level_positions, level_digits in matches:
+        todo = (positions < 0) & (level_positions >= 0)
+        positions[todo] = level_positions[todo]
+        levels[todo] = level_digits[todo]
+    return positions, levels
+#==============================================================================================
+def _present(values):
+    # Tariff field values that are listed, blanks and missing values are not
+    values = pd.Series(values, dtype=object)
+    return (values.notna() & (values.astype(str).str.strip() != '')).to_numpy()
+#==============================================================================================
+def _union_flags(flags, more_flags):
+    # 'ADD' and 'CVD/ADD' give 'ADD/CVD': labels of both, each once, in the order first seen
+    labels = [label for label in flags.split('/') if label]
+    return '/'.join(labels + [label for label in more_flags.split('/') if label and label not in labels])
+#==============================================================================================
+def lookup_tariffs(tariff_index, hts_codes, prefix_index=None):
+    # Return the tariff fields for a batch of HTS codes in one call.
+    # The result has one row per requested code, in the same order, indexed by the code.
+    # Without a prefix_index only exact codes match. With one, every listed heading and
+    # subheading a code falls under counts as well, field by field:
+    # - the rate fields come from the most specific level that lists them, so a line listed
+    #   only on a case list still gets the general rate of its heading
+    # - the ADD/CVD flag joins the flags of every level, so a case on the heading '7304'
+    #   flags 7304190000 even when the general schedule lists that line
+    # A code that matched but has no General Rate of Duty at any level gets NaN there, and
+    # resolve_components reports it. Codes that match nothing get the TARIFF_FIELDS defaults.
+    # 'HTS_Level' is the number of digits of the level the General Rate of Duty came from
+    # (the most specific match when none has one), 0 when the defaults were used.
+    codes = pd.Index(hts_codes, name='HTS_Code')
+    if prefix_index is None:
+        positions = tariff_index.index.get_indexer(codes) if len(tariff_index) else np.full(len(codes), -1)
+        matches = [(positions, np.asarray(codes.astype(str).str.len()))]
+    else:
+        matches = match_hts_levels(prefix_index, codes)
+    line_count = len(codes)
+    found = np.zeros(line_count, dtype=bool)
+    matched_levels = np.zeros(line_count, dtype=np.int64)
+    for positions, level_digits in matches:
+        first = ~found & (positions >= 0)
+        matched_levels[first] = level_digits[first]
+        found |= first
+
+    result = pd.DataFrame(index=codes)
+    levels = np.zeros(line_count, dtype=np.int64)
+    for field, default in TARIFF_FIELDS.items():
+        values = np.full(line_count, '' if field == 'ADD/CVD Flag' else None, dtype=object)
+        resolved = np.zeros(line_count, dtype=bool)
+        for positions, level_digits in matches:
+            if field == 'ADD/CVD Flag':
+                todo = np.flatnonzero(positions >= 0)
+            else:
+                todo = np.flatnonzero(~resolved & (positions >= 0))
+            if len(todo) == 0:
+                continue
+            level_values = tariff_index[field].iloc[positions[todo]].to_numpy(dtype=object)
+            listed = _present(level_values)
+            todo, level_values = todo[listed], level_values[listed]
+            if field == 'ADD/CVD Flag':
+                values[todo] = [_union_flags(flags, str(more)) for flags, more in zip(values[todo], level_values)]
+            else:
+                values[todo] = level_values
+                resolved[todo] = True
+                if field == 'General_Rate_of_Duty':
+                    levels[todo] = level_digits[todo]
+        if field == 'General_Rate_of_Duty':
+            values[found & ~resolved] = np.nan
+        elif field != 'ADD/CVD Flag':
+            values[found & ~resolved] = default
+        values[~found] = default
+        result[field] = values
+
+    result['HTS_Level'] = np.where(levels > 0, levels, matched_levels)
+    return result
+
+# -----------------------------------------------------------------------------
+# Batch tariff calculation
+# -----------------------------------------------------------------------------
+
+# Components of a line resolved once per HTS code, country, MOT and date (see resolve_components):
+# the General Rate of Duty as parsed (duty_rates.ParsedRate), a preference rate replacing it,
+# the China/Aluminum/Steel duties as fractions of value, and the fee parameters
+RATE_COMPONENT_COLUMNS = ['ad_valorem', 'per_kg', 'per_liter', 'per_unit']
+COMPONENT_COLUMNS = RATE_COMPONENT_COLUMNS + ['preference', 'china', 'aluminum', 'steel', 'ADD/CVD Flag',
+                                              'HTS Match Level', 'Rate Error'] + FEE_PARAMETER_COLUMNS
+
+# Columns of the data entry table
+INPUT_COLUMNS = ["SLB Part Number", "US HTS", "COO", "Value", "Weight", "MOT"]
+OUTCOME_COLUMNS = ["General Tariff Percentage", "COO China Tariff", "Aluminum Tariff", "Steel Tariff",
+                   "Potential ADD/CVD Flag", "CBP Merchandise Processing Fee", "CBP Harbor Maintenance Fee",
+                   "Tariffs & Fees to be Paid (%)", "Tariffs to be Paid (USD)", "Tariffs & Fees to be Paid (USD)"]
+
+# Optional entry columns: units for per-unit rates, the date that picks the duty rules in force,
+# and the customs entry a line belongs to for the MPF limits
+OPTIONAL_INPUT_COLUMNS = ["Quantity", "Entry Date", ENTRY_COLUMN]
+
+# Input columns that decide a line's outcome, used to recognise lines costed before
+ROW_KEY_COLUMNS = ["US HTS", "COO", "Value", "Weight", "MOT"]
+# Columns kept per line by calculate_tariffs_incremental, and how many lines it keeps
+CACHED_COLUMNS = OUTCOME_COLUMNS + ["HTS Match Level", "Rate Error"] + FEE_PARAMETER_COLUMNS
+ROW_CACHE_LIMIT = 100000
+
+#==============================================================================================
+def _numeric_column(values):
+    # Tariff columns may hold blanks or text, treat anything non-numeric as no duty
+    return pd.to_numeric(pd.Series(values), errors='coerce').fillna(0).to_numpy(dtype=float)
+#==============================================================================================
+def _ruled_duty(rules, schedule_values):
+    # Duty of one component per line: the schedule column, a fixed rule rate, or nothing
+    rule = rules['rule'].to_numpy(dtype=object)
+    rate = rules['rate'].fillna(0).to_numpy(dtype=float)
+    return np.select([rule == 'schedule', rule == 'additional'], [schedule_values, rate], 0.0)
+#==============================================================================================
+def add_fees(result):
+    # Fill the fee and total columns from 'Tariffs to be Paid (USD)' and the FEE_PARAMETER_COLUMNS.
+    # Runs over the whole frame at once since the MPF limits apply per entry, not per line.
+    has_code = (result['US HTS'].fillna('').astype(str) != '').to_numpy()
+    value = pd.to_numeric(result['Value'], errors='coerce').to_numpy(dtype=float)
+    duty_usd = pd.to_numeric(result['Tariffs to be Paid (USD)'], errors='coerce').to_numpy(dtype=float)
+    parameters = result[FEE_PARAMETER_COLUMNS].astype(float).where(pd.Series(has_code, index=result.index), axis=0)
+    mpf, hmf = entry_fees(value, parameters, result[ENTRY_COLUMN] if ENTRY_COLUMN in result.columns else None)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fees = {
+            'CBP Merchandise Processing Fee': mpf,
+            'CBP Harbor Maintenance Fee': hmf,
+            'Tariffs & Fees to be Paid (%)': (duty_usd + mpf + hmf) / value * 100,
+            'Tariffs & Fees to be Paid (USD)': duty_usd + mpf + hmf,
+        }
+    for column, values in fees.items():
+        result[column] = pd.Series(values, index=result.index).where(has_code)
+    return result
+#==============================================================================================
+def resolve_components(entries, tariff_index, prefix_index=None, rules=None):
+    # Everything about a line's duties and fees that does not depend on its value, weight or
+    # quantity, for a whole frame at once: one join against the tariff table, one join per
+    # HTS prefix length against the duty rules, and one parse per distinct rate string.
+    # Returns a frame of COMPONENT_COLUMNS with the index of entries, costed by apply_components.
+    # components.attrs['stage_seconds'] has the time spent in each step.
+    stage_seconds = {}
+    clock = time.perf_counter()
+    hts_codes = entries['US HTS'].fillna('').astype(str)
+    has_code = (hts_codes != '').to_numpy()
+    line_count = len(entries)
+
+    tariffs = lookup_tariffs(tariff_index, hts_codes, prefix_index)
+    stage_seconds['lookup'], clock = time.perf_counter() - clock, time.perf_counter()
+
+    matched = match_rules(rules if rules is not None else default_rules(), hts_codes, entries['COO'],
+                          entries['MOT'], entries['Entry Date'] if 'Entry Date' in entries.columns else None)
+    stage_seconds['rules'], clock = time.perf_counter() - clock, time.perf_counter()
+
+    # Listed codes without a General Rate of Duty at any level are left blank, not costed as Free
+    general_rates = tariffs['General_Rate_of_Duty'].to_numpy(dtype=object)
+    unrated = has_code & pd.isna(general_rates)
+    rates, rate_errors = rate_components(np.where(has_code & ~unrated, general_rates, ''))
+    rates[unrated] = np.nan
+    if unrated.any():
+        rate_errors = rate_errors.copy()
+        rate_errors[unrated] = [f"No General Rate of Duty is listed for HTS {code} or its headings"
+                                for code in hts_codes.to_numpy(dtype=object)[unrated]]
+
+    # A preference rule replaces the General Rate of Duty, and whatever was wrong with it
+    preference = component_rules(matched, 'general', line_count)['rate'].to_numpy(dtype=float)
+    rate_errors = np.where(np.isnan(preference), rate_errors, None)
+
+    components = pd.DataFrame(rates, columns=RATE_COMPONENT_COLUMNS, index=entries.index)
+    components['preference'] = preference
+    for component in ('china', 'aluminum', 'steel'):
+        components[component] = _ruled_duty(component_rules(matched, component, line_count),
+                                            _numeric_column(tariffs[SCHEDULE_COLUMNS[component]]))
+    components['ADD/CVD Flag'] = tariffs['ADD/CVD Flag'].to_numpy(dtype=object)
+    components['HTS Match Level'] = tariffs['HTS_Level'].to_numpy()
+    components['Rate Error'] = rate_errors
+    for column, values in fee_parameters(matched, line_count).items():
+        components[column] = values.to_numpy()
+    stage_seconds['components'] = time.perf_counter() - clock
+    components.attrs['stage_seconds'] = stage_seconds
+    return components
+#==============================================================================================
+def apply_components(entries, components):
+    # Cost every line from its components (from resolve_components, in the same row order):
+    # the value, weight and quantity dependent part of calculate_tariffs, then the fees and totals.
+    stage_seconds = {}
+    clock = time.perf_counter()
+    result = entries.copy()
+    has_code = (result['US HTS'].fillna('').astype(str) != '').to_numpy()
+    value = pd.to_numeric(result['Value'], errors='coerce').to_numpy(dtype=float)
+    weight = pd.to_numeric(result['Weight'], errors='coerce').to_numpy(dtype=float)
+    quantity = pd.to_numeric(result['Quantity'], errors='coerce').to_numpy(dtype=float) if 'Quantity' in result.columns else 1
+
+    general = duty_fraction(components[RATE_COMPONENT_COLUMNS].to_numpy(dtype=float), value, weight, quantity)
+    preference = components['preference'].to_numpy(dtype=float)
+    general = np.where(np.isnan(preference), general, preference)
+    china, aluminum, steel = (components[component].to_numpy(dtype=float) for component in ('china', 'aluminum', 'steel'))
+    duty = general + china + aluminum + steel
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        outcomes = {
+            'General Tariff Percentage': general * 10000,
+            'COO China Tariff': china * 100,
+            'Aluminum Tariff': aluminum,
+            'Steel Tariff': steel,
+            'Potential ADD/CVD Flag': components['ADD/CVD Flag'].to_numpy(dtype=object),
+            'HTS Match Level': components['HTS Match Level'].to_numpy(),
+            'Rate Error': components['Rate Error'].to_numpy(dtype=object),
+            'Tariffs to be Paid (USD)': duty * value,
+        }
+    for column, values in outcomes.items():
+        result[column] = pd.Series(values, index=result.index).where(has_code)
+    for column in FEE_PARAMETER_COLUMNS:
+        result[column] = components[column].to_numpy(dtype=float)
+    stage_seconds['rates'], clock = time.perf_counter() - clock, time.perf_counter()
+
+    # MPF per entry, HMF per line, then the totals
+    add_fees(result)
+    stage_seconds['fees'] = time.perf_counter() - clock
+    result.attrs['unparsed_rates'] = sorted(set(result['Rate Error'].dropna()))
+    result.attrs['stage_seconds'] = stage_seconds
+    return result
+#==============================================================================================
+def calculate_tariffs(entries, tariff_index, prefix_index=None, rules=None):
+    # Compute every outcome column for a frame of data entry lines in one pass.
+    # entries has the INPUT_COLUMNS with 'US HTS' already cleaned, tariff_index comes from
+    # build_tariff_index. Lines without an HTS code are left blank, like the editor did.
+    # Which duties and fees apply to a line comes from the duty rules (see duty_rules.py),
+    # rules defaults to the bundled table and lines are dated by 'Entry Date' when present.
+    # The MPF limits apply per 'Entry Number' when that column is present (see cbp_fees.py).
+    # With a prefix_index, codes fall back to their listed heading/subheading and
+    # 'HTS Match Level' says how many digits matched.
+    # Rates that cannot be parsed leave their lines blank, with the reason in 'Rate Error',
+    # and are listed in result.attrs['unparsed_rates'] instead of being costed as zero.
+    # result.attrs['stage_seconds'] has the time spent in each step, for the diagnostics panel.
+    components = resolve_components(entries, tariff_index, prefix_index, rules)
+    result = apply_components(entries, components)
+    result.attrs['stage_seconds'] = {**components.attrs['stage_seconds'], **result.attrs['stage_seconds']}
+    return result
+#==============================================================================================
+def row_keys(entries):
+    # One hash per line over the columns that decide its outcome, computed for the whole frame at once
+    # The entry number only changes the fees, which are recomputed for the whole frame every time
+    columns = ROW_KEY_COLUMNS + [column for column in OPTIONAL_INPUT_COLUMNS
+                                 if column in entries.columns and column != ENTRY_COLUMN]
+    return pd.util.hash_pandas_object(entries[columns], index=False).to_numpy()
+#==============================================================================================
+def calculate_tariffs_incremental(entries, tariff_index, prefix_index=None, row_cache=None, rules=None, calculate=None):
+    # Same result as calculate_tariffs, but lines whose ROW_KEY_COLUMNS were costed before
+    # are taken from row_cache and only new or edited lines go through lookup and rate
+    # evaluation. Fees are recomputed for the whole frame since they depend on the other
+    # lines of an entry. row_cache is the frame returned by the previous call (None to start),
+    # the caller has to drop it when the schedules or rules change. Returns (result, row_cache).
+    # calculate(lines) replaces calculate_tariffs for the new lines, e.g. to use the part cache.
+    if calculate is None:
+        calculate = lambda lines: calculate_tariffs(lines, tariff_index, prefix_index, rules)
+    keys = row_keys(entries)
+    if row_cache is None:
+        row_cache = pd.DataFrame(columns=CACHED_COLUMNS, index=pd.Index([], dtype=np.uint64))
+
+    known = np.isin(keys, row_cache.index.to_numpy())
+    stage_seconds = {}
+    if not known.all():
+        fresh = calculate(entries[~known])
+        stage_seconds = dict(fresh.attrs['stage_seconds'])
+        fresh = fresh[CACHED_COLUMNS]
+        fresh.index = pd.Index(keys[~known], dtype=np.uint64)
+        fresh = fresh[~fresh.index.duplicated()]
+        row_cache = pd.concat([row_cache, fresh]) if len(row_cache) else fresh
+
+    # Keep the cache bounded, lines that are no longer in the table are dropped first
+    if len(row_cache) > ROW_CACHE_LIMIT:
+        row_cache = row_cache[row_cache.index.isin(keys)]
+
+    outcomes = row_cache.reindex(keys)
+    result = entries.copy()
+    for column in CACHED_COLUMNS:
+        result[column] = outcomes[column].to_numpy()
+    clock = time.perf_counter()
+    add_fees(result)
+    stage_seconds['fees'] = time.perf_counter() - clock
+    result.attrs['unparsed_rates'] = sorted(set(result['Rate Error'].dropna()))
+    result.attrs['stage_seconds'] = stage_seconds
+    result.attrs['cached_lines'] = int(known.sum())
+    return result, row_cache
@@ -0,0 +1,82 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from duty_rates import rate_components
+
+# -----------------------------------------------------------------------------
+# Server-side search over the merged tariff data for the Data Description tab.
+# build_explorer sorts the HTS codes and classifies every row's General Rate of
+# Duty once per dataset, along with the summary counts. A search is then a
+# binary search for the HTS prefix plus two mask lookups, and only the rows of
+# the page being shown are taken out of the merged data.
+# Nothing in here imports streamlit.
+# -----------------------------------------------------------------------------
+
+# Kinds of General Rate of Duty, see rate_types
+RATE_TYPES = ['Free', 'Ad valorem', 'Specific', 'Compound', 'Unparsed', 'Blank']
+
+# Label used for rows without an ADD/CVD case
+NO_LABEL = '(none)'
+
+# Duty columns counted in the summary when the merged data has them
+DUTY_COLUMNS = ['China Duties', 'Aluminum', 'Steel']
+
+# codes: HTS codes in sorted order, order: the row of each sorted code,
+# labels/types: ADD/CVD label and rate type per row, summary: counts computed once
+Explorer = namedtuple('Explorer', ['codes', 'order', 'labels', 'types', 'summary'])
+
+#==============================================================================================
+def rate_types(rates):
+    # Kind of every General Rate of Duty: free, ad valorem only, specific (per kg/liter/unit) only,
+    # compound (both), one that could not be parsed, or blank. Each distinct rate is parsed once.
+    rates = pd.Series(rates, dtype=object)
+    text = rates.fillna('').astype(str).str.strip()
+    components, errors = rate_components(rates.where(text != '', ''))
+    ad_valorem = np.nan_to_num(components[:, 0]) > 0
+    specific = np.nan_to_num(components[:, 1:]).sum(axis=1) > 0
+    kinds = np.select(
+        [(text == '').to_numpy(), pd.notna(errors), ad_valorem & specific, specific, ad_valorem],
+        ['Blank', 'Unparsed', 'Compound', 'Specific', 'Ad valorem'], 'Free')
+    return pd.Categorical(kinds, categories=RATE_TYPES)
+#==============================================================================================
+def build_explorer(merged_data):
+    # Search structures and summary of a merged dataset, built once per dataset
+    codes = merged_data['HTS_Code'].fillna('').astype(str).to_numpy(dtype=str) if 'HTS_Code' in merged_data else np.array([], dtype=str)
+    order = np.argsort(codes, kind='stable')
+    if 'ADD/CVD' in merged_data:
+        labels = merged_data['ADD/CVD'].fillna('').astype(str).str.strip().replace('', NO_LABEL)
+    else:
+        labels = pd.Series(NO_LABEL, index=merged_data.index)
+    labels = pd.Categorical(labels)
+    types = rate_types(merged_data['General_Rate_of_Duty'] if 'General_Rate_of_Duty' in merged_data else [''] * len(merged_data))
+
+    summary = {
+        'rows': len(merged_data),
+        'codes': len(np.unique(codes)),
+        'labels': pd.Series(labels).value_counts().rename_axis('ADD/CVD').reset_index(name='rows'),
+        'types': pd.Series(types).value_counts(sort=False).rename_axis('Rate type').reset_index(name='rows'),
+        'duties': {column: int((pd.to_numeric(merged_data[column], errors='coerce') > 0).sum())
+                   for column in DUTY_COLUMNS if column in merged_data},
+    }
+    return Explorer(codes[order], order, labels, types, summary)
+#==============================================================================================
+def search(explorer, hts_prefix='', labels=None, types=None):
+    # Row positions of the merged data matching every given filter, in HTS code order.
+    # hts_prefix matches the start of the code (dots and spaces are ignored), labels and types
+    # are lists of ADD/CVD labels and RATE_TYPES, None or empty for any.
+    prefix = ''.join(character for character in str(hts_prefix) if character.isalnum())
+    start = np.searchsorted(explorer.codes, prefix, side='left')
+    end = np.searchsorted(explorer.codes, prefix + '￿', side='left') if prefix else len(explorer.codes)
+    positions = explorer.order[start:end]
+    if labels:
+        positions = positions[np.asarray(explorer.labels.isin(labels))[positions]]
+    if types:
+        positions = positions[np.asarray(explorer.types.isin(types))[positions]]
+    return positions
+#==============================================================================================
+def page_rows(data, positions, page, page_size):
+    # Rows of one page (numbered from 1) of the positions found by search
+    start = (page - 1) * page_size
+    return data.iloc[positions[start:start + page_size]]
@@ -0,0 +1,117 @@
+from functools import lru_cache
+from io import BytesIO
+
+import pandas as pd
+
+from tariff_engine import INPUT_COLUMNS, OUTCOME_COLUMNS
+from tariff_store import arrow_safe_frame
+
+# -----------------------------------------------------------------------------
+# Export of costed lines, shared by the Streamlit app and the command line.
+# openpyxl is only imported by the first Excel export, not with this module.
+# -----------------------------------------------------------------------------
+
+# Export formats by file extension: (label, MIME type). Excel gets the total row,
+# CSV and Parquet hold the lines only, for large results and further processing.
+EXPORT_FORMATS = {
+    '.xlsx': ('Excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    '.csv': ('CSV', 'text/csv'),
+    '.parquet': ('Parquet', 'application/vnd.apache.parquet'),
+}
+
+# Rows converted to cell values at a time while streaming a sheet
+EXCEL_CHUNK_ROWS = 10000
+
+#==============================================================================================
+@lru_cache(maxsize=1)
+def excel_styles():
+    # Same header look as pandas' ExcelWriter, and the bold red total row, created once
+    from openpyxl.styles import Alignment, Border, Font, Side
+    thin = Side(style='thin')
+    return {
+        'header_font': Font(bold=True),
+        'header_border': Border(left=thin, right=thin, top=thin, bottom=thin),
+        'header_alignment': Alignment(horizontal='center', vertical='top'),
+        'total_font': Font(bold=True, color="FF0000"),
+    }
+#==============================================================================================
+def add_total_row(df):
+    # Define the order of the columns as they should appear in the exported file
+    column_order = INPUT_COLUMNS + OUTCOME_COLUMNS
+
+    # Ensure df columns are in the correct order
+    df = df[column_order]
+
+    # Calculate the total tariffs
+    Total_Tariffs = df['Tariffs & Fees to be Paid (USD)'].sum()
+
+    # Add the Total_Tariffs as the last row
+    total_row_data = [None]*(len(column_order)-1) + [Total_Tariffs]
+    total_row_df = pd.DataFrame([total_row_data], columns=column_order)
+    return pd.concat([df, total_row_df], ignore_index=True)
+#==============================================================================================
+def _styled_cell(worksheet, value, font, border=None, alignment=None):
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(worksheet, value=value)
+    cell.font = font
+    if border is not None:
+        cell.border = border
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+#==============================================================================================
+# Function to convert DataFrame to Excel
+def to_excel(df, total_row=True):
+    # Stream the DataFrame into an .xlsx with openpyxl's write-only mode: rows go straight to
+    # the file instead of being kept as cell objects and read back for styling.
+    import openpyxl
+    styles = excel_styles()
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    worksheet.append([_styled_cell(worksheet, str(column), styles['header_font'], styles['header_border'], styles['header_alignment'])
+                      for column in df.columns])
+
+    # The last row is the total row from add_total_row, its font is set as it is written
+    last_row = len(df) - 1 if total_row else -1
+    for start in range(0, len(df), EXCEL_CHUNK_ROWS):
+        # Blanks are written as empty cells, like ExcelWriter did
+        chunk = df.iloc[start:start + EXCEL_CHUNK_ROWS].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        for position, row in enumerate(chunk.itertuples(index=False, name=None), start):
+            if position == last_row:
+                row = [_styled_cell(worksheet, value, styles['total_font']) for value in row]
+            worksheet.append(row)
+
+    output = BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+#==============================================================================================
+def to_csv(df):
+    return df.to_csv(index=False).encode('utf-8')
+#==============================================================================================
+def to_parquet(df):
+    output = BytesIO()
+    arrow_safe_frame(df).to_parquet(output, index=False)
+    return output.getvalue()
+#==============================================================================================
+def export_results(results, extension):
+    # File contents for costed lines in one of the EXPORT_FORMATS
+    if extension == '.xlsx':
+        return to_excel(add_total_row(results))
+    results = results[INPUT_COLUMNS + OUTCOME_COLUMNS]
+    if extension == '.csv':
+        return to_csv(results)
+    if extension == '.parquet':
+        return to_parquet(results)
+    raise ValueError(f"Unsupported output format '{extension}', use one of: {', '.join(EXPORT_FORMATS)}")
+#==============================================================================================
+def export_table(df, extension):
+    # File contents for any other table in one of the EXPORT_FORMATS, e.g. a scenario comparison:
+    # the columns as they are and no total row
+    if extension == '.xlsx':
+        return to_excel(df, total_row=False)
+    if extension == '.csv':
+        return to_csv(df)
+    if extension == '.parquet':
+        return to_parquet(df)
+    raise ValueError(f"Unsupported output format '{extension}', use one of: {', '.join(EXPORT_FORMATS)}")
@@ -0,0 +1,482 @@
+import multiprocessing
+import os
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+
+import pandas as pd
+
+from tariff_engine import INPUT_COLUMNS, OPTIONAL_INPUT_COLUMNS, add_fees, calculate_tariffs
+
+# -----------------------------------------------------------------------------
+# Reading the uploaded tariff schedules (ADD/CVD case lists, China/Aluminum/Steel
+# specific duty sheets and the general rate of duty export) into frames keyed on
+# HTS_Code, and reading and costing shipment manifests batch by batch (iter_manifest,
+# cost_manifest). Nothing in here imports streamlit, the app wraps these in its caches.
+# openpyxl is imported when the first .xlsx file is opened, not with this module.
+# -----------------------------------------------------------------------------
+
+# A parsed upload: kind is 'addcvd', 'specific_duty' or 'rate_of_duty', data is the
+# processed frame for that kind of schedule and stats reports rows and memory use
+Workbook = namedtuple('Workbook', ['name', 'kind', 'sheet_names', 'data', 'stats'])
+
+# HTS codes are kept as Arrow backed strings, compact and cheap to compare in merges and lookups
+HTS_CODE_DTYPE = 'string[pyarrow]'
+
+# Rows buffered as Python tuples before they are turned into a frame while streaming
+STREAM_CHUNK_ROWS = 50000
+
+# Columns kept from a general rate of duty export, everything else is dropped while reading
+HTS_COLUMNS = ['HTS', 'HTS Number', 'HSCODE']
+RATE_OF_DUTY_COLUMNS = ['General Rate of Duty', 'China Duties', 'Aluminum', 'Steel', 'China', 'ADD/CVD Flag', 'Description']
+
+# Schedule column each specific duty sheet fills in the merged data, keyed on the sheet name
+SPECIFIC_DUTY_COLUMNS = {'China': 'China Duties', 'Aluminum': 'Aluminum', 'Steel': 'Steel'}
+
+# Added to a general export column that a specific duty sheet also fills while merging
+GENERAL_SUFFIX = ' (general)'
+
+# Columns joined into the display-only 'Tariff' text of the merged data
+TARIFF_DESCRIPTION_COLUMNS = ['General_Rate_of_Duty', 'Steel', 'Aluminum', 'China Duties']
+
+# Text columns of the merged data with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_SHARE = 0.5
+
+# How load_workbooks starts its worker processes. Forking the app server copies locks
+# held by its other threads (Streamlit, background jobs) and can hang a worker, so
+# workers start from a fresh interpreter instead.
+POOL_START_METHOD = 'spawn'
+
+# Manifest lines read per batch, a manifest has the same columns as the data entry table
+MANIFEST_CHUNK_ROWS = 5000
+
+
+# Raised by load_workbooks when its cancel event is set
+class IngestCancelled(Exception):
+    pass
+
+
+def normalize_hts_codes(codes):
+    # Clean a column of HTS codes, numeric, text and mixed columns in one pass.
+    # - dots and whitespace are removed ('8481.80.00' -> '84818000')
+    # - numbers read from Excel get back the digits float formatting dropped:
+    #   the heading is left padded to 4 digits and the decimals right padded to
+    #   whole pairs (8481.8 -> '848180', 101.21 -> '010121'), and a trailing '.0'
+    #   on whole numbers is ignored (84818000.0 -> '84818000')
+    # - undotted codes with an odd number of digits lost their leading zero
+    #   (1012100 -> '01012100', 848180100 -> '0848180100')
+    # Codes keep their level, so 4 and 6 digit headings stay 4 and 6 digits long.
+    # Blanks come back as missing. The result uses HTS_CODE_DTYPE.
+    codes = pd.Series(codes)
+    text = codes.astype(str).str.strip()
+    missing = codes.isna() | text.isin(['', 'nan', 'None', '<NA>'])
+
+    parts = text.str.extract(r'^(?P<head>\d+)(?:\.(?P<tail>[\d.]*))?$')
+    head = parts['head']
+    tail = parts['tail'].fillna('').str.replace('.', '', regex=False)
+    numeric = parts['head'].notna()
+
+    # A dot after more than 4 digits is float formatting of a whole number
+    float_artifact = (head.str.len() > 4) & tail.str.fullmatch(r'0*')
+    tail = tail.where(~float_artifact, '')
+    dotted = tail != ''
+
+    head = head.where(~dotted, head.str.zfill(4))
+    tail = tail.where(tail.str.len() % 2 == 0, tail + '0')
+    normalized = head + tail
+    odd = ~dotted & (normalized.str.len() % 2 == 1)
+    normalized = normalized.where(~odd, '0' + normalized)
+
+    # Anything that is not a number only loses its dots and whitespace, so it is still visible
+    normalized = normalized.where(numeric, text.str.replace(r'[.\s]', '', regex=True))
+    return normalized.mask(missing).astype(HTS_CODE_DTYPE)
+#==============================================================================================
+def process_sheet(df, label):
+    df = df[df['HSCODE'].notna()].copy()
+    df['ADD/CVD'] = label
+    df['HSCODE'] = normalize_hts_codes(df['HSCODE'])
+    df = df.rename(columns={'HSCODE': 'HTS_Code'})[['HTS_Code', 'ADD/CVD']]
+    return df
+#==============================================================================================
+def combine_data(sheets):
+    # Stack the ADD and CVD sheets of a case list workbook, sheets maps sheet name to frame
+    combined_data = []
+
+    for sheet, df in sheets.items():
+        if 'ADD' in sheet:
+            combined_data.append(process_sheet(df, 'ADD'))
+        elif 'CVD' in sheet:
+            combined_data.append(process_sheet(df, 'CVD'))
+
+    return pd.concat(combined_data, ignore_index=True)
+#==============================================================================================
+def find_hts_column(df):
+    possible_columns = ['HTS', 'HTS Number', 'HSCODE']
+    for col in possible_columns:
+        if col in df.columns:
+            return col
+    raise ValueError("HTS column not found in the dataframe.")
+#==============================================================================================
+def process_rate_of_duty(df):
+    hts_col_name = find_hts_column(df)
+    df[hts_col_name] = normalize_hts_codes(df[hts_col_name])
+    df = df[df[hts_col_name].notna()]
+    df = df.rename(columns={hts_col_name: 'HTS_Code', 'General Rate of Duty': 'General_Rate_of_Duty'})
+    return df
+#==============================================================================================
+def process_specific_duty(df, column_name):
+    # This function processes the specific duty rates for China, Aluminum, or Steel.
+    # The rates go to that sheet's own schedule column (SPECIFIC_DUTY_COLUMNS), e.g. the
+    # China sheet fills 'China Duties', so the three schedules never overwrite each other.
+    duty_column = SPECIFIC_DUTY_COLUMNS[column_name]
+    df['HTS'] = normalize_hts_codes(df['HTS'])
+    df = df[df['HTS'].notna()].copy()
+    df = df.rename(columns={'HTS': 'HTS_Code', column_name: duty_column})[['HTS_Code', duty_column]]
+    df[duty_column] = df[duty_column].fillna(0)  # Assuming empty cells mean 0%
+    return df
+#==============================================================================================
+def specific_duty_sheet(sheet_names):
+    # The China, Aluminum or Steel sheet of a specific duty workbook, None for other workbooks
+    return next((sheet for sheet in sheet_names if sheet in SPECIFIC_DUTY_COLUMNS), None)
+#==============================================================================================
+def classify_workbook(sheet_names):
+    # Tell which kind of schedule a workbook is from its sheet names
+    is_specific_duty = specific_duty_sheet(sheet_names) is not None
+    is_addcvd = any(['ADD' in sheet for sheet in sheet_names]) or any(['CVD' in sheet for sheet in sheet_names])
+    if is_addcvd:
+        return 'addcvd'
+    elif is_specific_duty:
+        return 'specific_duty'
+    return 'rate_of_duty'
+#==============================================================================================
+def merge_frames(addcvd_dataframes, specific_duty_dataframes, rate_of_duty_dataframes):
+    # Initialize merged_data as an empty DataFrame or the first non-empty DataFrame
+    merged_data = pd.DataFrame()
+
+    # Merge all dataframes of each type, outer joins so a code listed in any one schedule is kept
+    if addcvd_dataframes:
+        combined_addcvd = pd.concat(addcvd_dataframes, ignore_index=True)
+        merged_data = combined_addcvd
+
+    if specific_duty_dataframes:
+        combined_specific_duty = merge_specific_duties(specific_duty_dataframes)
+        if not merged_data.empty:
+            merged_data = pd.merge(merged_data, combined_specific_duty, on='HTS_Code', how='outer', sort=False)
+        else:
+            merged_data = combined_specific_duty
+
+    if rate_of_duty_dataframes:
+        combined_rate_of_duty = pd.concat(rate_of_duty_dataframes, ignore_index=True)
+        if not merged_data.empty:
+            merged_data = pd.merge(merged_data, combined_rate_of_duty, on='HTS_Code', how='outer', sort=False, suffixes=('', GENERAL_SUFFIX))
+            # A schedule column the general export also carries: the specific duty sheet wins,
+            # the general export fills the codes that sheet does not list
+            for column in SPECIFIC_DUTY_COLUMNS.values():
+                if column + GENERAL_SUFFIX in merged_data.columns:
+                    merged_data[column] = merged_data[column].fillna(merged_data.pop(column + GENERAL_SUFFIX))
+        else:
+            merged_data = combined_rate_of_duty
+
+    return merged_data
+#==============================================================================================
+def merge_specific_duties(specific_duty_dataframes):
+    # One row per HTS code with a column per specific duty schedule. Sheets of the same
+    # schedule are stacked (the first listing of a code wins), the schedules are then
+    # joined side by side so a code can carry a China, an Aluminum and a Steel duty at once.
+    by_column = {}
+    for df in specific_duty_dataframes:
+        column = next(name for name in df.columns if name != 'HTS_Code')
+        by_column.setdefault(column, []).append(df)
+
+    combined = None
+    for column, frames in by_column.items():
+        schedule = pd.concat(frames, ignore_index=True).drop_duplicates(subset='HTS_Code', keep='first')
+        combined = schedule if combined is None else pd.merge(combined, schedule, on='HTS_Code', how='outer', sort=False)
+    return combined
+#==============================================================================================
+def _file_name(file):
+    return getattr(file, 'name', None) or os.path.basename(str(file))
+#==============================================================================================
+def _is_xlsx(file):
+    # .xlsx files are zip archives, old .xls files have to go through pandas
+    if hasattr(file, 'seek'):
+        file.seek(0)
+        signature = file.read(2)
+        file.seek(0)
+    else:
+        with open(file, 'rb') as handle:
+            signature = handle.read(2)
+    return signature == b'PK'
+#==============================================================================================
+def check_cancelled(cancel):
+    # cancel is an optional threading.Event, raise IngestCancelled once it is set
+    if cancel is not None and cancel.is_set():
+        raise IngestCancelled("Cancelled while reading the schedules")
+#==============================================================================================
+def iter_sheet_chunks(worksheet, columns, chunk_rows=STREAM_CHUNK_ROWS, cancel=None):
+    # Read a read-only worksheet row by row, keeping only the named columns, and yield
+    # (frame, rows read so far) every chunk_rows rows so the whole sheet never exists
+    # as Python objects at once. The first frame is yielded even when the sheet is empty.
+    # cancel is checked between chunks, see check_cancelled.
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None) or ()
+    header = ['' if name is None else str(name).strip() for name in header]
+    keep = [position for position, name in enumerate(header) if name in columns]
+    names = [header[position] for position in keep]
+
+    buffer = []
+    rows_read = 1
+    yielded = False
+    for row in rows:
+        rows_read += 1
+        values = tuple(row[position] if position < len(row) else None for position in keep)
+        if all(value is None for value in values):
+            continue
+        buffer.append(values)
+        if len(buffer) >= chunk_rows:
+            yield pd.DataFrame(buffer, columns=names), rows_read
+            buffer = []
+            yielded = True
+            check_cancelled(cancel)
+    if buffer or not yielded:
+        yield pd.DataFrame(buffer, columns=names), rows_read
+#==============================================================================================
+def stream_sheet(worksheet, columns, cancel=None):
+    return pd.concat([chunk for chunk, _ in iter_sheet_chunks(worksheet, columns, cancel=cancel)], ignore_index=True)
+#==============================================================================================
+def _read_sheets(file, cancel=None):
+    # Return (handle, sheet_names, read) where read(sheet, columns) gives the projected frame of a sheet.
+    # .xlsx files are streamed through openpyxl in read-only mode, .xls files use pandas.
+    if _is_xlsx(file):
+        import openpyxl
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
+        return workbook, workbook.sheetnames, lambda sheet, columns: stream_sheet(workbook[sheet], columns, cancel)
+    excel = pd.ExcelFile(file)
+    return excel, excel.sheet_names, lambda sheet, columns: _parse_sheet(excel, sheet, columns)
+#==============================================================================================
+def _parse_sheet(excel, sheet, columns):
+    # Projected frame of a sheet of a pandas ExcelFile, header names stripped as stream_sheet does
+    data = excel.parse(sheet, usecols=lambda name: str(name).strip() in columns)
+    data.columns = [str(column).strip() for column in data.columns]
+    return data
+#==============================================================================================
+def load_workbook(file, cancel=None):
+    # Open the workbook once, classify it and read only the sheets and columns it needs
+    # from that one handle. Memory and time are reported per file in Workbook.stats, the
+    # parse peak only when tracemalloc is tracing (see the diagnostics panel).
+    # cancel stops streamed .xlsx sheets between chunks, see iter_sheet_chunks.
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+    handle, sheet_names, read = _read_sheets(file, cancel)
+    try:
+        kind = classify_workbook(sheet_names)
+        classified = time.perf_counter()
+
+        if kind == 'addcvd':
+            sheets = {sheet: read(sheet, ['HSCODE']) for sheet in sheet_names if 'ADD' in sheet or 'CVD' in sheet}
+            data = combine_data(sheets)
+        elif kind == 'specific_duty':
+            sheet = specific_duty_sheet(sheet_names)
+            data = process_specific_duty(read(sheet, ['HTS', sheet]), sheet)
+        else:
+            data = process_rate_of_duty(read(sheet_names[0], HTS_COLUMNS + RATE_OF_DUTY_COLUMNS))
+    finally:
+        handle.close()
+
+    stats = {
+        'rows': len(data),
+        'open_seconds': classified - start,
+        'parse_seconds': time.perf_counter() - classified,
+        'frame_mb': memory_mb(data),
+        'peak_parse_mb': tracemalloc.get_traced_memory()[1] / 1e6 if tracing else None,
+    }
+    return Workbook(_file_name(file), kind, sheet_names, data, stats)
+#==============================================================================================
+def describe_tariffs(merged_data):
+    # Combine values from General_Rate_of_Duty, Steel, Aluminum, and China columns into the
+    # display-only 'Tariff' text, e.g. "5% + 0.25", skipping columns that are missing or blank
+    combined = pd.Series('', index=merged_data.index, dtype=object)
+    for column in TARIFF_DESCRIPTION_COLUMNS:
+        if column not in merged_data.columns:
+            continue
+        text = merged_data[column].astype(str)
+        present = merged_data[column].notna() & (text != '') & (text != 'nan')
+        combined = combined + (' + ' + text).where(present, '')
+    return combined.str[len(' + '):]
+#==============================================================================================
+def memory_mb(obj):
+    # Memory held by the frames in obj (a frame, or nested lists/tuples/dicts of them), in MB
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return float(obj.memory_usage(deep=True).sum()) / 1e6
+    if isinstance(obj, dict):
+        return sum(memory_mb(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(memory_mb(value) for value in obj)
+    return 0.0
+#==============================================================================================
+def merge_workbooks(workbooks):
+    frames = {'addcvd': [], 'specific_duty': [], 'rate_of_duty': []}
+    for workbook in workbooks:
+        frames[workbook.kind].append(workbook.data)
+    merged_data = merge_frames(frames['addcvd'], frames['specific_duty'], frames['rate_of_duty'])
+    if not merged_data.empty:
+        merged_data['Tariff'] = describe_tariffs(merged_data)
+    return compact_merged_data(merged_data)
+#==============================================================================================
+def compact_merged_data(merged_data):
+    # Reduce the merged table to one row per HTS code with compact column types:
+    # - codes listed in several ADD/CVD sheets get all their labels joined ('ADD/CVD'),
+    #   every other column keeps the first row, as the lookup always did
+    # - repetitive text columns (labels, rate strings) become categoricals
+    # - float columns stay float64, they are duty rates that get costed
+    if merged_data.empty or 'HTS_Code' not in merged_data.columns:
+        return merged_data
+
+    compact = merged_data.drop_duplicates(subset='HTS_Code', keep='first').reset_index(drop=True)
+    if 'ADD/CVD' in merged_data.columns:
+        labels = (merged_data.dropna(subset=['ADD/CVD'])
+                  .drop_duplicates(subset=['HTS_Code', 'ADD/CVD'])
+                  .groupby('HTS_Code', sort=False)['ADD/CVD'].agg('/'.join))
+        compact['ADD/CVD'] = compact['HTS_Code'].map(labels)
+
+    for column in compact.columns:
+        if column == 'HTS_Code':
+            continue
+        values = compact[column]
+        if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            # Mixed numbers and text (e.g. 0.25 next to '25%') are kept as text
+            if pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty'):
+                values = values.map(lambda v: v if pd.isna(v) else str(v))
+            if values.nunique(dropna=True) <= CATEGORY_MAX_SHARE * len(values):
+                values = values.astype('category')
+            compact[column] = values
+    return compact
+#==============================================================================================
+def _load_workbook_job(name, source):
+    # Runs in a worker process. Uploads arrive as bytes since file objects do not pickle.
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+        source.name = name
+    return load_workbook(source)
+#==============================================================================================
+def load_workbooks(files, max_workers=None, cancel=None, on_progress=None):
+    # Parse several workbooks at once in a process pool, Excel parsing is CPU bound.
+    # Returns (workbooks in upload order, {file name: error message}) so one bad
+    # workbook is reported without holding up the others.
+    # cancel is an optional threading.Event, setting it drops the files not parsed yet
+    # and raises IngestCancelled. on_progress(done, total, name) is called per file.
+    names = [_file_name(file) for file in files]
+    results = [None] * len(files)
+    errors = {}
+
+    def finish(position, load):
+        try:
+            results[position] = load()
+        except IngestCancelled:
+            raise
+        except Exception as e:
+            errors[names[position]] = f"{type(e).__name__}: {e}"
+        if on_progress:
+            on_progress(len(errors) + sum(result is not None for result in results), len(files), names[position])
+
+    # A single workbook is not worth starting a pool for, it is read here and checks cancel itself
+    if len(files) <= 1:
+        for position, file in enumerate(files):
+            check_cancelled(cancel)
+            finish(position, lambda: load_workbook(file, cancel))
+        check_cancelled(cancel)
+        return [result for result in results if result is not None], errors
+
+    jobs = [(name, file if isinstance(file, (str, os.PathLike)) else file.getvalue()) for name, file in zip(names, files)]
+    executor = ProcessPoolExecutor(max_workers=min(len(files), max_workers or os.cpu_count() or 1),
+                                   mp_context=multiprocessing.get_context(POOL_START_METHOD))
+    try:
+        futures = {executor.submit(_load_workbook_job, name, source): position for position, (name, source) in enumerate(jobs)}
+        pending = set(futures)
+        while pending:
+            if cancel is not None and cancel.is_set():
+                raise IngestCancelled(f"Cancelled with {len(pending)} of {len(files)} workbook(s) still being parsed")
+            done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(futures[future], future.result)
+    finally:
+        # Also reached when the caller is interrupted, drop whatever has not started yet
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    check_cancelled(cancel)
+    return [result for result in results if result is not None], errors
+#==============================================================================================
+def merge_all_data(uploaded_files):
+    # Parses the files in parallel, but refuses to merge if any of them could not be read
+    workbooks, errors = load_workbooks(uploaded_files)
+    if errors:
+        raise ValueError("; ".join(f"{name}: {error}" for name, error in errors.items()))
+    return merge_workbooks(workbooks)
+#==============================================================================================
+def _check_manifest_columns(columns):
+    missing = [column for column in INPUT_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"Manifest is missing the column(s): {', '.join(missing)}")
+#==============================================================================================
+def _manifest_columns(columns):
+    # Input columns plus whichever optional ones (Quantity, Entry Date) the manifest has
+    return INPUT_COLUMNS + [column for column in OPTIONAL_INPUT_COLUMNS if column in columns]
+#==============================================================================================
+def iter_manifest(file, chunk_rows=MANIFEST_CHUNK_ROWS):
+    # Read a CSV or XLSX shipment manifest in batches, yielding (frame of the manifest columns,
+    # fraction of the file read) so callers can cost each batch and show progress.
+    if _is_xlsx(file):
+        import openpyxl
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
+        try:
+            worksheet = workbook.worksheets[0]
+            total_rows = worksheet.max_row or 0
+            for chunk, rows_read in iter_sheet_chunks(worksheet, INPUT_COLUMNS + OPTIONAL_INPUT_COLUMNS, chunk_rows):
+                _check_manifest_columns(chunk.columns)
+                yield chunk[_manifest_columns(chunk.columns)], min(rows_read / total_rows, 1.0) if total_rows else 1.0
+        finally:
+            workbook.close()
+        return
+
+    handle = file if hasattr(file, 'read') else open(file, 'rb')
+    try:
+        handle.seek(0, os.SEEK_END)
+        size = handle.tell()
+        handle.seek(0)
+        # Keep codes and part numbers as text so leading zeros survive
+        reader = pd.read_csv(handle, chunksize=chunk_rows, dtype={'US HTS': str, 'SLB Part Number': str})
+        for chunk in reader:
+            chunk.columns = [str(column).strip() for column in chunk.columns]
+            _check_manifest_columns(chunk.columns)
+            yield chunk[_manifest_columns(chunk.columns)].reset_index(drop=True), min(handle.tell() / size, 1.0) if size else 1.0
+    finally:
+        if handle is not file:
+            handle.close()
+#==============================================================================================
+def cost_manifest(manifest, tariff_index, prefix_index, rules=None, on_progress=None, cancel=None, calculate=None):
+    # Cost a manifest file batch by batch, returns (costed lines, unparsed rate messages).
+    # on_progress(fraction of the file read, lines costed) is called per batch, cancel is an
+    # optional threading.Event, setting it raises IngestCancelled before the next batch.
+    # calculate(batch) replaces calculate_tariffs against tariff_index, e.g. to cost as of a date.
+    if calculate is None:
+        calculate = lambda batch: calculate_tariffs(batch, tariff_index, prefix_index, rules)
+    results = []
+    unparsed_rates = set()
+    lines = 0
+    for chunk, done in iter_manifest(manifest):
+        if cancel is not None and cancel.is_set():
+            raise IngestCancelled(f"Cancelled after {lines} manifest lines")
+        chunk['US HTS'] = normalize_hts_codes(chunk['US HTS']).fillna('')
+        result = calculate(chunk)
+        unparsed_rates.update(result.attrs.get('unparsed_rates', []))
+        results.append(result)
+        lines += len(result)
+        if on_progress:
+            on_progress(done, lines)
+    # Entries can span batches, their MPF limits apply to all of their lines
+    return add_fees(pd.concat(results, ignore_index=True)), sorted(unparsed_rates)
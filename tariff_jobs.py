@@ -0,0 +1,132 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from tariff_ingest import cost_manifest, load_workbooks, merge_workbooks
+from tariff_part_cache import calculate_tariffs_cached
+from tariff_snapshots import calculate_tariffs_as_of
+from tariff_store import load_merged
+
+# -----------------------------------------------------------------------------
+# Background jobs for long ingestion and costing runs.
+# A JobRunner runs functions on a small thread pool. Each function gets its Job
+# as first argument to report progress and to notice cancellation, and the Job
+# keeps the status, result or error for the page to pick up on a later rerun.
+# Threads rather than processes: workbook parsing already fans out to worker
+# processes inside load_workbooks, and results have to stay in this process to be
+# shared between sessions. Nothing in here imports streamlit.
+# -----------------------------------------------------------------------------
+
+JOB_WORKERS = 4
+
+# Job.status values once a job has stopped
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+#==============================================================================================
+class Job:
+    def __init__(self, name, key=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.key = key  # What the job was started for, e.g. the content hash of the uploaded schedules
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def report(self, progress, message=''):
+        # Called from the job function, progress is a fraction between 0 and 1
+        self.progress = min(max(float(progress), 0.0), 1.0)
+        self.message = message
+
+    def cancel(self):
+        # Ask the job to stop. A job still queued is dropped, a running one stops at its next check.
+        self.cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.status = 'cancelled'
+            self.finished = time.time()
+#==============================================================================================
+class JobRunner:
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tariff-job')
+
+    def submit(self, name, function, args=(), key=None):
+        # Run function(job, *args) in the background and return the Job right away
+        job = Job(name, key)
+        job.future = self.executor.submit(self._run, job, function, args)
+        return job
+
+    def _run(self, job, function, args):
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            job.result = function(job, *args)
+            job.progress = 1.0
+            job.status = 'done'
+        except Exception as e:
+            # Whatever a cancelled job raised on its way out is not an error
+            if job.cancel_event.is_set():
+                job.status = 'cancelled'
+                job.message = 'Cancelled'
+            else:
+                job.status = 'failed'
+                job.error = f"{type(e).__name__}: {e}"
+        finally:
+            job.finished = time.time()
+#==============================================================================================
+def named_copy(file):
+    # In-memory copy of an uploaded file for a job, so the job never shares a read position
+    # with the page and keeps working after the upload widget changes
+    copy = BytesIO(file.getvalue())
+    copy.name = file.name
+    return copy
+#==============================================================================================
+def read_schedules(job, files):
+    # Job: parse the schedule workbooks, then merge them into the on-disk store so the page
+    # only memory-maps the merged table. Returns (workbooks, {file name: error}) like load_workbooks.
+    steps = len(files) + 1
+
+    def on_progress(done, total, name):
+        job.report(done / steps, f"Read {name} ({done} of {total})")
+
+    workbooks, errors = load_workbooks(files, cancel=job.cancel_event, on_progress=on_progress)
+    if not errors:
+        job.report(len(files) / steps, "Merging schedules...")
+        load_merged(files, build=lambda: merge_workbooks(workbooks))
+    return workbooks, errors
+#==============================================================================================
+def cost_manifest_job(job, manifest, tariff_index, prefix_index, as_of=False, part_cache=None, schedule_key=None):
+    # Job: cost a manifest batch by batch, returns (costed lines, unparsed rate messages).
+    # With as_of every line is costed against the tariff snapshot in force on its Entry Date.
+    # With a part_cache, components are looked up there first, schedule_key names the schedules.
+    def on_progress(done, lines):
+        job.report(done, f"Costed {lines:,} lines")
+
+    # New parts are written to the part cache once for the whole manifest, not per batch
+    calculate = None
+    if as_of:
+        calculate = lambda batch: calculate_tariffs_as_of(batch, part_cache=part_cache, write=False)
+    elif part_cache is not None:
+        calculate = lambda batch: calculate_tariffs_cached(batch, tariff_index, prefix_index, part_cache, schedule_key, write=False)
+    try:
+        return cost_manifest(manifest, tariff_index, prefix_index, on_progress=on_progress, cancel=job.cancel_event,
+                             calculate=calculate)
+    finally:
+        if part_cache is not None:
+            part_cache.flush()
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# Stage timings and cache counters for the diagnostics panel.
+# A StageLog keeps one record per timed stage (wall time, traced peak memory when
+# tracemalloc is on, and any extra fields such as row counts) for the last
+# STAGE_LOG_LIMIT stages, and exports them as JSON lines. counted_cache wraps a Streamlit
+# cache decorator to count calls and misses per function for the whole process.
+# Nothing in here imports streamlit.
+# -----------------------------------------------------------------------------
+
+# Records kept per StageLog, the oldest are dropped first
+STAGE_LOG_LIMIT = 1000
+
+# {function name: {'calls': n, 'misses': n}} for every counted_cache function in this process
+CACHE_COUNTS = defaultdict(lambda: {'calls': 0, 'misses': 0})
+
+# Whether the last counted_cache call made by this thread ran the function body
+_last_call = threading.local()
+
+#==============================================================================================
+class StageLog:
+    def __init__(self, limit=STAGE_LOG_LIMIT):
+        self.records = deque(maxlen=limit)
+        self.run = 0
+
+    def new_run(self):
+        # Called once per script run so records can be grouped by run
+        self.run += 1
+
+    def add(self, stage, seconds, peak_mb=None, **fields):
+        self.records.append({'run': self.run, 'time': datetime.now().isoformat(timespec='milliseconds'),
+                             'stage': stage, 'seconds': seconds, 'peak_mb': peak_mb, **fields})
+
+    @contextmanager
+    def stage(self, name, **fields):
+        # Time the block and record it; the block may add fields to the yielded dict.
+        # Memory is the traced peak above the start of the block, only while tracemalloc is on.
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            start_mb = tracemalloc.get_traced_memory()[0] / 1e6
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            seconds = time.perf_counter() - start
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6 - start_mb if tracing else None
+            self.add(name, seconds, peak_mb, **fields)
+
+    def frame(self, run=None):
+        # Records as a frame, only those of one run when run is given
+        records = [record for record in self.records if run is None or record['run'] == run]
+        return pd.DataFrame(records)
+
+    def summary(self):
+        # Count, total, mean and max time and max peak per stage over all kept records
+        records = self.frame()
+        if records.empty:
+            return records
+        return (records.groupby('stage', sort=False)
+                .agg(count=('seconds', 'size'), total_seconds=('seconds', 'sum'), mean_seconds=('seconds', 'mean'),
+                     max_seconds=('seconds', 'max'), max_peak_mb=('peak_mb', 'max'))
+                .reset_index())
+
+    def to_jsonl(self):
+        return '\n'.join(json.dumps(record, default=str) for record in self.records) + '\n'
+#==============================================================================================
+def counted_cache(cache_decorator, **options):
+    # Use as @counted_cache(st.cache_resource) instead of @st.cache_resource to count the calls
+    # of a cached function and how many of them missed the cache and ran its body
+    def decorate(function):
+        name = function.__name__
+
+        @wraps(function)
+        def run_body(*args, **kwargs):
+            CACHE_COUNTS[name]['misses'] += 1
+            try:
+                return function(*args, **kwargs)
+            finally:
+                # Set after the body, which may itself call other counted functions
+                _last_call.missed = True
+
+        cached = cache_decorator(**options)(run_body) if options else cache_decorator(run_body)
+
+        @wraps(function)
+        def call(*args, **kwargs):
+            CACHE_COUNTS[name]['calls'] += 1
+            _last_call.missed = False
+            return cached(*args, **kwargs)
+
+        call.clear = getattr(cached, 'clear', None)
+        return call
+    return decorate
+#==============================================================================================
+def last_call_missed():
+    # True when the last counted_cache call of this thread was a cache miss
+    return getattr(_last_call, 'missed', False)
+#==============================================================================================
+def cache_counts():
+    # Calls, hits, misses and hit rate per counted function
+    rows = [{'function': name, 'calls': counts['calls'], 'hits': counts['calls'] - counts['misses'],
+             'misses': counts['misses'], 'hit_rate': (counts['calls'] - counts['misses']) / counts['calls'] if counts['calls'] else None}
+            for name, counts in list(CACHE_COUNTS.items())]
+    return pd.DataFrame(rows, columns=['function', 'calls', 'hits', 'misses', 'hit_rate'])
@@ -0,0 +1,214 @@
+import glob
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from duty_rules import RULE_COLUMNS, default_rules, rule_periods
+from tariff_engine import COMPONENT_COLUMNS, apply_components, resolve_components
+from tariff_metrics import CACHE_COUNTS
+from tariff_store import STORE_DIR, arrow_safe_frame
+
+# -----------------------------------------------------------------------------
+# Persistent part-level cache of resolved duty components.
+# What a line pays per unit of value, weight and quantity only depends on its HTS
+# code, country of origin, MOT, the duty rules in force on its date and the schedule
+# version, so those components (see tariff_engine.resolve_components) are kept per
+# line key and reused by every session, process and restart. Costing a line found in
+# the cache is plain arithmetic on its value, weight and quantity
+# (tariff_engine.apply_components).
+#
+# There is one uncompressed Arrow file per namespace, the schedule version (the
+# content hash used by the tariff store) and a hash of the duty rules, so a different
+# upload or rules file never sees another one's entries. A process keeps the files
+# it uses in memory and reads them again when another process has rewritten them.
+# Each put rewrites the whole file, so callers costing a manifest batch by batch add
+# entries with write=False and call flush once at the end.
+# Within a file the least recently used entries are dropped beyond PART_CACHE_LIMIT,
+# only the PART_CACHE_FILES most recently written files are kept, and all of them are
+# removed when a new tariff snapshot is saved (see tariff_snapshots.py).
+# Two processes adding entries at the same moment may drop each other's additions,
+# which only costs those entries being resolved again.
+# -----------------------------------------------------------------------------
+
+PART_CACHE_DIR = 'part_cache'
+
+# Entries kept per namespace, and namespaces kept on disk
+PART_CACHE_LIMIT = 500000
+PART_CACHE_FILES = 16
+
+# Bumped whenever COMPONENT_COLUMNS or the way they are resolved change, so older files are not reused
+PART_CACHE_FORMAT = 2
+
+#==============================================================================================
+def _normalized(values):
+    # Countries and MOTs as the duty rules compare them, without case or surrounding spaces
+    return pd.Series(values, dtype=object).fillna('').astype(str).str.strip().str.casefold().to_numpy(dtype=object)
+#==============================================================================================
+def cache_namespace(schedule_key, rules):
+    # Entries of one schedule version costed under one rules table
+    digest = hashlib.sha256(pd.util.hash_pandas_object(rules[RULE_COLUMNS], index=False).to_numpy().tobytes())
+    return f"{PART_CACHE_FORMAT}-{schedule_key}-{digest.hexdigest()[:16]}"
+#==============================================================================================
+def part_keys(entries, rules):
+    # One hash per line over its HTS code, country and MOT as the rules compare them, and the
+    # period of rule dates its Entry Date falls in, so lines with the same key cost the same per unit
+    entry_dates = entries['Entry Date'] if 'Entry Date' in entries.columns else [None] * len(entries)
+    keys = pd.DataFrame({
+        'hts': entries['US HTS'].fillna('').astype(str).to_numpy(dtype=object),
+        'country': _normalized(entries['COO']),
+        'mot': _normalized(entries['MOT']),
+        'period': rule_periods(rules, entry_dates),
+    })
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+#==============================================================================================
+class PartCache:
+    def __init__(self, store_dir=None, limit=PART_CACHE_LIMIT, files=PART_CACHE_FILES):
+        self.directory = os.path.join(store_dir or STORE_DIR, PART_CACHE_DIR)
+        self.limit = limit
+        self.files = files
+        self.hits = 0
+        self.misses = 0
+        self._tables = {}  # {namespace: (file modification time, entries indexed by key)}
+        self._unwritten = {}  # {namespace: entries added since its file was last written}
+        self._lock = threading.Lock()
+
+    def _path(self, namespace):
+        return os.path.join(self.directory, f"{namespace}.arrow")
+
+    def _table(self, namespace):
+        # Entries of a namespace, read again when the file changed since it was read
+        path = self._path(namespace)
+        modified = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        loaded = self._tables.get(namespace)
+        if loaded is None or loaded[0] != modified:
+            if modified is None:
+                table = pd.DataFrame(columns=COMPONENT_COLUMNS + ['last_used'], index=pd.Index([], dtype=np.uint64, name='key'))
+            else:
+                table = feather.read_table(path, memory_map=True).to_pandas().set_index('key')
+            if namespace in self._unwritten:
+                table = self._added(table, self._unwritten[namespace])
+            self._tables[namespace] = (modified, table)
+        return self._tables[namespace][1]
+
+    def get(self, namespace, keys):
+        # Components of keys (distinct uint64 line keys) with a NaN row for each key not cached,
+        # and a mask of those missing keys. Found entries are marked as used now.
+        with self._lock:
+            table = self._table(namespace)
+            positions = table.index.get_indexer(keys)
+            missing = positions < 0
+            last_used = table['last_used'].to_numpy(dtype=float, copy=True)
+            last_used[positions[~missing]] = time.time()
+            table['last_used'] = last_used
+            components = table[COMPONENT_COLUMNS].reindex(pd.Index(keys, dtype=np.uint64, name='key'))
+        self.record(int((~missing).sum()), int(missing.sum()))
+        return components, missing
+
+    def _added(self, table, fresh):
+        # table with the entries of fresh added or replaced, the least recently used dropped beyond the limit
+        table = pd.concat([table[~table.index.isin(fresh.index)], fresh]) if len(table) else fresh
+        if len(table) > self.limit:
+            table = table.iloc[np.argsort(table['last_used'].to_numpy(dtype=float), kind='stable')[-self.limit:]]
+        return table
+
+    def put(self, namespace, keys, components, write=True):
+        # Add the components of keys (same row order) and write the namespace file. With write=False
+        # they are only kept in memory until flush, so several calls cost a single write.
+        fresh = components[COMPONENT_COLUMNS].copy()
+        fresh.index = pd.Index(keys, dtype=np.uint64, name='key')
+        fresh['last_used'] = time.time()
+        with self._lock:
+            table = self._table(namespace)
+            self._tables[namespace] = (self._tables[namespace][0], self._added(table, fresh))
+            unwritten = self._unwritten.get(namespace)
+            self._unwritten[namespace] = fresh if unwritten is None else self._added(unwritten, fresh)
+            if write:
+                self._write(namespace)
+
+    def flush(self):
+        # Write every namespace with entries added by put(..., write=False)
+        with self._lock:
+            for namespace in list(self._unwritten):
+                self._write(namespace)
+
+    def _write(self, namespace):
+        # Read again first when another process has written the file since, then written next to
+        # the target and renamed so a concurrent reader never sees a partial file
+        table = self._table(namespace)
+        path = self._path(namespace)
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        arrow_table = pa.Table.from_pandas(arrow_safe_frame(table.reset_index()), preserve_index=False)
+        feather.write_feather(arrow_table, temp_path, compression='uncompressed')
+        os.replace(temp_path, path)
+        self._tables[namespace] = (os.stat(path).st_mtime_ns, table)
+        self._unwritten.pop(namespace, None)
+        self._drop_old_files()
+
+    def _drop_old_files(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.arrow')), key=os.path.getmtime)
+        for path in paths[:max(len(paths) - self.files, 0)]:
+            os.remove(path)
+            self._tables.pop(os.path.basename(path)[:-len('.arrow')], None)
+            self._unwritten.pop(os.path.basename(path)[:-len('.arrow')], None)
+
+    def record(self, hits, misses):
+        # Key lookups of this cache, and of the whole process for the diagnostics panel
+        self.hits += hits
+        self.misses += misses
+        CACHE_COUNTS['part_cache']['calls'] += hits + misses
+        CACHE_COUNTS['part_cache']['misses'] += misses
+
+    def invalidate(self):
+        # Remove every entry, e.g. when new schedules come into force
+        with self._lock:
+            for path in glob.glob(os.path.join(self.directory, '*.arrow')):
+                os.remove(path)
+            self._tables.clear()
+            self._unwritten.clear()
+
+    def stats(self):
+        # Entries and size on disk, and the hit rate of this cache
+        paths = glob.glob(os.path.join(self.directory, '*.arrow'))
+        lookups = self.hits + self.misses
+        return {
+            'versions': len(paths),
+            'entries': sum(feather.read_table(path, memory_map=True).num_rows for path in paths),
+            'file_mb': sum(os.path.getsize(path) for path in paths) / 1e6,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+        }
+#==============================================================================================
+def calculate_tariffs_cached(entries, tariff_index, prefix_index, part_cache, schedule_key, rules=None, write=True):
+    # Same result as calculate_tariffs, with the components of every distinct line key taken from
+    # part_cache when it has them. Only keys it does not have go through lookup and rule matching,
+    # once each, and are added to it. schedule_key identifies the schedules tariff_index was built
+    # from, e.g. tariff_store.store_key of the uploaded files. With write=False the new keys are only
+    # written by part_cache.flush, see PartCache.put.
+    rules = rules if rules is not None else default_rules()
+    namespace = cache_namespace(schedule_key, rules)
+    clock = time.perf_counter()
+    keys, first_lines, line_keys = np.unique(part_keys(entries, rules), return_index=True, return_inverse=True)
+    components, missing = part_cache.get(namespace, keys)
+    stage_seconds = {'part_cache': time.perf_counter() - clock}
+
+    if missing.any():
+        # One line per missing key stands for all of its lines
+        fresh = resolve_components(entries.iloc[first_lines[missing]], tariff_index, prefix_index, rules)
+        stage_seconds.update(fresh.attrs['stage_seconds'])
+        part_cache.put(namespace, keys[missing], fresh, write)
+        fresh.index = components.index[missing]
+        components = pd.concat([components[~missing], fresh[COMPONENT_COLUMNS]]).reindex(components.index) \
+            if (~missing).any() else fresh[COMPONENT_COLUMNS]
+
+    result = apply_components(entries, components.iloc[line_keys.ravel()])
+    result.attrs['stage_seconds'] = {**stage_seconds, **result.attrs['stage_seconds']}
+    result.attrs['cached_parts'] = int((~missing).sum())
+    return result
@@ -0,0 +1,265 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from cbp_fees import ENTRY_COLUMN, FEE_PARAMETER_COLUMNS, entry_fees, entry_groups
+from duty_rates import duty_fraction
+from duty_rules import RULES_PATH, default_rules, load_rules
+from tariff_engine import INPUT_COLUMNS, RATE_COMPONENT_COLUMNS, build_prefix_index, build_tariff_index, resolve_components
+from tariff_export import EXPORT_FORMATS, export_table
+from tariff_ingest import iter_manifest, normalize_hts_codes
+from tariff_part_cache import part_keys
+from tariff_store import load_merged
+
+# -----------------------------------------------------------------------------
+# Scenario sweeps: what a manifest would pay under a grid of what-if variations,
+# the alternative countries of origin and MOTs it could be sourced with, value
+# bands (multiples of the declared value) and hypothetical China/Aluminum/Steel
+# duty rates, in every combination.
+# Only the country and MOT change which duties and fees a line resolves to, so the
+# components (see tariff_engine.resolve_components) are resolved once per distinct
+# line and sourcing option. Every scenario is then arithmetic on those components,
+# evaluated for blocks of scenarios at once as (scenarios x lines) arrays.
+# A hypothetical rate replaces that duty on the lines that pay it (a non-zero
+# component), other lines stay as they are.
+#
+#   python tariff_scenarios.py --schedules general.xlsx china_301.xlsx addcvd.xlsx \
+#       --manifest parts.csv --coo Vietnam Mexico --mot OCEAN AIR --value-factors 0.9 1.1 \
+#       --china 0.5 --output scenarios.xlsx --cheapest cheapest.csv
+# -----------------------------------------------------------------------------
+
+# Country or MOT of a scenario that keeps each line's own
+AS_ENTERED = '(as entered)'
+
+# Hypothetical rate column of each duty component, NaN keeps the resolved duty
+RATE_COLUMNS = {'china': 'China Rate', 'aluminum': 'Aluminum Rate', 'steel': 'Steel Rate'}
+
+SOURCING_COLUMNS = ['COO', 'MOT']
+SCENARIO_COLUMNS = SOURCING_COLUMNS + ['Value Factor'] + list(RATE_COLUMNS.values())
+
+# Totals per scenario, see sweep_tariffs
+SUMMARY_COLUMNS = ['Lines', 'Unpriced Lines', 'Value (USD)', 'Tariffs to be Paid (USD)', 'CBP Fees (USD)',
+                   'Tariffs & Fees to be Paid (USD)', 'Change (USD)']
+
+# Scenarios a grid may have, and scenario x line cells evaluated at a time
+SCENARIO_LIMIT = 1000
+SWEEP_BLOCK_CELLS = 2000000
+
+# scenarios: the grid with the SUMMARY_COLUMNS, parts: one row per part with its lines as entered,
+# totals: Tariffs & Fees to be Paid (USD) per scenario and part, NaN where a line could not be priced
+Sweep = namedtuple('Sweep', ['scenarios', 'parts', 'totals'])
+
+#==============================================================================================
+def _options(values, default):
+    # default first, then the given alternatives without repeats
+    return list(dict.fromkeys([default] + [value for value in (values or []) if value is not None]))
+#==============================================================================================
+def scenario_grid(coo=None, mot=None, value_factors=None, china=None, aluminum=None, steel=None):
+    # Every combination of the given alternatives, each axis starting with the lines as entered:
+    # AS_ENTERED country and MOT, value factor 1 and the resolved duty rates (NaN).
+    # Rates are fractions of value (0.25 for 25%). The first row is the manifest as entered.
+    axes = [_options(coo, AS_ENTERED), _options(mot, AS_ENTERED), _options(value_factors, 1.0)]
+    axes += [_options(rates, np.nan) for rates in (china, aluminum, steel)]
+    grid = pd.DataFrame(list(itertools.product(*axes)), columns=SCENARIO_COLUMNS)
+    if len(grid) > SCENARIO_LIMIT:
+        raise ValueError(f"The grid has {len(grid):,} scenarios, at most {SCENARIO_LIMIT:,} are evaluated at once")
+    grid[SCENARIO_COLUMNS[2:]] = grid[SCENARIO_COLUMNS[2:]].astype(float)
+    grid.insert(0, 'Scenario', np.arange(1, len(grid) + 1))
+    return grid
+#==============================================================================================
+def _part_ids(entries):
+    # One id per 'SLB Part Number', lines without one are parts of their own
+    return entry_groups(entries['SLB Part Number'].fillna('').astype(str).str.strip(), len(entries))
+#==============================================================================================
+def _resolve_sourcing(entries, sourcing, tariff_index, prefix_index, rules):
+    # Components of every line under every sourcing option, as (options, lines) blocks.
+    # Each distinct HTS code, country, MOT and rule period is resolved once.
+    line_count = len(entries)
+    expanded = entries.iloc[np.tile(np.arange(line_count), len(sourcing))].reset_index(drop=True)
+    for column in SOURCING_COLUMNS:
+        chosen = np.repeat(sourcing[column].to_numpy(dtype=object), line_count)
+        expanded[column] = np.where(chosen == AS_ENTERED, expanded[column].to_numpy(dtype=object), chosen)
+    _, first_lines, line_keys = np.unique(part_keys(expanded, rules), return_index=True, return_inverse=True)
+    components = resolve_components(expanded.iloc[first_lines], tariff_index, prefix_index, rules)
+    components = components.iloc[line_keys.ravel()]
+    shape = (len(sourcing), line_count)
+    return {
+        'rates': components[RATE_COMPONENT_COLUMNS].to_numpy(dtype=float).reshape(shape + (len(RATE_COMPONENT_COLUMNS),)),
+        'preference': components['preference'].to_numpy(dtype=float).reshape(shape),
+        'fees': components[FEE_PARAMETER_COLUMNS].to_numpy(dtype=float).reshape(shape + (len(FEE_PARAMETER_COLUMNS),)),
+        **{component: components[component].to_numpy(dtype=float).reshape(shape) for component in RATE_COLUMNS},
+    }
+#==============================================================================================
+def sweep_tariffs(entries, tariff_index, prefix_index=None, grid=None, rules=None):
+    # Cost entries (INPUT_COLUMNS with 'US HTS' cleaned, optional Quantity, Entry Date and Entry
+    # Number as for calculate_tariffs) under every scenario of grid (from scenario_grid, the lines
+    # as entered by default). Each scenario applies to every line, and the MPF limits apply per
+    # entry within a scenario. Returns a Sweep, 'Change (USD)' is against the first scenario.
+    # sweep.scenarios.attrs['stage_seconds'] has the time spent resolving and evaluating.
+    grid = grid if grid is not None else scenario_grid()
+    rules = rules if rules is not None else default_rules()
+    entries = entries.reset_index(drop=True)
+    line_count = len(entries)
+    clock = time.perf_counter()
+
+    sourcing = grid[SOURCING_COLUMNS].drop_duplicates(ignore_index=True)
+    sourcing_ids = pd.MultiIndex.from_frame(sourcing).get_indexer(pd.MultiIndex.from_frame(grid[SOURCING_COLUMNS]))
+    resolved = _resolve_sourcing(entries, sourcing, tariff_index, prefix_index, rules)
+    stage_seconds = {'resolve': time.perf_counter() - clock}
+    clock = time.perf_counter()
+
+    has_code = (entries['US HTS'].fillna('').astype(str) != '').to_numpy()
+    value = pd.to_numeric(entries['Value'], errors='coerce').to_numpy(dtype=float)
+    weight = pd.to_numeric(entries['Weight'], errors='coerce').to_numpy(dtype=float)
+    quantity = pd.to_numeric(entries['Quantity'], errors='coerce').to_numpy(dtype=float) \
+        if 'Quantity' in entries.columns else np.ones(line_count)
+    groups = entry_groups(entries[ENTRY_COLUMN] if ENTRY_COLUMN in entries.columns else None, line_count)
+    group_count = groups.max() + 1 if line_count else 0
+    part_ids = _part_ids(entries)
+    part_count = part_ids.max() + 1 if line_count else 0
+
+    factors = grid['Value Factor'].to_numpy(dtype=float)
+    hypothetical = {component: grid[column].to_numpy(dtype=float) for component, column in RATE_COLUMNS.items()}
+    summary = np.zeros((len(grid), 5))
+    totals = np.full((len(grid), part_count), np.nan)
+
+    block_size = max(1, SWEEP_BLOCK_CELLS // max(line_count, 1))
+    for start in range(0, len(grid), block_size):
+        block = np.arange(start, min(start + block_size, len(grid)))
+        options = sourcing_ids[block]
+        shape = (len(block), line_count)
+        block_value = factors[block][:, None] * value
+
+        # Duty as a fraction of value, the same arithmetic as tariff_engine.apply_components
+        general = duty_fraction(resolved['rates'][options].reshape(-1, len(RATE_COMPONENT_COLUMNS)), block_value.ravel(),
+                                np.broadcast_to(weight, shape).ravel(), np.broadcast_to(quantity, shape).ravel()).reshape(shape)
+        preference = resolved['preference'][options]
+        duty = np.where(np.isnan(preference), general, preference)
+        for component, rates in hypothetical.items():
+            component_duty = resolved[component][options]
+            rate = rates[block][:, None]
+            duty = duty + np.where(np.isnan(rate) | (component_duty == 0), component_duty, rate)
+        tariffs = np.where(has_code, duty * block_value, np.nan)
+
+        # Each scenario's entries are entries of their own for the MPF limits
+        parameters = np.where(has_code[:, None], resolved['fees'][options], np.nan).reshape(-1, len(FEE_PARAMETER_COLUMNS))
+        mpf, hmf = entry_fees(block_value.ravel(), pd.DataFrame(parameters, columns=FEE_PARAMETER_COLUMNS),
+                              groups=(groups + np.arange(len(block))[:, None] * group_count).ravel())
+        fees = np.where(has_code, (mpf + hmf).reshape(shape), np.nan)
+        total = tariffs + fees
+
+        priced = np.isfinite(total)
+        unpriced = has_code & ~priced
+        summary[block] = np.column_stack([priced.sum(axis=1), unpriced.sum(axis=1),
+                                          np.where(has_code, block_value, 0).sum(axis=1),
+                                          np.nansum(tariffs, axis=1), np.nansum(fees, axis=1)])
+
+        # A part is only priced under a scenario when all of its lines with a code are
+        cells = (part_ids + np.arange(len(block))[:, None] * part_count).ravel()
+        part_totals = np.bincount(cells, weights=np.where(priced, total, 0).ravel(), minlength=len(block) * part_count)
+        part_priced = np.bincount(cells, weights=priced.ravel(), minlength=len(block) * part_count)
+        part_unpriced = np.bincount(cells, weights=unpriced.ravel(), minlength=len(block) * part_count)
+        totals[block] = np.where((part_priced > 0) & (part_unpriced == 0), part_totals, np.nan).reshape(len(block), part_count)
+    stage_seconds['evaluate'] = time.perf_counter() - clock
+
+    scenarios = grid.reset_index(drop=True).copy()
+    for position, column in enumerate(SUMMARY_COLUMNS[:5]):
+        scenarios[column] = summary[:, position]
+    scenarios[['Lines', 'Unpriced Lines']] = scenarios[['Lines', 'Unpriced Lines']].astype(int)
+    scenarios['Tariffs & Fees to be Paid (USD)'] = scenarios['Tariffs to be Paid (USD)'] + scenarios['CBP Fees (USD)']
+    scenarios['Change (USD)'] = scenarios['Tariffs & Fees to be Paid (USD)'] - scenarios['Tariffs & Fees to be Paid (USD)'].iloc[0]
+    scenarios.attrs['stage_seconds'] = stage_seconds
+
+    # The first line of each part stands for it, with the number of lines and their value
+    first_lines = np.unique(part_ids, return_index=True)[1]
+    parts = entries.iloc[first_lines][['SLB Part Number', 'US HTS', 'COO', 'MOT']].reset_index(drop=True)
+    parts['Lines'] = np.bincount(part_ids, minlength=part_count)
+    parts['Value (USD)'] = np.bincount(part_ids, weights=np.nan_to_num(value), minlength=part_count)
+    return Sweep(scenarios, parts, totals)
+#==============================================================================================
+def cheapest_options(sweep):
+    # Cheapest country and MOT per part for every value factor and set of hypothetical rates in
+    # the grid, next to what the part pays as entered under the same value factor and rates.
+    # Parts that could not be priced under any option have no cheapest option.
+    scenarios = sweep.scenarios
+    others = SCENARIO_COLUMNS[2:]
+    cases = scenarios.groupby(others, dropna=False, sort=False).ngroup().to_numpy()
+    as_entered = ((scenarios['COO'] == AS_ENTERED) & (scenarios['MOT'] == AS_ENTERED)).to_numpy()
+    part_count = len(sweep.parts)
+    columns = np.arange(part_count)
+
+    results = []
+    for case in np.unique(cases):
+        rows = np.flatnonzero(cases == case)
+        totals = sweep.totals[rows]
+        best = np.argmin(np.where(np.isnan(totals), np.inf, totals), axis=0)
+        best_total = totals[best, columns]
+        found = ~np.isnan(best_total)
+        chosen = scenarios.iloc[rows[best]].reset_index(drop=True)
+        entered_rows = rows[as_entered[rows]]
+        entered = sweep.totals[entered_rows[0]] if len(entered_rows) else np.full(part_count, np.nan)
+
+        result = sweep.parts.copy()
+        for column in others:
+            result[column] = scenarios[column].iloc[rows[0]]
+        for column in SOURCING_COLUMNS:
+            # An option keeping the part's own country or MOT names it
+            option = chosen[column].where(chosen[column] != AS_ENTERED, sweep.parts[column])
+            result[f"Cheapest {column}"] = option.where(found, '')
+        result['Cheapest Scenario'] = chosen['Scenario'].where(found)
+        result['Cheapest (USD)'] = best_total
+        result['As Entered (USD)'] = entered
+        result['Savings (USD)'] = entered - best_total
+        results.append(result)
+    return pd.concat(results, ignore_index=True)
+#==============================================================================================
+def _write_table(table, path):
+    with open(path, 'wb') as handle:
+        handle.write(export_table(table, os.path.splitext(path)[1].lower()))
+#==============================================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cost a manifest under a grid of what-if scenarios.")
+    parser.add_argument('--schedules', nargs='+', required=True, help="Schedule workbooks, in the same order they are uploaded in the app")
+    parser.add_argument('--manifest', required=True, help="CSV or XLSX manifest with the columns: " + ", ".join(INPUT_COLUMNS))
+    parser.add_argument('--coo', nargs='*', default=[], help="Alternative countries of origin")
+    parser.add_argument('--mot', nargs='*', default=[], help="Alternative methods of transportation")
+    parser.add_argument('--value-factors', nargs='*', type=float, default=[], help="Value bands as multiples of the declared value, e.g. 0.9 1.1")
+    for component, column in RATE_COLUMNS.items():
+        parser.add_argument(f'--{component}', nargs='*', type=float, default=[],
+                            help=f"Hypothetical {column.lower()}s as fractions of value, e.g. 0.25 for 25%%")
+    parser.add_argument('--output', required=True, help="Scenario comparison, " + "/".join(EXPORT_FORMATS))
+    parser.add_argument('--cheapest', default=None, help="Also write the cheapest sourcing option per part to this file")
+    parser.add_argument('--store-dir', default=None, help="Tariff store directory (default: the app's store)")
+    parser.add_argument('--rules', default=None, help=f"Duty rules CSV (default: {RULES_PATH})")
+    args = parser.parse_args(argv)
+
+    for path in (args.output, args.cheapest):
+        if path and os.path.splitext(path)[1].lower() not in EXPORT_FORMATS:
+            parser.error(f"output files must end in one of: {', '.join(EXPORT_FORMATS)}")
+
+    try:
+        grid = scenario_grid(args.coo, args.mot, args.value_factors, args.china, args.aluminum, args.steel)
+        tariff_index = build_tariff_index(load_merged(args.schedules, args.store_dir))
+        entries = pd.concat([chunk for chunk, _ in iter_manifest(args.manifest)], ignore_index=True)
+        entries['US HTS'] = normalize_hts_codes(entries['US HTS']).fillna('')
+        sweep = sweep_tariffs(entries, tariff_index, build_prefix_index(tariff_index), grid, load_rules(args.rules))
+        _write_table(sweep.scenarios, args.output)
+        if args.cheapest:
+            _write_table(cheapest_options(sweep), args.cheapest)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    print(sweep.scenarios[['Scenario'] + SCENARIO_COLUMNS + ['Tariffs & Fees to be Paid (USD)', 'Change (USD)']].to_string(index=False))
+    print(f"Costed {len(entries)} lines under {len(grid)} scenarios, written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
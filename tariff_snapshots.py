@@ -0,0 +1,285 @@
+import argparse
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from tariff_engine import TARIFF_FIELDS, add_fees, build_prefix_index, build_tariff_index, calculate_tariffs, match_hts_levels, resolve_hts_codes
+from tariff_part_cache import PartCache, calculate_tariffs_cached
+from tariff_store import STORE_DIR, load_merged, read_merged, store_key
+
+# -----------------------------------------------------------------------------
+# Versioned tariff snapshots.
+# A snapshot is a merged schedule in the on-disk tariff store (see tariff_store.py)
+# plus the date it takes effect. The catalog of snapshots is a small CSV next to
+# the stored tables, so every version stays available without the source Excel
+# files. Lines are costed against the snapshot in force on their 'Entry Date',
+# found for a whole manifest at once with a binary search over effective dates,
+# and two snapshots are compared column by column on their tariff fields.
+#
+#   python tariff_snapshots.py add --effective 2025-01-01 general.xlsx china_301.xlsx addcvd.xlsx
+#   python tariff_snapshots.py list
+#   python tariff_snapshots.py diff 1 2 --manifest parts.csv
+# -----------------------------------------------------------------------------
+
+CATALOG_NAME = 'snapshots.csv'
+CATALOG_COLUMNS = ['version', 'effective_date', 'store_key', 'files', 'label', 'created']
+
+# Seconds add_snapshot waits for another writer of the catalog, and after which a lock
+# left behind by a process that died while holding it is removed
+CATALOG_LOCK_TIMEOUT = 30
+CATALOG_LOCK_STALE = 120
+
+# Columns left blank for lines dated before the first snapshot, the fees do not depend on it
+UNDATED_COLUMNS = ['General Tariff Percentage', 'COO China Tariff', 'Aluminum Tariff', 'Steel Tariff',
+                   'Potential ADD/CVD Flag', 'Tariffs to be Paid (USD)']
+
+# Columns of diff_snapshots
+DIFF_COLUMNS = ['HTS_Code', 'change', 'field', 'old', 'new']
+
+#==============================================================================================
+def catalog_path(store_dir=None):
+    return os.path.join(store_dir or STORE_DIR, CATALOG_NAME)
+#==============================================================================================
+def list_snapshots(store_dir=None):
+    # The catalog sorted by effective date, then version, so the last row in force wins a tie
+    path = catalog_path(store_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=CATALOG_COLUMNS)
+    catalog = pd.read_csv(path, dtype={'store_key': str, 'files': str, 'label': str}, keep_default_na=False)
+    catalog['effective_date'] = pd.to_datetime(catalog['effective_date'])
+    return catalog.sort_values(['effective_date', 'version'], ignore_index=True)
+#==============================================================================================
+@contextmanager
+def _catalog_lock(store_dir=None):
+    # Lock file next to the catalog, created exclusively, so two processes saving a snapshot at
+    # the same moment never read the same last version and both write the next one
+    path = f"{catalog_path(store_dir)}.lock"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    deadline = time.monotonic() + CATALOG_LOCK_TIMEOUT
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > CATALOG_LOCK_STALE:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"The snapshot catalog is locked by another process, remove {path} if none is running")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.remove(path)
+#==============================================================================================
+def add_snapshot(files, effective_date, label='', store_dir=None, build=None):
+    # Store the merged table of these files (if it is not stored yet) and record it as in force
+    # from effective_date. Saving the same files with the same date again returns the existing version.
+    # A new version clears the part cache of the store. Versions are numbered under a lock on the catalog.
+    load_merged(files, store_dir, build)
+    key = store_key(files)
+    effective_date = pd.Timestamp(effective_date)
+
+    with _catalog_lock(store_dir):
+        catalog = list_snapshots(store_dir)
+        existing = catalog[(catalog['store_key'] == key) & (catalog['effective_date'] == effective_date)]
+        if len(existing):
+            return int(existing['version'].iloc[0])
+
+        version = int(catalog['version'].max()) + 1 if len(catalog) else 1
+        entry = pd.DataFrame([{
+            'version': version,
+            'effective_date': effective_date,
+            'store_key': key,
+            'files': ';'.join(getattr(file, 'name', None) or os.path.basename(str(file)) for file in files),
+            'label': label,
+            'created': datetime.now().isoformat(timespec='seconds'),
+        }])
+        catalog = pd.concat([catalog, entry], ignore_index=True) if len(catalog) else entry
+        catalog['effective_date'] = catalog['effective_date'].dt.strftime('%Y-%m-%d')
+
+        # Written next to the catalog and renamed so a concurrent reader never sees a partial file
+        path = catalog_path(store_dir)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        catalog[CATALOG_COLUMNS].to_csv(temp_path, index=False)
+        os.replace(temp_path, path)
+    PartCache(store_dir).invalidate()
+    return version
+#==============================================================================================
+def _snapshot_key(version, store_dir=None):
+    catalog = list_snapshots(store_dir)
+    keys = catalog.loc[catalog['version'] == int(version), 'store_key']
+    if keys.empty:
+        raise ValueError(f"There is no tariff snapshot version {version}")
+    return keys.iloc[0]
+#==============================================================================================
+def snapshot_data(version, store_dir=None):
+    # Merged table of a snapshot, memory-mapped from the store
+    merged_data = read_merged(_snapshot_key(version, store_dir), store_dir)
+    if merged_data is None:
+        raise ValueError(f"The stored table of tariff snapshot version {version} is missing")
+    return merged_data
+#==============================================================================================
+@lru_cache(maxsize=8)
+def _stored_index(version, key, store_dir):
+    tariff_index = build_tariff_index(snapshot_data(version, store_dir))
+    return tariff_index, build_prefix_index(tariff_index)
+#==============================================================================================
+def snapshot_index(version, store_dir=None):
+    # (tariff_index, prefix_index) of a snapshot, the last few used are kept in memory
+    return _stored_index(int(version), _snapshot_key(version, store_dir), store_dir)
+#==============================================================================================
+def snapshot_versions_as_of(catalog, dates):
+    # Version in force on each date, 0 before the first snapshot. Missing dates mean today.
+    effective = catalog['effective_date'].to_numpy(dtype='datetime64[ns]')
+    dates = pd.to_datetime(pd.Series(list(dates), dtype=object), errors='coerce')
+    dates = dates.fillna(pd.Timestamp(date.today())).to_numpy(dtype='datetime64[ns]')
+    slots = np.searchsorted(effective, dates, side='right') - 1
+    return np.where(slots >= 0, catalog['version'].to_numpy(dtype=np.int64)[slots.clip(min=0)], 0)
+#==============================================================================================
+def calculate_tariffs_as_of(entries, store_dir=None, rules=None, part_cache=None, write=True):
+    # calculate_tariffs with each line costed against the snapshot in force on its 'Entry Date'
+    # (today when the column is missing or blank). Lines dated before the first snapshot are
+    # left blank with the reason in 'Rate Error'. 'Snapshot Version' says which one was used.
+    # With a part_cache, components are looked up there first (see tariff_part_cache.py), write is
+    # passed on to calculate_tariffs_cached.
+    catalog = list_snapshots(store_dir)
+    if catalog.empty:
+        raise ValueError("No tariff snapshots have been saved yet")
+    dates = entries['Entry Date'] if 'Entry Date' in entries.columns else [None] * len(entries)
+    versions = snapshot_versions_as_of(catalog, dates)
+
+    parts, positions = [], []
+    for version in np.unique(versions):
+        lines = np.flatnonzero(versions == version)
+        used_version = version if version else catalog['version'].iloc[0]
+        tariff_index, prefix_index = snapshot_index(used_version, store_dir)
+        if part_cache is not None:
+            costed = calculate_tariffs_cached(entries.iloc[lines], tariff_index, prefix_index, part_cache,
+                                              _snapshot_key(used_version, store_dir), rules, write)
+        else:
+            costed = calculate_tariffs(entries.iloc[lines], tariff_index, prefix_index, rules)
+        if not version:
+            costed[UNDATED_COLUMNS] = np.nan
+            costed['Rate Error'] = "No tariff snapshot was in force on the entry date"
+        parts.append(costed)
+        positions.append(lines)
+
+    result = pd.concat(parts).iloc[np.argsort(np.concatenate(positions), kind='stable')]
+    result['Snapshot Version'] = versions
+    add_fees(result)
+    result.attrs['unparsed_rates'] = sorted(set(result['Rate Error'].dropna()))
+    return result
+#==============================================================================================
+def _field_text(values):
+    # Tariff fields compared as text, blanks and missing values are the same
+    return values.astype(object).where(values.notna(), '').astype(str).to_numpy(dtype=object)
+#==============================================================================================
+def diff_snapshots(old_data, new_data):
+    # Compare two merged tables on the tariff fields, one code per row as looked up.
+    # Returns a frame with DIFF_COLUMNS: one row per added or removed code, and one row per
+    # changed field of a code listed in both, with the old and new value.
+    old_index = build_tariff_index(old_data)
+    new_index = build_tariff_index(new_data)
+    codes = old_index.index.union(new_index.index)
+    in_old = codes.isin(old_index.index)
+    in_new = codes.isin(new_index.index)
+
+    changes = [
+        pd.DataFrame({'HTS_Code': codes[~in_old], 'change': 'added'}),
+        pd.DataFrame({'HTS_Code': codes[~in_new], 'change': 'removed'}),
+    ]
+    for field in TARIFF_FIELDS:
+        old = _field_text(old_index[field].reindex(codes))
+        new = _field_text(new_index[field].reindex(codes))
+        changed = in_old & in_new & (old != new)
+        changes.append(pd.DataFrame({'HTS_Code': codes[changed], 'change': 'changed', 'field': field,
+                                     'old': old[changed], 'new': new[changed]}))
+    diff = pd.concat(changes, ignore_index=True).reindex(columns=DIFF_COLUMNS)
+    return diff.sort_values(['HTS_Code', 'change'], kind='stable', ignore_index=True)
+#==============================================================================================
+def _matched_codes(indexes, hts_codes):
+    # Schedule line each code resolves to (with heading fallback), '' when none
+    tariff_index, prefix_index = indexes
+    positions, _ = resolve_hts_codes(prefix_index, hts_codes)
+    listed = np.asarray(tariff_index.index.astype(str), dtype=object)
+    return np.where(positions >= 0, listed[positions.clip(min=0)] if len(listed) else '', '')
+#==============================================================================================
+def _falls_under(indexes, hts_codes, listed_codes):
+    # Whether any listed line a code falls under (the code itself or a heading, see
+    # match_hts_levels) is one of listed_codes, since every level can supply a field
+    tariff_index, prefix_index = indexes
+    listed = np.asarray(tariff_index.index.astype(str), dtype=object)
+    hit = np.zeros(len(hts_codes), dtype=bool)
+    for positions, _ in match_hts_levels(prefix_index, hts_codes):
+        matched = positions >= 0
+        hit[matched] |= np.isin(listed[positions[matched]], listed_codes)
+    return hit
+#==============================================================================================
+def affected_parts(entries, diff, old_indexes, new_indexes):
+    # Lines of entries whose 'US HTS' falls under a code in diff under either version.
+    # old_indexes/new_indexes are (tariff_index, prefix_index) pairs, e.g. from snapshot_index.
+    hts_codes = entries['US HTS'].fillna('').astype(str)
+    old_match = _matched_codes(old_indexes, hts_codes)
+    new_match = _matched_codes(new_indexes, hts_codes)
+    changed_codes = diff['HTS_Code'].unique()
+    affected = _falls_under(old_indexes, hts_codes, changed_codes) | _falls_under(new_indexes, hts_codes, changed_codes)
+    result = entries[affected].copy()
+    result['Old Schedule Line'] = old_match[affected]
+    result['New Schedule Line'] = new_match[affected]
+    return result
+#==============================================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage versioned tariff snapshots in the tariff store.")
+    parser.add_argument('--store-dir', default=None, help=f"Store directory (default: {STORE_DIR})")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="Save schedule workbooks as a snapshot")
+    add.add_argument('files', nargs='+', help="Schedule workbooks, in the same order they are uploaded in the app")
+    add.add_argument('--effective', required=True, help="Date the schedules take effect, YYYY-MM-DD")
+    add.add_argument('--label', default='', help="Free text shown next to the version")
+    commands.add_parser('list', help="List the saved snapshots")
+    diff = commands.add_parser('diff', help="Changed HTS codes and rates between two versions")
+    diff.add_argument('old', type=int)
+    diff.add_argument('new', type=int)
+    diff.add_argument('--manifest', default=None, help="Also list the manifest lines affected by the changes")
+    diff.add_argument('--output', default=None, help="Write the differences to this CSV file")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'add':
+            version = add_snapshot(args.files, args.effective, args.label, args.store_dir)
+            print(f"Saved as tariff snapshot version {version}, in force from {args.effective}")
+        elif args.command == 'list':
+            print(list_snapshots(args.store_dir).to_string(index=False))
+        else:
+            changes = diff_snapshots(snapshot_data(args.old, args.store_dir), snapshot_data(args.new, args.store_dir))
+            print(changes['change'].value_counts().to_string())
+            if args.output:
+                changes.to_csv(args.output, index=False)
+            else:
+                print(changes.to_string(index=False))
+            if args.manifest:
+                from tariff_ingest import iter_manifest, normalize_hts_codes
+                entries = pd.concat([chunk for chunk, _ in iter_manifest(args.manifest)], ignore_index=True)
+                entries['US HTS'] = normalize_hts_codes(entries['US HTS']).fillna('')
+                parts = affected_parts(entries, changes, snapshot_index(args.old, args.store_dir),
+                                       snapshot_index(args.new, args.store_dir))
+                print(f"{len(parts)} manifest line(s) affected:")
+                print(parts.to_string(index=False))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import argparse
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from tariff_ingest import merge_all_data
+
+# -----------------------------------------------------------------------------
+# On-disk columnar store for merged tariff schedules.
+# The merged table for a set of schedule files is written once as an
+# uncompressed Arrow (Feather v2) file named after the hash of the file
+# contents, so later sessions and server restarts memory-map it instead of
+# parsing the Excel files again.
+#
+# Prebuild from the command line:
+#   python tariff_store.py general_rates.xlsx china_301.xlsx addcvd.xlsx
+# -----------------------------------------------------------------------------
+
+STORE_DIR = os.environ.get('TARIFF_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tariff_store'))
+
+# Bumped whenever the merged table changes shape, so older stored tables are not reused
+STORE_FORMAT = 5
+
+#==============================================================================================
+def _file_bytes(file):
+    # Uploaded files are in-memory buffers, the command line passes paths
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    with open(file, 'rb') as handle:
+        return handle.read()
+#==============================================================================================
+def store_key(files):
+    # Content hash of the schedule files, in upload order since the first file wins on duplicates
+    digest = hashlib.sha256(f"format {STORE_FORMAT}".encode())
+    for file in files:
+        digest.update(hashlib.sha256(_file_bytes(file)).digest())
+    return digest.hexdigest()
+#==============================================================================================
+def store_path(key, store_dir=None):
+    return os.path.join(store_dir or STORE_DIR, f"{key}.arrow")
+#==============================================================================================
+def arrow_safe_frame(df):
+    # Excel columns often mix numbers and text (e.g. '6.5%' next to 0.065), Arrow needs one type
+    # per column, so mixed object columns are stored as text with blanks kept as nulls
+    df = df.copy()
+    df.columns = [str(column) for column in df.columns]
+    for column in df.columns:
+        if df[column].dtype == object and pd.api.types.infer_dtype(df[column], skipna=True) not in ('string', 'empty'):
+            df[column] = df[column].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+#==============================================================================================
+def write_merged(merged_data, key, store_dir=None):
+    path = store_path(key, store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(arrow_safe_frame(merged_data), preserve_index=False)
+    # Write next to the target and rename so a concurrent reader never sees a partial file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(table, temp_path, compression='uncompressed')
+    os.replace(temp_path, path)
+    return path
+#==============================================================================================
+def read_merged(key, store_dir=None):
+    # Memory-mapped read, returns None when these files have not been stored yet
+    path = store_path(key, store_dir)
+    if not os.path.exists(path):
+        return None
+    return feather.read_table(path, memory_map=True).to_pandas()
+#==============================================================================================
+def load_merged(files, store_dir=None, build=None):
+    # Merged tariff table for these files, built from the Excel files only on the first request.
+    # build lets the caller merge workbooks it has already parsed instead of reading the files again.
+    key = store_key(files)
+    merged_data = read_merged(key, store_dir)
+    if merged_data is None:
+        merged_data = build() if build else merge_all_data(files)
+        write_merged(merged_data, key, store_dir)
+    return merged_data
+#==============================================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild the on-disk tariff store from schedule workbooks.")
+    parser.add_argument('files', nargs='+', help="Schedule workbooks, in the same order they are uploaded in the app")
+    parser.add_argument('--store-dir', default=None, help=f"Store directory (default: {STORE_DIR})")
+    args = parser.parse_args()
+
+    key = store_key(args.files)
+    merged_data = read_merged(key, args.store_dir)
+    if merged_data is not None:
+        print(f"Already stored: {store_path(key, args.store_dir)} ({len(merged_data)} rows)")
+        return
+
+    merged_data = merge_all_data(args.files)
+    path = write_merged(merged_data, key, args.store_dir)
+    print(f"Stored {len(merged_data)} rows in {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,41 @@
+import time
+# Taken before the other imports, so the time to first render of a cold start includes them
+script_started = time.perf_counter()
+
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import numpy as np
 import pandas as pd
+import tracemalloc
 import streamlit as st
-from io import BytesIO
-from openpyxl.styles import Font
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import tariff_ingest
+from tariff_ingest import memory_mb, normalize_hts_codes
+from tariff_store import load_merged, store_key
+from tariff_export import EXPORT_FORMATS, export_results, export_table
+from tariff_metrics import StageLog, cache_counts, counted_cache, last_call_missed
+from tariff_jobs import JobRunner, cost_manifest_job, named_copy, read_schedules
+from tariff_part_cache import PartCache, calculate_tariffs_cached
+from tariff_explorer import RATE_TYPES, build_explorer, page_rows, search
+from tariff_scenarios import RATE_COLUMNS, cheapest_options, scenario_grid, sweep_tariffs
+from tariff_snapshots import add_snapshot, affected_parts, diff_snapshots, list_snapshots, snapshot_data, snapshot_index
+from tariff_engine import INPUT_COLUMNS, OUTCOME_COLUMNS, build_prefix_index, build_tariff_index, calculate_tariffs_incremental, row_keys
 
 # -----------------------------------------------------------------------------
 # Streamlit Tab and Page Configuration
 # -----------------------------------------------------------------------------
 
-#Tab name config
-st.set_page_config(page_icon="https://upload.wikimedia.org/wikipedia/commons/thumb/d/d6/SLB_Logo_2022.svg/2560px-SLB_Logo_2022.svg.png", page_title="Tariffs Processing", layout="wide")
+# Header and welcome images: 'remote' shows the hosted logos, 'local' only the images bundled
+# with the app, so pages never wait on the internet (e.g. TARIFF_ASSETS=local on offline networks).
+# The welcome page image is the bundled tariffs.png in both modes.
+ASSET_MODE = os.environ.get('TARIFF_ASSETS', 'remote')
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Width to height of the header banner cut out of new.jpg in local mode
+HEADER_BANNER_ASPECT = 8
+
 # URLs for the images
 slb_logo_url = "https://upload.wikimedia.org/wikipedia/commons/thumb/d/d6/SLB_Logo_2022.svg/2560px-SLB_Logo_2022.svg.png"
 slb_website_url = "https://www.slb.com/"  # The URL you want to open when the logo is clicked
@@ -17,7 +44,27 @@ pipesim_logo_url = "https://americanpatriotsdecals.com/cdn/shop/products/America
 mid_image_url = "https://www.umsl.edu/technology/procurement/files/images/techimg.jpg"
 seal_award_image_url = "https://cei.org/wp-content/uploads/2017/08/2000px-Seal_of_the_United_States_Department_of_Commerce.svg_.png"
 seal_award_website_url = "https://dataweb.usitc.gov/"
-ghg_image_url = "https://github.com/thunderdbolt/slbtool/blob/main/tariffs.png?raw=true"
+
+#Tab name config
+st.set_page_config(page_icon=slb_logo_url if ASSET_MODE == 'remote' else ":material/local_shipping:",
+                   page_title="Tariffs Processing", layout="wide")
+
+@st.cache_resource(show_spinner=False)
+def local_image(name, aspect=None):
+    # Bytes of an image bundled with the app, read once per process. st.image serves them under a
+    # content hash URL, so browsers keep them cached. With aspect (width / height) only the middle
+    # band of the image at that ratio is kept, e.g. to fit the header row.
+    path = os.path.join(ASSET_DIR, name)
+    if aspect is None:
+        with open(path, 'rb') as handle:
+            return handle.read()
+    from PIL import Image
+    with Image.open(path) as image:
+        height = min(image.height, round(image.width / aspect))
+        top = (image.height - height) // 2
+        output = BytesIO()
+        image.crop((0, top, image.width, top + height)).save(output, format=image.format)
+    return output.getvalue()
 
 # Custom CSS to remove padding and margin from columns
 st.markdown(
@@ -30,43 +77,50 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-# Display images with responsive design
-col1, col2, col3, col4 = st.columns([1, 1, 7, 1], gap="small")  # Adjust column ratios as needed
-
-# Determine the max height based on your layout requirements or through trial and error
-max_image_height = "100px"  # Adjust this value as needed to fit your header layout
-
-with col1:
-    st.markdown(
-        f'<a href="{slb_website_url}">'
-        f'<img src="{slb_logo_url}" alt="SLB Logo" style="max-height:{max_image_height}; height:auto; width:auto;">'
-        f'</a>',
-        unsafe_allow_html=True,
-    )
-
-with col2:
-    st.markdown(
-        # f'<a href="{pipesim_website_url}">'
-        f'<img src="{pipesim_logo_url}" alt="Pipesim Logo" style="max-height:{max_image_height}; height:auto; width:auto;">'
-        f'</a>',
-        unsafe_allow_html=True,
-    )
-
-with col3:
-    st.markdown(
-        # f'<a href="{slb_website_url}">'
-        f'<img src="{mid_image_url}" alt="Middle Image" style="max-height:{max_image_height}; width:93%;">'
-        f'</a>',
-        unsafe_allow_html=True,
-    )
-    
-with col4:
-    st.markdown(
-        f'<a href="{seal_award_website_url}">'
-        f'<img src="{seal_award_image_url}" alt="Seal Award Logo" style="max-height:{max_image_height}; height:auto; width:auto;">'
-        f'</a>',
-        unsafe_allow_html=True,
-    )
+if ASSET_MODE == 'local':
+    # One banner from the bundled new.jpg in place of the hosted logos
+    st.image(local_image('new.jpg', HEADER_BANNER_ASPECT), width='stretch')
+else:
+    # Display images with responsive design
+    col1, col2, col3, col4 = st.columns([1, 1, 7, 1], gap="small")  # Adjust column ratios as needed
+
+    # Determine the max height based on your layout requirements or through trial and error
+    max_image_height = "100px"  # Adjust this value as needed to fit your header layout
+
+    with col1:
+        st.markdown(
+            f'<a href="{slb_website_url}">'
+            f'<img src="{slb_logo_url}" alt="SLB Logo" style="max-height:{max_image_height}; height:auto; width:auto;">'
+            f'</a>',
+            unsafe_allow_html=True,
+        )
+
+    with col2:
+        st.markdown(
+            # f'<a href="{pipesim_website_url}">'
+            f'<img src="{pipesim_logo_url}" alt="Pipesim Logo" style="max-height:{max_image_height}; height:auto; width:auto;">'
+            f'</a>',
+            unsafe_allow_html=True,
+        )
+
+    with col3:
+        st.markdown(
+            # f'<a href="{slb_website_url}">'
+            f'<img src="{mid_image_url}" alt="Middle Image" style="max-height:{max_image_height}; width:93%;">'
+            f'</a>',
+            unsafe_allow_html=True,
+        )
+
+    with col4:
+        st.markdown(
+            f'<a href="{seal_award_website_url}">'
+            f'<img src="{seal_award_image_url}" alt="Seal Award Logo" style="max-height:{max_image_height}; height:auto; width:auto;">'
+            f'</a>',
+            unsafe_allow_html=True,
+        )
+
+# Recorded in the stage log by main()
+first_render_seconds = time.perf_counter() - script_started
 
 
 
@@ -74,116 +128,444 @@ with col4:
 ###############################################################################################################################################
 # Functions Being Used
 ###############################################################################################################################################
+
+# Sessions that have not rerun for this many seconds drop out of the memory total
+SESSION_MEMORY_TTL = 3600
+
+# Finished schedule jobs remembered for sessions uploading the same files, least recently used dropped first
+SCHEDULE_JOB_LIMIT = 8
+
+# Countries of origin offered in the editor
+COO_OPTIONS = [
+    "China", "USA", "Italy", "Germany", "France",
+    "Afghanistan", "Albania", "Algeria", "Andorra", "Angola",
+    "Argentina", "Armenia", "Australia", "Austria", "Azerbaijan",
+    "Bahamas", "Bahrain", "Bangladesh", "Barbados", "Belarus",
+    "Belgium", "Belize", "Benin", "Bhutan", "Bolivia",
+    "Bosnia and Herzegovina", "Botswana", "Brazil", "Brunei", "Bulgaria",
+    "Burkina Faso", "Burundi", "Cambodia", "Cameroon", "Canada",
+    "Cape Verde", "Central African Republic", "Chad", "Chile", "Colombia",
+    "Comoros", "Congo", "Costa Rica", "Croatia", "Cuba",
+    "Cyprus", "Czech Republic", "Denmark", "Djibouti", "Dominica",
+    "Dominican Republic", "East Timor", "Ecuador", "Egypt", "El Salvador",
+    "Equatorial Guinea", "Eritrea", "Estonia", "Eswatini", "Ethiopia",
+    "Fiji", "Finland", "Gabon", "Gambia", "Georgia",
+    "Ghana", "Greece", "Grenada", "Guatemala", "Guinea",
+    "Guinea-Bissau", "Guyana", "Haiti", "Honduras", "Hungary",
+    "Iceland", "India", "Indonesia", "Iran", "Iraq",
+    "Ireland", "Israel", "Jamaica", "Japan", "Jordan",
+    "Kazakhstan", "Kenya", "Kiribati", "Kosovo", "Kuwait",
+    "Kyrgyzstan", "Laos", "Latvia", "Lebanon", "Lesotho",
+    "Liberia", "Libya", "Liechtenstein", "Lithuania", "Luxembourg",
+    "Madagascar", "Malawi", "Malaysia", "Maldives", "Mali",
+    "Malta", "Marshall Islands", "Mauritania", "Mauritius", "Mexico",
+    "Micronesia", "Moldova", "Monaco", "Mongolia", "Montenegro",
+    "Morocco", "Mozambique", "Myanmar", "Namibia", "Nauru",
+    "Nepal", "Netherlands", "New Zealand", "Nicaragua", "Niger",
+    "Nigeria", "North Korea", "North Macedonia", "Norway", "Oman",
+    "Pakistan", "Palau", "Palestine", "Panama", "Papua New Guinea",
+    "Paraguay", "Peru", "Philippines", "Poland", "Portugal",
+    "Qatar", "Romania", "Russia", "Rwanda", "Saint Kitts and Nevis",
+    "Saint Lucia", "Saint Vincent and the Grenadines", "Samoa", "San Marino", "Sao Tome and Principe",
+    "Saudi Arabia", "Senegal", "Serbia", "Seychelles", "Sierra Leone",
+    "Singapore", "Slovakia", "Slovenia", "Solomon Islands", "Somalia",
+    "South Africa", "South Korea", "South Sudan", "Spain", "Sri Lanka",
+    "Sudan", "Suriname", "Sweden", "Switzerland", "Syria",
+    "Taiwan", "Tajikistan", "Tanzania", "Thailand", "Togo",
+    "Tonga", "Trinidad and Tobago", "Tunisia", "Turkey", "Turkmenistan",
+    "Tuvalu", "Uganda", "Ukraine", "United Arab Emirates", "United Kingdom",
+    "Uruguay", "Uzbekistan", "Vanuatu", "Vatican City", "Venezuela",
+    "Vietnam", "Yemen", "Zambia", "Zimbabwe"
+]
+
+# Methods of transportation offered in the editor
+MOT_OPTIONS = ["AIR", "TRUCK", "OCEAN", "COURIER"]
         
-def clean_hts_code(hts_code):
-    # Convert to string and remove all dots and whitespace
-    hts_code_str = str(hts_code)
-    return hts_code_str.replace('.', '').strip()
+# The schedule data is held with st.cache_resource: one read-only copy in the server process,
+# shared by every session instead of a pickled copy per caller. Nothing below modifies it.
+# counted_cache counts the calls and misses of each cached function for the diagnostics panel.
+@counted_cache(st.cache_resource)
+def load_schedules(uploaded_files):
+    # All uploads are parsed together in a process pool, once per set of files.
+    # Returns (workbooks, {file name: error}), the previews and the merge share the result.
+    # Normally a background job has parsed these files already, see start_schedule_job.
+    # Its result moves into this cache, the job only keeps its status.
+    job = schedule_jobs().get(schedule_version(uploaded_files))
+    if job is not None and job.status == 'done' and job.result is not None:
+        result, job.result = job.result, None
+        return result
+    return tariff_ingest.load_workbooks(uploaded_files)
 #==============================================================================================
-def reformat_hts_code(hts_code):
-    # Reformat to xxxx.xx.xx.xx or xxxx.xx.xxxx depending on length
-    # First ensure it's a string without any whitespace or dots
-    hts_code_str = clean_hts_code(hts_code)
-    if len(hts_code_str) > 10:
-        return f"{hts_code_str[:4]}.{hts_code_str[4:6]}.{hts_code_str[6:8]}.{hts_code_str[8:]}"
-    else:
-        return f"{hts_code_str[:4]}.{hts_code_str[4:6]}.{hts_code_str[6:]}"
+@counted_cache(st.cache_resource)
+def merge_all_data(uploaded_files):
+    workbooks, errors = load_schedules(uploaded_files)
+    if errors:
+        # Merge what could be read, but don't persist a table that is missing files
+        return tariff_ingest.merge_workbooks(workbooks)
+    # Read from the on-disk tariff store when these exact files were ingested before,
+    # by an earlier session or with `python tariff_store.py`
+    return load_merged(uploaded_files, build=lambda: tariff_ingest.merge_workbooks(workbooks))
 #==============================================================================================
-@st.cache_data
-def process_sheet(df, label):
-    df = df[df['HSCODE'].notna()]
-    df['ADD/CVD'] = label
-    df['HSCODE'] = df['HSCODE'].apply(clean_hts_code)
-    df = df.rename(columns={'HSCODE': 'HTS_Code'})[['HTS_Code', 'ADD/CVD']]
-    return df
+@counted_cache(st.cache_resource)
+def tariff_lookup_index(merged_data):
+    # Built once per merged dataset so every editor rerun reuses the same HTS indexes:
+    # the exact-code table and the sorted prefix index for heading/subheading fallback
+    tariff_index = build_tariff_index(merged_data)
+    return tariff_index, build_prefix_index(tariff_index)
 #==============================================================================================
-@st.cache_data
-def combine_data(file):
-    sheet_names = pd.ExcelFile(file).sheet_names
-    combined_data = []
-
-    for sheet in sheet_names:
-        df = pd.read_excel(file, sheet_name=sheet)
-        if 'ADD' in sheet:
-            combined_data.append(process_sheet(df, 'ADD'))
-        elif 'CVD' in sheet:
-            combined_data.append(process_sheet(df, 'CVD'))
-
+@counted_cache(st.cache_resource)
+def tariff_explorer(merged_data):
+    # Sorted codes, rate types and summary counts of a merged dataset, built once for all sessions
+    return build_explorer(merged_data)
 #==============================================================================================
-@st.cache_data
-def find_hts_column(df):
-    possible_columns = ['HTS', 'HTS Number', 'HSCODE']
-    for col in possible_columns:
-        if col in df.columns:
-            return col
-    raise ValueError("HTS column not found in the dataframe.")
+@st.cache_resource
+def schedule_version(uploaded_files):
+    # Content hash of the uploaded schedules, the same for every session and restart
+    return store_key(uploaded_files)
 #==============================================================================================
-@st.cache_data
-def process_rate_of_duty(file):
-    df = pd.read_excel(file)
-    hts_col_name = find_hts_column(df)
-    df[hts_col_name] = df[hts_col_name].apply(clean_hts_code)
-    df = df.rename(columns={hts_col_name: 'HTS_Code', 'General Rate of Duty': 'General_Rate_of_Duty'})
-    return df
+@st.cache_resource
+def part_cache():
+    # Resolved duty components per part, on disk in the tariff store and shared by every session
+    return PartCache()
 #==============================================================================================
-@st.cache_data
-def process_specific_duty(file, column_name):
-    # This function processes the specific duty rates for China, Aluminum, or Steel.
-    df = pd.read_excel(file)
-    df['HTS'] = df['HTS'].apply(clean_hts_code)
-    df = df.rename(columns={'HTS': 'HTS_Code', column_name: 'Specific_Rate_of_Duty'})
-    df['Specific_Rate_of_Duty'] = df['Specific_Rate_of_Duty'].fillna(0)  # Assuming empty cells mean 0%
-    return df
+@st.cache_resource
+def job_runner():
+    # One pool of background job threads for the whole server, see tariff_jobs.py
+    return JobRunner()
 #==============================================================================================
-@st.cache_data
-def merge_all_data(uploaded_files):
-    addcvd_dataframes = []
-    specific_duty_dataframes = []
-    rate_of_duty_dataframes = []
-
-    for uploaded_file in uploaded_files:
-        # Determine the type of file
-        sheet_names = pd.ExcelFile(uploaded_file).sheet_names
-        is_specific_duty = 'China' in sheet_names or 'Aluminum' in sheet_names or 'Steel' in sheet_names
-        is_addcvd = any(['ADD' in sheet for sheet in sheet_names]) or any(['CVD' in sheet for sheet in sheet_names])
-        
-        if is_addcvd:
-            addcvd_dataframes.append(combine_data(uploaded_file))
-        elif is_specific_duty:
-            specific_duty_dataframes.append(process_specific_duty(uploaded_file, sheet_names[0]))
-        else:
-            rate_of_duty_dataframes.append(process_rate_of_duty(uploaded_file))
-
-    # Initialize merged_data as an empty DataFrame or the first non-empty DataFrame
-    merged_data = pd.DataFrame()
-
-    # Merge all dataframes of each type
-    if addcvd_dataframes:
-        combined_addcvd = pd.concat(addcvd_dataframes, ignore_index=True)
-        merged_data = combined_addcvd
-
-    if specific_duty_dataframes:
-        combined_specific_duty = pd.concat(specific_duty_dataframes, ignore_index=True)
-        if not merged_data.empty:
-            merged_data = pd.merge(merged_data, combined_specific_duty, on='HTS_Code', how='left')
-        else:
-            merged_data = combined_specific_duty
-
-    if rate_of_duty_dataframes:
-        combined_rate_of_duty = pd.concat(rate_of_duty_dataframes, ignore_index=True)
-        if not merged_data.empty:
-            merged_data = pd.merge(merged_data, combined_rate_of_duty, on='HTS_Code', how='left')
-        else:
-            merged_data = combined_rate_of_duty
+@st.cache_resource
+def schedule_jobs():
+    # {schedule version: Job reading those schedules}, least recently used first. Shared so
+    # sessions uploading the same files share one job, see start_schedule_job.
+    return OrderedDict()
+#==============================================================================================
+@st.cache_resource
+def schedule_jobs_lock():
+    # Held while schedule_jobs is changed, sessions run on their own threads
+    return threading.Lock()
+#==============================================================================================
+def track_job(job):
+    # Jobs of this session, shown in the sidebar until they are dismissed
+    jobs = st.session_state.setdefault('jobs', {})
+    jobs[job.id] = job
+    return job
+#==============================================================================================
+def start_schedule_job(uploaded_files):
+    # The job reading these files, started when no session has read them yet.
+    # A cancelled or failed job is only retried on request, see display_jobs.
+    # Only SCHEDULE_JOB_LIMIT finished jobs are kept, running ones stay until they finish.
+    key = schedule_version(uploaded_files)
+    jobs = schedule_jobs()
+    with schedule_jobs_lock():
+        job = jobs.get(key)
+        if job is None:
+            job = job_runner().submit("Read schedules", read_schedules, ([named_copy(file) for file in uploaded_files],), key=key)
+            jobs[key] = job
+        jobs.move_to_end(key)
+        finished = [finished_key for finished_key, finished_job in jobs.items() if finished_job.done]
+        for finished_key in finished[:max(len(jobs) - SCHEDULE_JOB_LIMIT, 0)]:
+            jobs.pop(finished_key, None)
+    return track_job(job)
+#==============================================================================================
+@st.cache_resource
+def session_memory_registry():
+    # {session id: (MB held in session state, last seen)}, shared by all sessions
+    return {}
+#==============================================================================================
+def report_memory(shared_objects, shared_session_keys):
+    # Show the memory of the shared tariff data, of this session's own data and the total for
+    # all sessions seen in the last SESSION_MEMORY_TTL seconds
+    shared_mb = memory_mb(shared_objects)
+    session_mb = memory_mb({key: value for key, value in st.session_state.items() if key not in shared_session_keys})
+
+    registry = session_memory_registry()
+    now = time.time()
+    registry[get_script_run_ctx().session_id] = (session_mb, now)
+    for session_id, (_, last_seen) in list(registry.items()):
+        if now - last_seen > SESSION_MEMORY_TTL:
+            registry.pop(session_id, None)
+    sessions_mb = sum(mb for mb, _ in list(registry.values()))
+
+    st.caption(f"Memory: {shared_mb:.1f} MB of tariff data shared by all sessions, {session_mb:.1f} MB in this session, "
+               f"{shared_mb + sessions_mb:.1f} MB in total for {len(registry)} active session(s)")
+#==============================================================================================
+@st.cache_resource
+def editor_template():
+    # The editor's starting line and column configuration, built once per process. data_editor
+    # copies the configuration and nothing modifies the frame, so every session shares them.
+
+    # Define the structure of the empty DataFrame according to the Excel sheet
+    data_structure = {
+        "SLB Part Number": [""],
+        "US HTS": [""],
+        "COO": [""],
+        "Value": [100],
+        "Weight": [0],
+        "MOT": [""],
+        "General Tariff Percentage": [0],  # To be calculated based on US HTS
+        "COO China Tariff": [0],  # To be calculated based on COO
+        "Aluminum Tariff": [0],  # To be calculated based on US HTS
+        "Steel Tariff": [0],  # To be calculated based on US HTS
+        "Potential ADD/CVD Flag": [""],  # To be determined based on US HTS and COO
+        "CBP Merchandise Processing Fee": [0],  # To be calculated per entry based on Value
+        "CBP Harbor Maintenance Fee": [0],  # To be calculated based on Value and MOT
+        "Tariffs & Fees to be Paid (%)": [0],  # To be calculated based on above tariffs and fees
+        "Tariffs to be Paid (USD)": [0],  # To be calculated based on Value and the total percentage
+        "Tariffs & Fees to be Paid (USD)": [0],  # To include the CBP fees in the total
+    }
+
+    # Define column configurations with a dropdown for COO
+    column_config = {
+        "COO": st.column_config.SelectboxColumn(options=COO_OPTIONS, help="Select the Country of Origin"),
+        "MOT": st.column_config.SelectboxColumn(options=MOT_OPTIONS, help="Select the Method of Transportation"),
+    }
+    return pd.DataFrame(data_structure), column_config
+#==============================================================================================
+def stage_log():
+    # Stage timings of this session, shown in the diagnostics panel
+    if 'stage_log' not in st.session_state:
+        st.session_state['stage_log'] = StageLog()
+    return st.session_state['stage_log']
+#==============================================================================================
+def log_calculation(result):
+    # Record the lookup/rules/rates/fees times reported by calculate_tariffs
+    for stage, seconds in result.attrs.get('stage_seconds', {}).items():
+        stage_log().add(stage, seconds, lines=len(result))
+#==============================================================================================
+def display_jobs():
+    # Sidebar list of this session's background jobs, refreshed every second while one runs.
+    # When a job that was running at the last full run finishes, the whole page reruns to show its result.
+    jobs = st.session_state.get('jobs', {})
+    running = [job.id for job in jobs.values() if not job.done]
+    st.session_state['running_jobs'] = running
+
+    @st.fragment(run_every=1.0 if running else None)
+    def job_list():
+        if any(jobs[job_id].done for job_id in st.session_state.get('running_jobs', [])):
+            st.rerun()
+        for job in list(jobs.values()):
+            st.write(f"**{job.name}** ({job.status}, {job.seconds:.0f} s)")
+            if not job.done:
+                st.progress(job.progress, text=job.message or None)
+                if st.button("Cancel", key=f"cancel_{job.id}"):
+                    job.cancel()
+            else:
+                if job.error:
+                    st.caption(job.error)
+                if st.button("Dismiss", key=f"dismiss_{job.id}"):
+                    jobs.pop(job.id, None)
+                    # A failed or cancelled schedule job is dropped so the files can be read again
+                    with schedule_jobs_lock():
+                        if job.status != 'done' and schedule_jobs().get(job.key) is job:
+                            schedule_jobs().pop(job.key, None)
+                    st.rerun()
+
+    if jobs:
+        with st.sidebar:
+            st.subheader("Background jobs")
+            job_list()
+#==============================================================================================
+def display_diagnostics():
+    # Optional panel with this session's stage timings and the server's cache counters
+    with st.expander("Diagnostics"):
+        trace_memory = st.checkbox("Trace memory (slower)", key="trace_memory",
+                                   help="Record the peak memory of each stage from the next run on. "
+                                        "Tracing covers the whole server process, so it slows every session.")
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        log = stage_log()
+        st.write("Last run:")
+        st.dataframe(log.frame(run=log.run), use_container_width=True, hide_index=True)
+        st.write(f"All stages of this session (last {log.records.maxlen} records):")
+        st.dataframe(log.summary(), use_container_width=True, hide_index=True)
+        st.write("Cache hits and misses (all sessions):")
+        st.dataframe(cache_counts(), use_container_width=True, hide_index=True)
+        stats = part_cache().stats()
+        hit_rate = f"{stats['hit_rate']:.0%}" if stats['hit_rate'] is not None else "n/a"
+        st.write(f"Part cache: {stats['entries']:,} parts for {stats['versions']} schedule version(s), "
+                 f"{stats['file_mb']:.1f} MB on disk, {hit_rate} of parts found since the server started")
+        if st.button("Clear the part cache", key="part_cache_clear"):
+            part_cache().invalidate()
+        st.download_button(label='📥 Download stage log (JSON lines)',
+                           data=log.to_jsonl(),
+                           file_name='tariff_stage_log.jsonl',
+                           mime='application/x-ndjson',
+                           key='stage_log_download')
+#==============================================================================================
+@counted_cache(st.cache_resource)
+def snapshot_diff(old_version, new_version):
+    # A saved snapshot never changes, so the differences between two versions are computed once
+    return diff_snapshots(snapshot_data(old_version), snapshot_data(new_version))
+#==============================================================================================
+def display_snapshots(uploaded_files=None):
+    # Saved schedule versions: save the current upload with the date it takes effect, and compare
+    # two versions from the tariff store without reading any Excel file again
+    with st.expander("Tariff snapshots"):
+        if uploaded_files:
+            col1, col2 = st.columns([1, 2])
+            with col1:
+                effective_date = st.date_input("In force from", key="snapshot_effective_date")
+            with col2:
+                label = st.text_input("Label", key="snapshot_label", placeholder="e.g. Section 232 update")
+            if st.button("Save the uploaded schedules as a snapshot", key="snapshot_save"):
+                version = add_snapshot(uploaded_files, effective_date, label)
+                st.success(f"Saved as version {version}, in force from {effective_date}.")
+
+        catalog = list_snapshots()
+        if catalog.empty:
+            st.write("No snapshots saved yet.")
+            return
+        st.dataframe(catalog.drop(columns='store_key'), use_container_width=True, hide_index=True)
+        if len(catalog) < 2:
+            return
+
+        versions = catalog['version'].tolist()
+        describe = dict(zip(versions, [f"v{version} ({effective:%Y-%m-%d}) {label}" for version, effective, label
+                                       in catalog[['version', 'effective_date', 'label']].itertuples(index=False)]))
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            old_version = st.selectbox("Compare", versions, index=len(versions) - 2, key="snapshot_old", format_func=describe.get)
+        with col2:
+            new_version = st.selectbox("with", versions, index=len(versions) - 1, key="snapshot_new", format_func=describe.get)
+        with stage_log().stage('snapshot_diff') as fields:
+            changes = snapshot_diff(old_version, new_version)
+            fields['cache_hit'] = not last_call_missed()
+            fields['rows'] = len(changes)
+        counts = changes['change'].value_counts()
+        st.write(f"{counts.get('changed', 0):,} changed rates, {counts.get('added', 0):,} added and "
+                 f"{counts.get('removed', 0):,} removed HTS codes")
+        st.dataframe(changes, use_container_width=True, hide_index=True)
+
+        # Lines of this session's manifest or editor table that the changes apply to
+        entries = st.session_state.get('manifest_results', st.session_state.get('new_df'))
+        if entries is not None and len(changes):
+            parts = affected_parts(entries, changes, snapshot_index(old_version), snapshot_index(new_version))
+            st.write(f"{len(parts):,} of your {len(entries):,} lines are affected:")
+            st.dataframe(parts[INPUT_COLUMNS + ['Old Schedule Line', 'New Schedule Line']],
+                         use_container_width=True, hide_index=True)
+#==============================================================================================
+def parse_numbers(text, scale=1.0):
+    # Numbers typed as "0.9, 1.1" (commas or spaces), divided by scale, e.g. 100 for percentages
+    return [float(number) / scale for number in text.replace(',', ' ').split()]
+#==============================================================================================
+def display_scenario_sweep(entries, tariff_index, prefix_index, schedule_key):
+    # Cost the lines under every combination of alternative countries and MOTs, value bands and
+    # hypothetical duty rates in one pass (see tariff_scenarios.py), with the cheapest option per part
+    with st.expander("Scenario sweep"):
+        with st.form("scenario_sweep_form"):
+            col1, col2 = st.columns([1, 1])
+            with col1:
+                coo = st.multiselect("Alternative countries of origin", COO_OPTIONS, key="sweep_coo")
+                value_factors = st.text_input("Value bands, as multiples of the declared value", key="sweep_values",
+                                              placeholder="e.g. 0.9, 1.1")
+            with col2:
+                mot = st.multiselect("Alternative methods of transportation", MOT_OPTIONS, key="sweep_mot")
+            rate_columns = st.columns(len(RATE_COLUMNS))
+            rates = {}
+            for rate_column, (component, column) in zip(rate_columns, RATE_COLUMNS.items()):
+                with rate_column:
+                    rates[component] = st.text_input(f"Hypothetical {column.lower()}s (%)", key=f"sweep_{component}",
+                                                     placeholder="e.g. 25, 50",
+                                                     help="Replaces this duty on the lines that pay it")
+            submitted = st.form_submit_button("Run the sweep")
+
+        # Results are kept until the lines or the schedules change
+        sweep_key = (schedule_key, row_keys(entries).tobytes())
+        if submitted:
+            try:
+                grid = scenario_grid(coo, mot, parse_numbers(value_factors),
+                                     **{component: parse_numbers(text, 100) for component, text in rates.items()})
+            except ValueError as e:
+                st.error(f"Could not build the scenarios: {e}")
+                return
+            with st.spinner("Costing the scenarios..."), \
+                    stage_log().stage('scenario_sweep', lines=len(entries), scenarios=len(grid)):
+                sweep = sweep_tariffs(entries, tariff_index, prefix_index, grid)
+            st.session_state['scenario_sweep'] = (sweep_key, sweep.scenarios, cheapest_options(sweep))
+        saved = st.session_state.get('scenario_sweep')
+        if saved is None:
+            return
+        if saved[0] != sweep_key:
+            st.info("The lines or schedules changed since the last sweep, run it again to update the results.")
+            return
+
+        _, scenarios, cheapest = saved
+        st.write(f"{len(scenarios):,} scenarios over {len(entries):,} lines, the change is against the first (as entered):")
+        st.dataframe(scenarios, use_container_width=True, hide_index=True)
+        download_results(scenarios, file_name='tariff_scenarios', key='sweep_download', export=export_table)
+        st.write("Cheapest country and MOT per part:")
+        display_page(cheapest, 'sweep_cheapest')
+        download_results(cheapest, file_name='tariff_cheapest_options', key='sweep_cheapest_download', export=export_table)
+#==============================================================================================
+def display_page(df, key, positions=None, columns=None):
+    # Page size and number pickers, then only the rows of that page are sent to the browser.
+    # positions are the rows to page through (all of df by default), e.g. from tariff_explorer.search.
+    if positions is None:
+        positions = np.arange(len(df))
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        page_size = st.selectbox("Rows per page", [50, 100, 500, 1000], index=1, key=f"{key}_page_size")
+    page_count = max(1, -(-len(positions) // page_size))
+    # A narrower search can leave the page picked earlier past the end
+    if st.session_state.get(f"{key}_page", 1) > page_count:
+        st.session_state[f"{key}_page"] = 1
+    with col2:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, key=f"{key}_page")
+    rows = page_rows(df, positions, page, page_size)
+    st.dataframe(rows if columns is None else rows[columns], use_container_width=True, hide_index=True)
+#==============================================================================================
+def display_tariff_explorer(merged_data):
+    # Search the merged tariff data by HTS prefix, ADD/CVD label and rate type, a page at a time
+    with stage_log().stage('explorer') as fields:
+        explorer = tariff_explorer(merged_data)
+        fields['cache_hit'] = not last_call_missed()
+    summary = explorer.summary
+    with st.expander("Merged tariff data", expanded=True):
+        columns = st.columns(2 + len(summary['duties']))
+        columns[0].metric("Rows", f"{summary['rows']:,}")
+        columns[1].metric("HTS codes", f"{summary['codes']:,}")
+        for column, (duty, count) in zip(columns[2:], summary['duties'].items()):
+            column.metric(f"Rows with {duty}", f"{count:,}")
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            st.dataframe(summary['labels'], use_container_width=True, hide_index=True)
+        with col2:
+            st.dataframe(summary['types'], use_container_width=True, hide_index=True)
 
-    return merged_data
+        col1, col2, col3 = st.columns([1, 1, 1])
+        with col1:
+            hts_prefix = st.text_input("HTS code starts with", key="explorer_hts", placeholder="e.g. 7304")
+        with col2:
+            labels = st.multiselect("ADD/CVD", summary['labels']['ADD/CVD'].tolist(), key="explorer_labels")
+        with col3:
+            types = st.multiselect("Rate type", RATE_TYPES, key="explorer_types")
+        with stage_log().stage('explorer_search') as fields:
+            positions = search(explorer, hts_prefix, labels, types)
+            fields['rows'] = len(positions)
+        st.write(f"{len(positions):,} matching rows")
+        display_page(merged_data, 'explorer', positions)
 #==============================================================================================
-def combine_tariff_information(row):
-    # Combine values from General_Rate_of_Duty, Steel, Aluminum, and China columns
-    # Convert each item to a string and use a list comprehension to filter out None or empty string values before joining
-    values_to_combine = [str(row['General_Rate_of_Duty']), str(row.get('Steel')), str(row.get('Aluminum')), str(row.get('China'))]
-    combined_info = ' + '.join([v for v in values_to_combine if v and v != 'nan'])
-    return combined_info
+def download_results(df, file_name='tariff_data', key='download', export=export_results):
+    # The file is only built when the button is clicked, on Streamlit's download thread,
+    # so reruns don't pay for an export nobody asked for. Excel includes the total row,
+    # pass export=export_table for tables other than costed lines.
+    extension = st.selectbox("Download format", list(EXPORT_FORMATS), key=f"{key}_format",
+                             format_func=lambda extension: EXPORT_FORMATS[extension][0])
+    label, mime = EXPORT_FORMATS[extension]
+    log = stage_log()
+
+    def build_file():
+        with log.stage('export', rows=len(df), format=label):
+            return export(df, extension)
+
+    st.download_button(label=f'📥 Download {label}',
+                       data=build_file,
+                       file_name=file_name + extension,
+                       mime=mime,
+                       key=key)
 
 
 ###############################################################################################################################################
@@ -192,6 +574,10 @@ def combine_tariff_information(row):
 
 def main():
     st.title("HTS Code Data Processing and Tariff Calculation Tool")
+    stage_log().new_run()
+    # From the start of the script to the header being drawn, imports included on the first run
+    stage_log().add('first_render', first_render_seconds, assets=ASSET_MODE)
+    schedules_ready = False
 
     # Streamlit app layout with tabs
     tab1, tab2, tab3 = st.tabs(["Welcome", "Data Entry", "Data Description"])
@@ -208,48 +594,47 @@ def main():
             1. **Enter Details**: Navigate to the 'Data Entry' tab to input essential information, including HTS Codes, country of origin, value, weight, and transportation method.
             2. **Calculate Tariffs**: Automatically computes the tariffs based on your inputs, taking into account various factors such as general tariff percentages and specific duties.
             3. **Review Results**: Offers a detailed view of the calculated tariffs and fees, providing a comprehensive understanding of potential costs.
-            4. **Adjust and Recalculate**: Enables modification of input values to explore different scenarios and immediately see the updated tariffs.
+            4. **Adjust and Recalculate**: Enables modification of input values to explore different scenarios and immediately see the updated tariffs, or run a scenario sweep over alternative countries of origin, transportation methods, value bands and duty rates.
             5. **Export Data**: Allows for exporting the detailed tariff calculations for further analysis or record-keeping.
             """)
 
         with col2:
-            st.markdown(
-                # f'<a href="{slb_website_url}">'
-                f'<img src="{ghg_image_url}" alt="SLB Logo" style="max-height:auto; width:auto; display: block; margin-left: auto; margin-right: auto;"></a>',
-                unsafe_allow_html=True,
-            )
+            # The bundled copy, served by the app instead of fetched from GitHub on every page load
+            st.image(local_image('tariffs.png'), width='content')
 
             # # Embed a YouTube video with a specific size
             # video_url = 'https://www.youtube.com/embed/40PaXCJfi6M'  # Note: Use the 'embed' URL
             # st.markdown(f'<iframe width="800" height="410" src="{video_url}" frameborder="0" allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture" allowfullscreen></iframe>', unsafe_allow_html=True)
 
 
-        slb_logo_explained = "https://user-images.githubusercontent.com/135745865/255714845-eb74d101-c6d8-4dc7-9ce5-fa791593ddbf.jpeg"
-        slb_logo_explained_2 = "https://user-images.githubusercontent.com/135745865/255726767-c571acdc-4a22-4859-b196-892bf5f622d3.png"
-        slb_logo_explained_url = "https://www.slb.com/about/who-we-are/for-a-balanced-planet"
-
-        st.divider()
-        st.write("")
-        st.write("")
-        st.write("")
-        st.write("") 
-        col1, col2, col3, col4 = st.columns([3, 1, 2, 1])
-        with col1:
-            # st.markdown(
-            #     f'<a href="{slb_logo_explained_url}"><img src="{slb_logo_explained}" alt="SLB Logo 6" style="width:800px; height:600px;"></a><p style="text-align:center;">HELLOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOO</p>',
-            #     unsafe_allow_html=True,
-            # )
-            st.image(slb_logo_explained, caption="This is the reduction in carbon emissions the world needs in order to meet its net-zero objectives by 2050, but it is also what we need to do to maintain this for the long term. We need to balance the impact of the past with sustained net negative carbon solutions. We placed this global energy challenge at the heart of what we do and who we are. It’s the path we have all taken, and we will support its realization.", width=720)
-
+        # Hosted images only, there are no bundled copies of these
+        if ASSET_MODE == 'remote':
+            slb_logo_explained = "https://user-images.githubusercontent.com/135745865/255714845-eb74d101-c6d8-4dc7-9ce5-fa791593ddbf.jpeg"
+            slb_logo_explained_2 = "https://user-images.githubusercontent.com/135745865/255726767-c571acdc-4a22-4859-b196-892bf5f622d3.png"
+            slb_logo_explained_url = "https://www.slb.com/about/who-we-are/for-a-balanced-planet"
 
-        with col3:
-            # st.markdown(
-            #     f'<a href="{slb_logo_explained_url}"><img src="{slb_logo_explained_2}" alt="SLB Logo 7" style="width:800px; height:600px;"></a>',
-            #     unsafe_allow_html=True,
-            # )
+            st.divider()
+            st.write("")
             st.write("")
             st.write("")
-            st.image(slb_logo_explained_2, caption="The SLB logo represents our bold commitment, not only to our own net-zero journey, but also in support of our customers’, while embodying our pledge to go beyond. And all to bring balance back to our planet.", width=660)
+            st.write("") 
+            col1, col2, col3, col4 = st.columns([3, 1, 2, 1])
+            with col1:
+                # st.markdown(
+                #     f'<a href="{slb_logo_explained_url}"><img src="{slb_logo_explained}" alt="SLB Logo 6" style="width:800px; height:600px;"></a><p style="text-align:center;">HELLOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOO</p>',
+                #     unsafe_allow_html=True,
+                # )
+                st.image(slb_logo_explained, caption="This is the reduction in carbon emissions the world needs in order to meet its net-zero objectives by 2050, but it is also what we need to do to maintain this for the long term. We need to balance the impact of the past with sustained net negative carbon solutions. We placed this global energy challenge at the heart of what we do and who we are. It’s the path we have all taken, and we will support its realization.", width=720)
+
+
+            with col3:
+                # st.markdown(
+                #     f'<a href="{slb_logo_explained_url}"><img src="{slb_logo_explained_2}" alt="SLB Logo 7" style="width:800px; height:600px;"></a>',
+                #     unsafe_allow_html=True,
+                # )
+                st.write("")
+                st.write("")
+                st.image(slb_logo_explained_2, caption="The SLB logo represents our bold commitment, not only to our own net-zero journey, but also in support of our customers’, while embodying our pledge to go beyond. And all to bring balance back to our planet.", width=660)
 
 
         st.markdown("""
@@ -277,149 +662,68 @@ def main():
         uploaded_files = st.file_uploader("Upload", type=["xls", "xlsx"], key="file_uploader", accept_multiple_files=True)
 
     if uploaded_files:
-        # Process uploaded files
-        for uploaded_file in uploaded_files:
-            # Check the type of file by reading the sheets or some other method
-            sheet_names = pd.ExcelFile(uploaded_file).sheet_names
-            is_specific_duty = 'China' in sheet_names or 'Aluminum' in sheet_names or 'Steel' in sheet_names
-            is_addcvd = any(['ADD' in sheet for sheet in sheet_names]) or any(['CVD' in sheet for sheet in sheet_names])
-            
-            if is_addcvd:
-                # Process as ADD/CVD file
-                st.session_state['combined_addcvd_data'] = combine_data(uploaded_file)
-                with tab3:
-                    # if st.checkbox(f'Show ADD/CVD Data for {uploaded_file.name}'):
-                        with st.expander(f"Data from {uploaded_file.name}:"):
-                            st.dataframe(st.session_state['combined_addcvd_data'], use_container_width=True)
-
-            elif is_specific_duty:
-                # Process as specific duty rate file
-                st.session_state['specific_duty_data'] = process_specific_duty(uploaded_file, sheet_names[0])
-                with tab3:
-                    # if st.checkbox(f'Show {sheet_names[0]} Data for {uploaded_file.name}'):
-                        with st.expander(f"Data from {uploaded_file.name}:"):
-                            st.dataframe(st.session_state['specific_duty_data'], use_container_width=True)
-
-            else:
-                # Process as Rate of Duty file
-                st.session_state['rate_of_duty_data'] = process_rate_of_duty(uploaded_file)
-                with tab3:
-                #    if st.checkbox(f'Show General Rate of Duty Data for {uploaded_file.name}'):
-                        with st.expander(f"Data from {uploaded_file.name}:"):
-                            st.dataframe(st.session_state['rate_of_duty_data'], use_container_width=True)
+        # Schedules are read by a background job so the other tabs stay usable meanwhile
+        schedule_job = start_schedule_job(uploaded_files)
+        if not schedule_job.done:
+            with tab2:
+                st.info("Reading schedules in the background, see the progress in the sidebar.")
+        elif schedule_job.status != 'done':
+            with tab2:
+                st.error(f"Schedules were not read ({schedule_job.status}). Dismiss the job in the sidebar to read them again.")
+        else:
+            schedules_ready = True
+
+    if schedules_ready:
+        # Session state key each kind of schedule is kept under
+        session_keys = {
+            'addcvd': 'combined_addcvd_data',
+            'specific_duty': 'specific_duty_data',
+            'rate_of_duty': 'rate_of_duty_data',
+        }
+
+        # Process uploaded files, each workbook is opened, classified and parsed in one pass
+        with st.spinner("Reading schedules..."), stage_log().stage('load_schedules', files=len(uploaded_files)) as fields:
+            workbooks, workbook_errors = load_schedules(uploaded_files)
+            fields['cache_hit'] = not last_call_missed()
+        if not fields['cache_hit']:
+            # Opening/classifying and parsing were timed per file where the file was parsed
+            for workbook in workbooks:
+                stage_log().add('classify_file', workbook.stats['open_seconds'], file=workbook.name, kind=workbook.kind)
+                stage_log().add('parse_file', workbook.stats['parse_seconds'], workbook.stats['peak_parse_mb'],
+                                file=workbook.name, rows=workbook.stats['rows'])
+        for file_name, error in workbook_errors.items():
+            with tab2:
+                st.error(f"Could not read {file_name}, it is left out of the tariff data: {error}")
+        for workbook in workbooks:
+            st.session_state[session_keys[workbook.kind]] = workbook.data
+            with tab3:
+                with st.expander(f"Data from {workbook.name}:"):
+                    st.caption(f"{workbook.stats['rows']:,} rows, {workbook.stats['frame_mb']:.1f} MB in memory")
+                    display_page(workbook.data, f"workbook_{workbook.name}")
 
     with tab2:
-        if uploaded_files:
-            processed_data = merge_all_data(uploaded_files)
-            try:
-                processed_data['Tariff'] = processed_data.apply(combine_tariff_information, axis=1)
-            except Exception as e:
-                st.error(f"Error processing data: {e}")
+        if schedules_ready:
+            # The combined 'Tariff' column is built once with the merged data, see tariff_ingest.describe_tariffs
+            with stage_log().stage('merge') as fields:
+                processed_data = merge_all_data(uploaded_files)
+                fields['cache_hit'] = not last_call_missed()
+                fields['rows'] = len(processed_data)
             st.write("Processed Data (with Tariffs):")
             with st.expander('HTS Data', expanded=True):
                 # st.dataframe(processed_data, use_container_width=True)
 
-                # Assuming this function looks up tariff information based on the HTS code
-                def lookup_tariff_data(hts_code, processed_data):
-                    # Assuming there's a column 'China Tariff' in your processed_data
-                    tariff_info = processed_data[processed_data['HTS_Code'] == hts_code]
-                    if not tariff_info.empty:
-                        # Extract the specific tariff data from the dataframe
-                        return {
-                            'General_Rate_of_Duty': tariff_info['General_Rate_of_Duty'].iloc[0],
-                            'China Duties': tariff_info['China Duties'].iloc[0],
-                            'Aluminum': tariff_info['Aluminum'].iloc[0],
-                            'Steel': tariff_info['Steel'].iloc[0],
-                            'ADD/CVD Flag': tariff_info['ADD/CVD Flag'].iloc[0],
-                        }
-                    return {'China Duties': 0, 'Aluminum': 0, 'Steel': 0, 'ADD/CVD Flag': ''}
+                # Index the merged data by HTS code once, lookups below are hash probes
+                with stage_log().stage('build_index') as fields:
+                    tariff_index, prefix_index = tariff_lookup_index(processed_data)
+                    fields['cache_hit'] = not last_call_missed()
 
                 # Create an editable table
                 def display_editable_table():
-                    # Define the structure of the empty DataFrame according to the Excel sheet
-                    data_structure = {
-                        "SLB Part Number": [""],
-                        "US HTS": [""],
-                        "COO": [""],
-                        "Value": [100],
-                        "Weight": [0],
-                        "MOT": [""],
-                        "General Tariff Percentage": [0],  # To be calculated based on US HTS
-                        "COO China Tariff": [0],  # To be calculated based on COO
-                        "Aluminum Tariff": [0],  # To be calculated based on US HTS
-                        "Steel Tariff": [0],  # To be calculated based on US HTS
-                        "Potential ADD/CVD Flag": [""],  # To be determined based on US HTS and COO
-                        "CBP Merchandise Processing Fee": [31.67],  # Fixed cost for all items
-                        "CBP Harbor Maintenance Fee": [0],  # To be calculated based on Value and MOT
-                        "Tariffs & Fees to be Paid (%)": [0],  # To be calculated based on above tariffs + 0.35%
-                        "Tariffs to be Paid (USD)": [0],  # To be calculated based on Value and the total percentage
-                        "Tariffs & Fees to be Paid (USD)": [0],  # To include the $31.67 fee in the total
-                    }
-                    df = pd.DataFrame(data_structure)
-
-                    # Define column configurations with a dropdown for COO
-                    column_config = {
-                        "COO": st.column_config.SelectboxColumn(
-                            options=[
-                                "China", "USA", "Italy", "Germany", "France",
-                                "Afghanistan", "Albania", "Algeria", "Andorra", "Angola",
-                                "Argentina", "Armenia", "Australia", "Austria", "Azerbaijan",
-                                "Bahamas", "Bahrain", "Bangladesh", "Barbados", "Belarus",
-                                "Belgium", "Belize", "Benin", "Bhutan", "Bolivia",
-                                "Bosnia and Herzegovina", "Botswana", "Brazil", "Brunei", "Bulgaria",
-                                "Burkina Faso", "Burundi", "Cambodia", "Cameroon", "Canada",
-                                "Cape Verde", "Central African Republic", "Chad", "Chile", "Colombia",
-                                "Comoros", "Congo", "Costa Rica", "Croatia", "Cuba",
-                                "Cyprus", "Czech Republic", "Denmark", "Djibouti", "Dominica",
-                                "Dominican Republic", "East Timor", "Ecuador", "Egypt", "El Salvador",
-                                "Equatorial Guinea", "Eritrea", "Estonia", "Eswatini", "Ethiopia",
-                                "Fiji", "Finland", "Gabon", "Gambia", "Georgia",
-                                "Ghana", "Greece", "Grenada", "Guatemala", "Guinea",
-                                "Guinea-Bissau", "Guyana", "Haiti", "Honduras", "Hungary",
-                                "Iceland", "India", "Indonesia", "Iran", "Iraq",
-                                "Ireland", "Israel", "Jamaica", "Japan", "Jordan",
-                                "Kazakhstan", "Kenya", "Kiribati", "Kosovo", "Kuwait",
-                                "Kyrgyzstan", "Laos", "Latvia", "Lebanon", "Lesotho",
-                                "Liberia", "Libya", "Liechtenstein", "Lithuania", "Luxembourg",
-                                "Madagascar", "Malawi", "Malaysia", "Maldives", "Mali",
-                                "Malta", "Marshall Islands", "Mauritania", "Mauritius", "Mexico",
-                                "Micronesia", "Moldova", "Monaco", "Mongolia", "Montenegro",
-                                "Morocco", "Mozambique", "Myanmar", "Namibia", "Nauru",
-                                "Nepal", "Netherlands", "New Zealand", "Nicaragua", "Niger",
-                                "Nigeria", "North Korea", "North Macedonia", "Norway", "Oman",
-                                "Pakistan", "Palau", "Palestine", "Panama", "Papua New Guinea",
-                                "Paraguay", "Peru", "Philippines", "Poland", "Portugal",
-                                "Qatar", "Romania", "Russia", "Rwanda", "Saint Kitts and Nevis",
-                                "Saint Lucia", "Saint Vincent and the Grenadines", "Samoa", "San Marino", "Sao Tome and Principe",
-                                "Saudi Arabia", "Senegal", "Serbia", "Seychelles", "Sierra Leone",
-                                "Singapore", "Slovakia", "Slovenia", "Solomon Islands", "Somalia",
-                                "South Africa", "South Korea", "South Sudan", "Spain", "Sri Lanka",
-                                "Sudan", "Suriname", "Sweden", "Switzerland", "Syria",
-                                "Taiwan", "Tajikistan", "Tanzania", "Thailand", "Togo",
-                                "Tonga", "Trinidad and Tobago", "Tunisia", "Turkey", "Turkmenistan",
-                                "Tuvalu", "Uganda", "Ukraine", "United Arab Emirates", "United Kingdom",
-                                "Uruguay", "Uzbekistan", "Vanuatu", "Vatican City", "Venezuela",
-                                "Vietnam", "Yemen", "Zambia", "Zimbabwe"
-                            ],
-
-
-                            help="Select the Country of Origin"
-                        ),
-                        "MOT": st.column_config.SelectboxColumn(
-                            options=[
-                                "AIR", "TRUCK", "OCEAN", "COURIER",
-                            ],
-
-
-                            help="Select the Method of Transportation"
-                        ),
-                    }
+                    df, column_config = editor_template()
 
                     # Assuming df is your initial dataframe loaded with data
-                    input_columns = ["SLB Part Number", "US HTS", "COO", "Value", "Weight", "MOT"]
-                    outcome_columns = ["General Tariff Percentage", "COO China Tariff", "Aluminum Tariff", "Steel Tariff", 
-                                    "Potential ADD/CVD Flag", "CBP Merchandise Processing Fee", "CBP Harbor Maintenance Fee", 
-                                    "Tariffs & Fees to be Paid (%)", "Tariffs to be Paid (USD)", "Tariffs & Fees to be Paid (USD)"]
+                    input_columns = INPUT_COLUMNS
+                    outcome_columns = OUTCOME_COLUMNS
 
 
                     # Display the editable table with specified configurations
@@ -434,109 +738,46 @@ def main():
 
                     # Apply the cleaning function to the HTS codes column after the user input
                     if 'US HTS' in new_df.columns:
-                        new_df['US HTS'] = new_df['US HTS'].apply(clean_hts_code)
+                        new_df['US HTS'] = normalize_hts_codes(new_df['US HTS']).fillna('')
+
+                    # The MPF minimum and maximum apply per customs entry, not per line
+                    if st.checkbox("All lines are one customs entry", key="single_entry",
+                                   help="Apply the Merchandise Processing Fee limits to the total value of the table"):
+                        new_df['Entry Number'] = 1
 
                     # After editing, you can combine new_df with the outcome columns to get the full table
                     full_df = pd.concat([new_df, df[outcome_columns]], axis=1)
 
-                    # Ensure CBP Merchandise Processing Fee is set for all rows
-                    full_df['CBP Merchandise Processing Fee'] = full_df['CBP Merchandise Processing Fee'].fillna(31.67)
-
                     st.session_state['user_data'] = full_df
-                    st.session_state['new_df'] = new_df
-
-                    def parse_general_rate(rate, value, weight):
-                        # Convert rate to string if it's not already a string
-                        rate_str = str(rate)
-                        
-                        try:
-                            if '%' in rate_str:
-                                # If the rate is a simple percentage
-                                return float(rate_str.replace('%', '')) / 100
-                            elif '/kg' in rate_str or '/liter' in rate_str:
-                                # If the rate is a currency per weight or per liter
-                                rate_value = float(rate_str.split('/')[0].replace('¢', '').replace('$', ''))
-                                if '¢' in rate_str:
-                                    rate_value /= 100  # Convert cents to dollars
-                                # Return total cost based on weight or volume
-                                return (rate_value * weight) / value
-                            elif '+' in rate_str:
-                                # If the rate has a fixed part and a percentage part, like "$1.035/kg + 17%"
-                                fixed_part, percentage_part = rate_str.split(' + ')
-                                fixed_rate = parse_general_rate(fixed_part, value, weight)
-                                percentage_rate = parse_general_rate(percentage_part, value, weight)
-                                return fixed_rate + percentage_rate
-                            elif '$' in rate_str:
-                                # If the rate is a fixed currency amount (assumed per kg for this calculation)
-                                return (float(rate_str.replace('$', '')) * weight) / value
-                            else:
-                                # If the rate is already a float, assume it's a direct percentage
-                                return float(rate) / 100
-                        except ValueError:
-                            return 0
-
-
-                    # Inside your 'Update Tariffs' checkbox block
-                    # if st.checkbox('Update Tariffs', value=True):  
-                    Total_Tariffs = 0  # Initialize total tariffs sum
-                    for index, row in new_df.iterrows():
-                        hts_code = row['US HTS']
-                        weight = row.get('Weight', 0)  # Ensure there is a default weight value
-                        value = row.get('Value', 1)  # Ensure there is a default value
-
-                        if hts_code:
-                            tariff_info = lookup_tariff_data(hts_code, processed_data)
-                            general_rate = tariff_info.get('General_Rate_of_Duty', '0%')
-                            general_tariff_percentage = parse_general_rate(general_rate, value, weight)
-                            
-                            # Initialize tariffs to 0
-                            china_duties = 0
-                            aluminum_tariff = 0
-                            steel_tariff = 0
-
-                            # general_tariff_percentage = parse_tariff(tariff_info.get('General_Rate_of_Duty', '0%'), row.get('Weight', 0))
-
-                            # Apply tariffs based on the conditions
-                            if row['COO'] == 'China':
-                                china_duties = float(tariff_info.get('China Duties', 0) or 0)
-                            aluminum_tariff = float(tariff_info.get('Aluminum Tariff', 0) or 0)
-                            steel_tariff = float(tariff_info.get('Steel Tariff', 0) or 0)
-
-                            # Update the dataframe with the retrieved tariff information
-                            new_df.at[index, 'General Tariff Percentage'] = general_tariff_percentage*10000
-                            new_df.at[index, 'COO China Tariff'] = china_duties*100
-                            new_df.at[index, 'Aluminum Tariff'] = aluminum_tariff
-                            new_df.at[index, 'Steel Tariff'] = steel_tariff
-                            new_df.at[index, 'Potential ADD/CVD Flag'] = tariff_info.get('ADD/CVD Flag', '')
-
-                            # Calculate 'Tariffs & Fees to be Paid (%)'
-                            total_percentage = (general_tariff_percentage + china_duties + aluminum_tariff + steel_tariff + 31.67/value)*100
-                            new_df.at[index, 'Tariffs & Fees to be Paid (%)'] = total_percentage
-
-                            # Calculate 'Tariffs to be Paid (USD)'
-                            total_tariffs = (general_tariff_percentage + china_duties + aluminum_tariff + steel_tariff)*value
-                            new_df.at[index, 'Tariffs to be Paid (USD)'] = total_tariffs
-
-                            # Calculate 'Tariffs & Fees to be Paid (USD)'
-                            total_percentage_usd = (general_tariff_percentage + china_duties + aluminum_tariff + steel_tariff)*value + 31.67
-                            new_df.at[index, 'Tariffs & Fees to be Paid (USD)'] = total_percentage_usd
-                            
-                            Total_Tariffs += new_df.at[index, 'Tariffs & Fees to be Paid (USD)']
 
-                    try:  
-                        if 'CBP Merchandise Processing Fee' not in new_df.columns:
-                            new_df['CBP Merchandise Processing Fee'] = 31.67
+                    # Results of earlier reruns are reused per line, they only hold for the same schedules
+                    version = schedule_version(uploaded_files)
+                    if st.session_state.get('row_cache_schedules') != version:
+                        st.session_state['row_cache'] = None
+                        st.session_state['row_cache_schedules'] = version
+
+                    # Compute the outcome columns, only new or edited lines are looked up and evaluated,
+                    # and then only for parts the part cache has not seen with these schedules
+                    with stage_log().stage('calculate', lines=len(new_df)) as fields:
+                        new_df, st.session_state['row_cache'] = calculate_tariffs_incremental(
+                            new_df, tariff_index, prefix_index, st.session_state['row_cache'],
+                            calculate=lambda lines: calculate_tariffs_cached(lines, tariff_index, prefix_index, part_cache(), version))
+                        fields['cached_lines'] = new_df.attrs['cached_lines']
+                    log_calculation(new_df)
+                    Total_Tariffs = new_df['Tariffs & Fees to be Paid (USD)'].sum()
+                    st.session_state['new_df'] = new_df
 
-                        if 'CBP Harbor Maintenance Fee' not in new_df.columns:
-                            new_df['CBP Harbor Maintenance Fee'] = 0
+                    # Lines whose General Rate of Duty could not be parsed are left blank, say why
+                    for rate_error in new_df.attrs.get('unparsed_rates', []):
+                        st.warning(rate_error)
 
-                        # Now define the outcome columns for display
-                        outcome_columns = [
-                            "General Tariff Percentage", "COO China Tariff", "Aluminum Tariff", "Steel Tariff", 
-                            "Potential ADD/CVD Flag", "CBP Merchandise Processing Fee", "CBP Harbor Maintenance Fee", 
-                            "Tariffs & Fees to be Paid (%)", "Tariffs to be Paid (USD)", "Tariffs & Fees to be Paid (USD)"
-                        ]
+                    # Codes that are not listed exactly were costed at their heading/subheading
+                    fallback_lines = (new_df['HTS Match Level'] > 0) & (new_df['HTS Match Level'] < new_df['US HTS'].str.len())
+                    if fallback_lines.any():
+                        st.info(f"{int(fallback_lines.sum())} line(s) matched a shorter heading or subheading in the schedule "
+                                "instead of their full HTS code.")
 
+                    try:  
                         # Filter 'new_df' to get only the outcome columns for display
                         outcome_df = new_df[outcome_columns]
 
@@ -568,72 +809,89 @@ def main():
                         # Function to convert and download dataframe to Excel
                         # -----------------------------------------------------------------------------
         
-                        # Define the order of the columns as they should appear in the exported file
-                        column_order = [
-                            "SLB Part Number", "US HTS", "COO", "Value", "Weight", "MOT",
-                            "General Tariff Percentage", "COO China Tariff", "Aluminum Tariff", "Steel Tariff",
-                            "Potential ADD/CVD Flag", "CBP Merchandise Processing Fee", "CBP Harbor Maintenance Fee",
-                            "Tariffs & Fees to be Paid (%)", "Tariffs to be Paid (USD)", "Tariffs & Fees to be Paid (USD)"
-                        ]
-        
-                        # Ensure new_df columns are in the correct order
-                        new_df = st.session_state['new_df'][column_order]
-                        
-                        # Calculate the total tariffs if not already done
-                        Total_Tariffs = new_df['Tariffs & Fees to be Paid (USD)'].sum()
-                        
-                        # Add the Total_Tariffs to the new_df
-                        total_row_data = [None]*(len(column_order)-1) + [Total_Tariffs]
-                        total_row_df = pd.DataFrame([total_row_data], columns=column_order)
-                        new_df = pd.concat([new_df, total_row_df], ignore_index=True)
-        
-                        
-                        # Call the function to make the download button available in the Streamlit app
-                        # Function to convert DataFrame to Excel
-                        def to_excel(df):
-                            # Create a BytesIO buffer to hold the Excel file in memory
-                            output = BytesIO()
-                            
-                            # Create a Pandas Excel writer using the 'openpyxl' engine and the BytesIO buffer
-                            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                                # Write the DataFrame to the Excel writer
-                                df.to_excel(writer, index=False, sheet_name='Sheet1')
-                                
-                                # Access the openpyxl workbook and worksheet objects to apply styles
-                                workbook = writer.book
-                                worksheet = writer.sheets['Sheet1']
-                        
-                                # Define the font style for the total row
-                                bold_red_font = Font(bold=True, color="FF0000")
-                                
-                                # Get the max row (last row) in the worksheet
-                                max_row = worksheet.max_row
-                                
-                                # Apply the font style to all cells in the last row
-                                for row in worksheet.iter_rows(min_row=max_row, max_row=max_row):
-                                    for cell in row:
-                                        cell.font = bold_red_font
-                            
-                            # At this point, the ExcelWriter context is closed and the data is saved to the output buffer
-                            return output.getvalue()
-                        
-                        def download_excel(df):
-                            excel_data = to_excel(df)
-                            st.download_button(label='📥 Download Excel',
-                                               data=excel_data,
-                                               file_name='tariff_data.xlsx',
-                                               mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        
-        
                         # Ensure new_df is available in the session state before attempting to download
                         if 'new_df' in st.session_state:
-                            download_excel(new_df)
+                            download_results(st.session_state['new_df'])
                         else:
                             st.error("No data available to download.")
                     
                     except:
                         pass    
-                display_editable_table()     
+
+                    return new_df
+
+                # Bulk import of shipment manifests, costed in batches instead of through the editor
+                def display_manifest_import():
+                    manifest_file = st.file_uploader(f"Upload a manifest (CSV or Excel) with the columns: {', '.join(INPUT_COLUMNS)}",
+                                                     type=["csv", "xlsx"], key="manifest_uploader")
+                    as_of = st.checkbox("Cost each line against the tariff snapshot in force on its Entry Date",
+                                        key="manifest_as_of", disabled=list_snapshots().empty,
+                                        help="Uses the snapshots saved under Data Description instead of the uploaded schedules. "
+                                             "Lines without an Entry Date are costed as of today.")
+                    if not manifest_file:
+                        return None
+
+                    # Only re-cost when the manifest, the schedules or the costing mode change, not on every rerun.
+                    # Costing runs as a background job, its result is moved into the session once it is done.
+                    manifest_key = (manifest_file.file_id, schedule_version(uploaded_files), as_of)
+                    if st.session_state.get('manifest_key') != manifest_key:
+                        job = st.session_state.get('manifest_job')
+                        if job is None or job.key != manifest_key:
+                            if job is not None:
+                                job.cancel()
+                            job = track_job(job_runner().submit("Cost manifest", cost_manifest_job,
+                                                                (named_copy(manifest_file), tariff_index, prefix_index, as_of,
+                                                                 part_cache(), schedule_version(uploaded_files)),
+                                                                key=manifest_key))
+                            st.session_state['manifest_job'] = job
+                        if not job.done:
+                            st.info("Costing the manifest in the background, see the progress in the sidebar.")
+                            return None
+                        if job.status != 'done':
+                            st.error(f"Error reading manifest: {job.error or job.status}")
+                            if st.button("Cost again", key="manifest_retry"):
+                                st.session_state.pop('manifest_job', None)
+                                st.rerun()
+                            return None
+                        manifest_results, unparsed_rates = job.result
+                        stage_log().add('cost_manifest', job.seconds, lines=len(manifest_results))
+                        st.session_state['manifest_results'] = manifest_results
+                        st.session_state['manifest_unparsed_rates'] = unparsed_rates
+                        st.session_state['manifest_key'] = manifest_key
+
+                    manifest_results = st.session_state['manifest_results']
+                    for rate_error in st.session_state['manifest_unparsed_rates']:
+                        st.warning(rate_error)
+                    st.write(f"**{len(manifest_results):,} lines, Total Tariffs & Fees to be Paid (USD): "
+                             f"{manifest_results['Tariffs & Fees to be Paid (USD)'].sum()}**")
+
+                    # Only the current page is sent to the browser
+                    columns = INPUT_COLUMNS + OUTCOME_COLUMNS + [column for column in ['Snapshot Version'] if column in manifest_results]
+                    display_page(manifest_results, 'manifest', columns=columns)
+
+                    download_results(manifest_results, file_name='manifest_tariff_data', key='manifest_download')
+                    return manifest_results
+
+                entry_mode = st.radio("Entry mode", ["Editor", "Manifest upload"], horizontal=True, key="entry_mode")
+                if entry_mode == "Manifest upload":
+                    entries = display_manifest_import()
+                else:
+                    entries = display_editable_table()
+
+            # What-if costing of the same lines, against the uploaded schedules
+            if entries is not None and len(entries):
+                display_scenario_sweep(entries, tariff_index, prefix_index, schedule_version(uploaded_files))
+
+            with tab3:
+                display_tariff_explorer(processed_data)
+                report_memory([workbooks, processed_data, tariff_index], list(session_keys.values()))
+
+    with tab3:
+        # Only a complete upload can be saved as a snapshot
+        display_snapshots(uploaded_files if schedules_ready and not workbook_errors else None)
+        display_diagnostics()
+
+    display_jobs()
                 
 
 if __name__ == "__main__":
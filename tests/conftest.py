@@ -0,0 +1,39 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the repository root, next to tariffs.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duty_rules import RULE_COLUMNS, compile_rules  # noqa: E402
+from tariff_engine import build_prefix_index, build_tariff_index  # noqa: E402
+
+
+@pytest.fixture
+def rules():
+    # Section 301/232 duties from the schedule columns, the FY2025 MPF and the HMF on ocean shipments
+    return compile_rules(pd.DataFrame([
+        ['schedule', 'china', 'China', '', '*', None, None, None, '', '', ''],
+        ['schedule', 'aluminum', '*', '', '*', None, None, None, '', '', ''],
+        ['schedule', 'steel', '*', '', '*', None, None, None, '', '', ''],
+        ['mpf', 'mpf', '*', '', '*', 0.003464, 32.71, 634.62, '', '', ''],
+        ['hmf', 'hmf', '*', '', 'OCEAN', 0.00125, None, None, '', '', ''],
+    ], columns=RULE_COLUMNS))
+
+
+@pytest.fixture
+def indexes():
+    # (tariff_index, prefix_index) of a small merged schedule
+    merged = pd.DataFrame({
+        'HTS_Code': ['84818000', '73041910', '76061100', '99999999'],
+        'General_Rate_of_Duty': ['5%', '$1.035/kg + 2%', 'Free', 'See heading 9903'],
+        'China Duties': [0.25, np.nan, 0.25, 0],
+        'Aluminum': [0, 0, 0.1, 0],
+        'Steel': [0, 0.25, 0, 0],
+        'ADD/CVD': [np.nan, 'ADD', np.nan, np.nan],
+    })
+    tariff_index = build_tariff_index(merged)
+    return tariff_index, build_prefix_index(tariff_index)
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cbp_fees import FEE_PARAMETER_COLUMNS, entry_fees
+
+MPF_RATE, MPF_MINIMUM, MPF_MAXIMUM = 0.003464, 32.71, 634.62
+
+
+def parameters(lines, hmf_rate=np.nan):
+    return pd.DataFrame([[MPF_RATE, MPF_MINIMUM, MPF_MAXIMUM, hmf_rate]] * lines, columns=FEE_PARAMETER_COLUMNS)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (1000.0, MPF_MINIMUM),         # 3.46 is below the minimum
+    (50000.0, 50000 * MPF_RATE),   # 173.20 is between the limits
+    (1000000.0, MPF_MAXIMUM),      # 3464.00 is above the maximum
+])
+def test_single_line_entry_is_capped(value, expected):
+    mpf, hmf = entry_fees([value], parameters(1))
+    assert mpf == pytest.approx([expected])
+    assert hmf == pytest.approx([0.0])
+
+
+def test_minimum_applies_once_per_entry():
+    # Costed per line each line would pay the 32.71 minimum, the entry pays 10,000 * rate once
+    mpf, _ = entry_fees([5000.0, 5000.0], parameters(2), entry_numbers=['E1', 'E1'])
+    assert mpf.sum() == pytest.approx(10000 * MPF_RATE)
+    assert mpf == pytest.approx([5000 * MPF_RATE] * 2)
+
+
+def test_minimum_of_a_small_entry_is_shared_by_value():
+    mpf, _ = entry_fees([100.0, 300.0], parameters(2), entry_numbers=['E1', 'E1'])
+    assert mpf == pytest.approx([MPF_MINIMUM / 4, MPF_MINIMUM * 3 / 4])
+
+
+def test_maximum_applies_once_per_entry():
+    mpf, _ = entry_fees([100000.0, 100000.0, 200000.0], parameters(3), entry_numbers=[7, 7, 7])
+    assert mpf.sum() == pytest.approx(MPF_MAXIMUM)
+    assert mpf == pytest.approx([MPF_MAXIMUM / 4, MPF_MAXIMUM / 4, MPF_MAXIMUM / 2])
+
+
+def test_lines_without_an_entry_number_are_entries_of_their_own():
+    mpf, _ = entry_fees([1000.0, 1000.0, 1000.0, 1000.0], parameters(4), entry_numbers=['E1', 'E1', '', None])
+    assert mpf == pytest.approx([MPF_MINIMUM / 2, MPF_MINIMUM / 2, MPF_MINIMUM, MPF_MINIMUM])
+    mpf, _ = entry_fees([1000.0, 1000.0], parameters(2))
+    assert mpf == pytest.approx([MPF_MINIMUM, MPF_MINIMUM])
+
+
+def test_lines_without_fee_rules_pay_nothing_and_do_not_count_towards_the_entry():
+    fees = parameters(2)
+    fees.loc[1, ['MPF Rate', 'MPF Minimum', 'MPF Maximum']] = np.nan
+    mpf, _ = entry_fees([100000.0, 1000000.0], fees, entry_numbers=['E1', 'E1'])
+    assert mpf == pytest.approx([100000 * MPF_RATE, 0.0])
+
+
+def test_harbor_maintenance_fee_is_per_line_without_limits():
+    _, hmf = entry_fees([1000.0, 2000000.0], parameters(2, hmf_rate=0.00125), entry_numbers=['E1', 'E1'])
+    assert hmf == pytest.approx([1.25, 2500.0])
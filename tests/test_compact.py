@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tariff_engine import OUTCOME_COLUMNS, build_prefix_index, build_tariff_index, calculate_tariffs
+from tariff_ingest import compact_merged_data
+
+
+@pytest.fixture
+def merged():
+    # A merged table as merge_frames builds it: 84818000 is on the ADD and the CVD sheet
+    return pd.DataFrame({
+        'HTS_Code': ['84818000', '84818000', '73041910', '76061100', '76061200'],
+        'ADD/CVD': ['ADD', 'CVD', 'ADD', np.nan, np.nan],
+        'General_Rate_of_Duty': ['5%', '5%', '$1.035/kg + 2%', 'Free', 'Free'],
+        'China Duties': [0.25, 0.25, 0.075, 0.1, 0.1],
+        'Aluminum': [0.0, 0.0, 0.0, 0.075, 0.1],
+        'Steel': [0.0, 0.0, 0.25, 0.0, 0.0],
+    })
+
+
+def cost(merged, rules):
+    tariff_index = build_tariff_index(merged)
+    lines = pd.DataFrame({
+        'SLB Part Number': ['P1', 'P2', 'P3', 'P4'],
+        'US HTS': ['84818000', '73041910', '76061100', '76061200'],
+        'COO': ['China', 'China', 'Canada', 'China'],
+        'Value': [1000.0, 2000.0, 1000.0, 3333.33],
+        'Weight': [10.0, 100.0, 5.0, 7.5],
+        'MOT': ['AIR', 'OCEAN', 'TRUCK', 'AIR'],
+    })
+    return calculate_tariffs(lines, tariff_index, build_prefix_index(tariff_index), rules)
+
+
+def test_one_row_per_code_with_all_case_labels(merged):
+    compact = compact_merged_data(merged)
+    assert compact['HTS_Code'].tolist() == ['84818000', '73041910', '76061100', '76061200']
+    assert compact['ADD/CVD'].astype(object).where(compact['ADD/CVD'].notna(), None).tolist() == ['ADD/CVD', 'ADD', None, None]
+
+
+def test_repetitive_text_becomes_categorical_with_the_same_values():
+    rates = ['5%', 'Free', 'Free', '5%', 'Free', 0.02]
+    compact = compact_merged_data(pd.DataFrame({'HTS_Code': [f'848180{code:02d}' for code in range(6)],
+                                                'General_Rate_of_Duty': rates}))
+    assert isinstance(compact['General_Rate_of_Duty'].dtype, pd.CategoricalDtype)
+    assert compact['General_Rate_of_Duty'].tolist() == ['5%', 'Free', 'Free', '5%', 'Free', '0.02']
+
+
+def test_rates_keep_full_precision(merged, rules):
+    compact = compact_merged_data(merged)
+    assert compact['Aluminum'].dtype == np.float64
+    result = cost(compact, rules)
+    assert result.loc[2, 'Aluminum Tariff'] == 0.075
+    assert result.loc[2, 'Tariffs to be Paid (USD)'] == 75.0
+
+
+def test_compact_table_costs_like_the_merged_table(merged, rules):
+    expected = cost(merged.drop_duplicates(subset='HTS_Code'), rules)
+    result = cost(compact_merged_data(merged), rules)
+    columns = [column for column in OUTCOME_COLUMNS if column != 'Potential ADD/CVD Flag']
+    pd.testing.assert_frame_equal(result[columns], expected[columns], check_exact=True)
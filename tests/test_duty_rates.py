@@ -0,0 +1,42 @@
+import pytest
+
+from duty_rates import ZERO_RATE, parse_rate
+
+
+@pytest.mark.parametrize('rate, expected', [
+    ('Free', ZERO_RATE),
+    ('free', ZERO_RATE),
+    ('', ZERO_RATE),
+    (float('nan'), ZERO_RATE),
+    ('0%', ZERO_RATE),
+    ('Free (A+,AU,BH,CL)', ZERO_RATE),
+    ('6.5%', (0.065, 0.0, 0.0, 0.0)),
+    ('6.5% 1/', (0.065, 0.0, 0.0, 0.0)),
+    ('5', (0.05, 0.0, 0.0, 0.0)),
+    (5, (0.05, 0.0, 0.0, 0.0)),
+    ('2.5¢/kg', (0.0, 0.025, 0.0, 0.0)),
+    ('2.5c/kg', (0.0, 0.025, 0.0, 0.0)),
+    ('$1.035/kg + 17%', (0.17, 1.035, 0.0, 0.0)),
+    ('$2', (0.0, 2.0, 0.0, 0.0)),
+    ('30¢/g', (0.0, 300.0, 0.0, 0.0)),
+    ('$5/t', (0.0, 0.005, 0.0, 0.0)),
+    ('19¢/liter', (0.0, 0.0, 0.19, 0.0)),
+    ('$1/each', (0.0, 0.0, 0.0, 1.0)),
+    ('$1/pr.', (0.0, 0.0, 0.0, 0.5)),
+    ('$1.20/doz.', (0.0, 0.0, 0.0, 0.1)),
+    ('2%-5%', (0.05, 0.0, 0.0, 0.0)),
+    ('1.5¢/kg to 3¢/kg', (0.0, 0.03, 0.0, 0.0)),
+    ('4.4¢/kg + 6%', (0.06, 0.044, 0.0, 0.0)),
+])
+def test_parse_rate(rate, expected):
+    parsed = parse_rate(rate)
+    assert parsed.error is None
+    assert parsed[:4] == pytest.approx(tuple(expected[:4]))
+
+
+@pytest.mark.parametrize('rate', ['See 9903.88.01', '5%/kg', '$1/barrel', '6.5% + abc'])
+def test_unparsed_rates_report_an_error(rate):
+    parsed = parse_rate(rate)
+    assert parsed.error is not None
+    assert rate in parsed.error
+    assert parsed[:4] == (0.0, 0.0, 0.0, 0.0)
@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from duty_rules import RULE_COLUMNS, compile_rules, match_rules
+
+
+def rules(*rows):
+    # rows of (rule, component, country, hts_prefix, mot, rate, effective_from, effective_to)
+    frame = pd.DataFrame([dict(zip(['rule', 'component', 'country', 'hts_prefix', 'mot', 'rate',
+                                    'effective_from', 'effective_to'], row)) for row in rows])
+    return compile_rules(frame.reindex(columns=RULE_COLUMNS))
+
+
+def winning_rates(table, codes, countries, mots, entry_dates=None, component='china'):
+    matched = match_rules(table, codes, countries, mots, entry_dates)
+    matched = matched[matched['component'] == component].set_index('line')['rate']
+    return [matched.get(line) for line in range(len(codes))]
+
+
+def test_longest_prefix_wins_over_country():
+    table = rules(('additional', 'china', 'China', '', '*', 0.25, '', ''),
+                  ('additional', 'china', '*', '8481', '*', 0.10, '', ''),
+                  ('additional', 'china', '*', '848180', '*', 0.05, '', ''))
+    assert winning_rates(table, ['84818000', '84819000', '73041910'], ['China'] * 3, ['AIR'] * 3) == [0.05, 0.10, 0.25]
+
+
+def test_named_country_and_mot_win_over_wildcards():
+    table = rules(('additional', 'china', '*', '8481', '*', 0.10, '', ''),
+                  ('additional', 'china', 'China', '8481', '*', 0.20, '', ''),
+                  ('additional', 'china', 'China', '8481', 'OCEAN', 0.30, '', ''))
+    assert winning_rates(table, ['84818000'] * 3, ['Germany', 'China', ' china '], ['AIR', 'AIR', 'ocean']) == [0.10, 0.20, 0.30]
+
+
+def test_later_row_wins_a_tie():
+    table = rules(('additional', 'china', 'China', '', '*', 0.25, '', ''),
+                  ('additional', 'china', 'China', '', '*', 0.075, '', ''))
+    assert winning_rates(table, ['84818000'], ['China'], ['AIR']) == [0.075]
+
+
+def test_rules_without_a_match_leave_the_line_out():
+    table = rules(('additional', 'china', 'China', '8481', 'OCEAN', 0.25, '', ''))
+    assert winning_rates(table, ['84818000', '73041910', '84818000'], ['China', 'China', 'Germany'],
+                         ['OCEAN', 'OCEAN', 'OCEAN']) == [0.25, None, None]
+    assert winning_rates(table, ['84818000'], ['China'], ['AIR']) == [None]
+
+
+def test_rules_apply_between_their_dates():
+    table = rules(('additional', 'china', 'China', '', '*', 0.10, '2018-07-06', '2019-05-09'),
+                  ('additional', 'china', 'China', '', '*', 0.25, '2019-05-10', ''))
+    dates = ['2018-01-01', '2018-07-06', '2019-05-09', '2019-05-10', '2024-01-01']
+    assert winning_rates(table, ['84818000'] * 5, ['China'] * 5, ['AIR'] * 5, dates) == [None, 0.10, 0.10, 0.25, 0.25]
+
+
+def test_lines_without_a_date_use_the_rules_in_force_today():
+    table = rules(('additional', 'china', 'China', '', '*', 0.10, '2018-07-06', '2019-05-09'),
+                  ('additional', 'china', 'China', '', '*', 0.25, '2019-05-10', ''))
+    assert winning_rates(table, ['84818000'] * 2, ['China'] * 2, ['AIR'] * 2, [None, '']) == [0.25, 0.25]
+    assert winning_rates(table, ['84818000'], ['China'], ['AIR'], '2019-01-01') == [0.10]
+
+
+def test_components_are_matched_separately():
+    table = rules(('schedule', 'china', 'China', '', '*', None, '', ''),
+                  ('schedule', 'steel', '*', '', '*', None, '', ''),
+                  ('exemption', 'steel', 'Mexico', '7304', '*', None, '', ''))
+    matched = match_rules(table, ['73041910', '73041910'], ['China', 'Mexico'], ['AIR', 'AIR'])
+    winners = {(line, component): rule for line, component, rule in matched[['line', 'component', 'rule']].itertuples(index=False)}
+    assert winners == {(0, 'china'): 'schedule', (0, 'steel'): 'schedule', (1, 'steel'): 'exemption'}
+
+
+def test_invalid_rules_are_reported_by_row():
+    with pytest.raises(ValueError, match="row 3: 'additional' rule without a rate"):
+        rules(('schedule', 'china', 'China', '', '*', None, '', ''),
+              ('additional', 'china', 'China', '', '*', None, '', ''))
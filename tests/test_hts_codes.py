@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from tariff_ingest import HTS_CODE_DTYPE, normalize_hts_codes
+
+
+@pytest.mark.parametrize('code, expected', [
+    # Text
+    ('8481.80.00', '84818000'),
+    (' 8481.80.1000 ', '8481801000'),
+    ('84818000', '84818000'),
+    ('0101.21.00', '01012100'),
+    ('1012100', '01012100'),
+    ('8481', '8481'),
+    ('848180', '848180'),
+    ('9903.88.01', '99038801'),
+    # Floats, as Excel hands over numeric cells
+    (8481.8, '848180'),
+    (8481.80, '848180'),
+    (101.21, '010121'),
+    (8481.801, '84818010'),
+    (84818000.0, '84818000'),
+    # Ints
+    (84818000, '84818000'),
+    (1012100, '01012100'),
+    (848180100, '0848180100'),
+    (8481, '8481'),
+])
+def test_normalize_hts_codes(code, expected):
+    assert normalize_hts_codes(pd.Series([code], dtype=object)).tolist() == [expected]
+
+
+def test_mixed_column_keeps_blanks_missing():
+    codes = pd.Series(['8481.80.00', 8481.8, 84818000, None, '', 'n/a'], dtype=object)
+    normalized = normalize_hts_codes(codes)
+    assert normalized.dtype == HTS_CODE_DTYPE
+    assert normalized[:3].tolist() == ['84818000', '848180', '84818000']
+    assert normalized[3:5].isna().all()
+    assert normalized[5] == 'n/a'
+
+
+def test_numeric_columns():
+    assert normalize_hts_codes(pd.Series([8481.8, 101.21])).tolist() == ['848180', '010121']
+    assert normalize_hts_codes(pd.Series([84818000, 1012100])).tolist() == ['84818000', '01012100']
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tariff_engine import build_prefix_index, build_tariff_index, calculate_tariffs, lookup_tariffs
+from tariff_snapshots import affected_parts
+
+
+def indexes(rows):
+    # rows of (HTS_Code, ADD/CVD, General_Rate_of_Duty, Steel), as the outer join of the schedules gives them
+    merged = pd.DataFrame(rows, columns=['HTS_Code', 'ADD/CVD', 'General_Rate_of_Duty', 'Steel'])
+    tariff_index = build_tariff_index(merged)
+    return tariff_index, build_prefix_index(tariff_index)
+
+
+def lookup(rows, codes):
+    tariff_index, prefix_index = indexes(rows)
+    return lookup_tariffs(tariff_index, pd.Series(codes), prefix_index).reset_index(drop=True)
+
+
+def test_heading_case_flags_a_listed_line():
+    found = lookup([('7304', 'ADD', np.nan, np.nan), ('7304190000', np.nan, '2%', np.nan)], ['7304190000', '73041950'])
+    assert found['ADD/CVD Flag'].tolist() == ['ADD', 'ADD']
+    assert found.loc[0, 'General_Rate_of_Duty'] == '2%'
+    assert pd.isna(found.loc[1, 'General_Rate_of_Duty'])
+    assert found.loc[0, 'HTS_Level'] == 10
+
+
+def test_flags_of_every_level_are_joined():
+    found = lookup([('7304', 'CVD', np.nan, np.nan), ('730419', 'ADD/CVD', np.nan, np.nan),
+                    ('7304190000', 'ADD', '2%', np.nan)], ['7304190000'])
+    assert found.loc[0, 'ADD/CVD Flag'] == 'ADD/CVD'
+
+
+def test_case_list_line_takes_the_rates_of_its_heading():
+    found = lookup([('7304190000', 'ADD', np.nan, np.nan), ('73041900', np.nan, '$1.035/kg + 2%', np.nan),
+                    ('7304', np.nan, '5%', 0.25)], ['7304190000'])
+    assert found.loc[0, 'General_Rate_of_Duty'] == '$1.035/kg + 2%'
+    assert found.loc[0, 'Steel'] == 0.25
+    assert found.loc[0, 'ADD/CVD Flag'] == 'ADD'
+    assert found.loc[0, 'HTS_Level'] == 8
+
+
+def test_unlisted_codes_get_the_defaults():
+    found = lookup([('7304190000', 'ADD', '2%', np.nan)], ['8481800000', ''])
+    assert found['General_Rate_of_Duty'].tolist() == ['0%', '0%']
+    assert found['ADD/CVD Flag'].tolist() == ['', '']
+    assert found['HTS_Level'].tolist() == [0, 0]
+
+
+def test_line_without_a_general_rate_at_any_level_is_reported(rules):
+    tariff_index, prefix_index = indexes([('7304190000', 'ADD', np.nan, np.nan), ('84818000', np.nan, '5%', np.nan)])
+    lines = pd.DataFrame({'SLB Part Number': ['P1', 'P2'], 'US HTS': ['7304190000', '84818000'], 'COO': ['Germany'] * 2,
+                          'Value': [1000.0] * 2, 'Weight': [10.0] * 2, 'MOT': ['AIR'] * 2})
+    result = calculate_tariffs(lines, tariff_index, prefix_index, rules)
+    assert np.isnan(result.loc[0, 'Tariffs to be Paid (USD)'])
+    assert result.loc[0, 'Potential ADD/CVD Flag'] == 'ADD'
+    assert result.attrs['unparsed_rates'] == ["No General Rate of Duty is listed for HTS 7304190000 or its headings"]
+    assert result.loc[1, 'Tariffs to be Paid (USD)'] == pytest.approx(50.0)
+
+
+def test_a_changed_heading_affects_lines_listed_on_their_own():
+    old = indexes([('7304', np.nan, np.nan, np.nan), ('7304190000', np.nan, '2%', np.nan)])
+    new = indexes([('7304', 'ADD', np.nan, np.nan), ('7304190000', np.nan, '2%', np.nan)])
+    entries = pd.DataFrame({'SLB Part Number': ['P1', 'P2'], 'US HTS': ['7304190000', '84818000']})
+    diff = pd.DataFrame({'HTS_Code': ['7304']})
+    assert affected_parts(entries, diff, old, new)['SLB Part Number'].tolist() == ['P1']
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from tariff_engine import OUTCOME_COLUMNS, calculate_tariffs, calculate_tariffs_incremental
+
+
+def test_incremental_matches_full_calculation(indexes, rules):
+    rng = np.random.default_rng(0)
+    count = 200
+    lines = pd.DataFrame({
+        'SLB Part Number': [f'P{number}' for number in range(count)],
+        'US HTS': rng.choice(['84818000', '73041910', '76061100', '8481800010', '99999999', ''], size=count),
+        'COO': rng.choice(['China', 'Germany', 'Canada'], size=count),
+        'Value': rng.choice([100.0, 1000.0, 25000.0, 300000.0], size=count),
+        'Weight': rng.choice([1.0, 10.0, 250.0], size=count),
+        'MOT': rng.choice(['AIR', 'OCEAN', 'TRUCK'], size=count),
+    })
+    lines['Entry Number'] = rng.choice(['E1', 'E2', 'E3', ''], size=count)
+
+    # Start with part of the table, then cost the whole table with some lines edited
+    _, row_cache = calculate_tariffs_incremental(lines[:120], *indexes, rules=rules)
+    edited = lines.copy()
+    edited.loc[::7, 'Value'] = edited.loc[::7, 'Value'] * 2
+    edited.loc[::11, 'COO'] = 'China'
+    incremental, row_cache = calculate_tariffs_incremental(edited, *indexes, row_cache, rules=rules)
+    full = calculate_tariffs(edited, *indexes, rules=rules)
+
+    assert incremental.attrs['cached_lines'] > 0
+    pd.testing.assert_frame_equal(incremental[OUTCOME_COLUMNS], full[OUTCOME_COLUMNS], check_dtype=False)
+    assert incremental.attrs['unparsed_rates'] == full.attrs['unparsed_rates']
@@ -0,0 +1,69 @@
+import threading
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from tariff_ingest import IngestCancelled, _parse_sheet, iter_sheet_chunks, load_workbooks, stream_sheet
+from tariff_jobs import JobRunner
+
+
+@pytest.fixture
+def general(tmp_path):
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.append(['HTS Number', 'General Rate of Duty'])
+    for code in range(10):
+        worksheet.append([f'8481.80.{code:02d}', '5%'])
+    path = tmp_path / 'general.xlsx'
+    workbook.save(path)
+    return path
+
+
+def test_single_workbook_is_read(general):
+    workbooks, errors = load_workbooks([general])
+    assert errors == {}
+    assert [workbook.kind for workbook in workbooks] == ['rate_of_duty']
+    assert len(workbooks[0].data) == 10
+
+
+def test_single_workbook_checks_cancel(general):
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(IngestCancelled):
+        load_workbooks([general], cancel=cancel)
+
+
+def test_streaming_stops_between_chunks(general):
+    cancel = threading.Event()
+    worksheet = openpyxl.load_workbook(general, read_only=True)['Sheet']
+    chunks = iter_sheet_chunks(worksheet, ['HTS Number'], chunk_rows=3, cancel=cancel)
+    first, _ = next(chunks)
+    assert len(first) == 3
+    cancel.set()
+    with pytest.raises(IngestCancelled):
+        next(chunks)
+
+
+def test_cancelled_single_workbook_job_is_not_done(general):
+    def read(job):
+        job.cancel_event.set()
+        return load_workbooks([general], cancel=job.cancel_event)
+
+    job = JobRunner(max_workers=1).submit("Read schedules", read)
+    job.future.result()
+    assert job.status == 'cancelled'
+    assert job.result is None
+
+
+def test_both_readers_strip_header_names(tmp_path):
+    # .xlsx sheets are streamed, .xls sheets go through pandas, both give the same names
+    workbook = openpyxl.Workbook()
+    workbook.active.append([' HTS Number ', 'Description', 'General Rate of Duty '])
+    workbook.active.append(['8481.80.00', 'Valves', '5%'])
+    path = tmp_path / 'padded.xlsx'
+    workbook.save(path)
+    columns = ['HTS Number', 'General Rate of Duty']
+    parsed = _parse_sheet(pd.ExcelFile(path), workbook.active.title, columns)
+    streamed = stream_sheet(openpyxl.load_workbook(path, read_only=True).active, columns)
+    assert parsed.columns.tolist() == streamed.columns.tolist() == columns
@@ -0,0 +1,97 @@
+import pandas as pd
+import pytest
+
+from duty_rules import RULE_COLUMNS, compile_rules
+from tariff_engine import calculate_tariffs
+from tariff_part_cache import PartCache, calculate_tariffs_cached
+
+
+def entries(codes, countries):
+    return pd.DataFrame({
+        'SLB Part Number': [f"P{n}" for n in range(len(codes))],
+        'US HTS': codes,
+        'COO': countries,
+        'Value': [1000.0] * len(codes),
+        'Weight': [10.0] * len(codes),
+        'MOT': ['AIR'] * len(codes),
+    })
+
+
+@pytest.fixture
+def lines():
+    return entries(['84818000', '73041910', '84818000', '76061100'], ['China', 'Germany', 'China', 'Canada'])
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    # Namespace files written, in order
+    written = []
+    write = PartCache._write
+    monkeypatch.setattr(PartCache, '_write', lambda self, namespace: written.append(namespace) or write(self, namespace))
+    return written
+
+
+def test_costed_parts_are_found_again(tmp_path, lines, indexes, rules):
+    cache = PartCache(str(tmp_path))
+    first = calculate_tariffs_cached(lines, *indexes, cache, 'v1', rules)
+    assert first.attrs['cached_parts'] == 0
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    # A new cache on the same directory, as after a restart, reads the file back
+    again = calculate_tariffs_cached(lines, *indexes, PartCache(str(tmp_path)), 'v1', rules)
+    assert again.attrs['cached_parts'] == 3
+    expected = calculate_tariffs(lines, *indexes, rules)
+    pd.testing.assert_series_equal(again['Tariffs & Fees to be Paid (USD)'], expected['Tariffs & Fees to be Paid (USD)'])
+
+
+def test_other_schedules_or_rules_miss(tmp_path, lines, indexes, rules):
+    cache = PartCache(str(tmp_path))
+    calculate_tariffs_cached(lines, *indexes, cache, 'v1', rules)
+    assert calculate_tariffs_cached(lines, *indexes, cache, 'v2', rules).attrs['cached_parts'] == 0
+
+    # The China duty moved to Canadian goods: no line may reuse the components of the old rules
+    changed_rules = rules[RULE_COLUMNS].copy()
+    changed_rules.loc[changed_rules['component'] == 'china', 'country'] = 'Canada'
+    changed_rules = compile_rules(changed_rules)
+    result = calculate_tariffs_cached(lines, *indexes, cache, 'v1', changed_rules)
+    assert result.attrs['cached_parts'] == 0
+    assert result['COO China Tariff'].tolist() == pytest.approx([0.0, 0.0, 0.0, 25.0])
+
+
+def test_invalidate_removes_every_entry(tmp_path, lines, indexes, rules):
+    cache = PartCache(str(tmp_path))
+    calculate_tariffs_cached(lines, *indexes, cache, 'v1', rules)
+    cache.invalidate()
+    assert cache.stats()['entries'] == 0
+    assert calculate_tariffs_cached(lines, *indexes, PartCache(str(tmp_path)), 'v1', rules).attrs['cached_parts'] == 0
+
+
+def test_batches_are_written_once_on_flush(tmp_path, indexes, rules, writes):
+    cache = PartCache(str(tmp_path))
+    for batch in [entries(['84818000'], ['China']), entries(['73041910'], ['Germany']), entries(['76061100'], ['Canada'])]:
+        calculate_tariffs_cached(batch, *indexes, cache, 'v1', rules, write=False)
+    assert writes == []
+    # Unwritten entries are still found by the cache that holds them
+    assert calculate_tariffs_cached(entries(['84818000'], ['China']), *indexes, cache, 'v1', rules, write=False).attrs['cached_parts'] == 1
+    cache.flush()
+    assert len(writes) == 1
+    assert cache.stats()['entries'] == 3
+    cache.flush()
+    assert len(writes) == 1
+
+
+def test_unwritten_entries_survive_a_reload(tmp_path, indexes, rules):
+    # Another process rewriting the namespace file does not drop entries not flushed yet
+    ours, theirs = PartCache(str(tmp_path)), PartCache(str(tmp_path))
+    calculate_tariffs_cached(entries(['84818000'], ['China']), *indexes, ours, 'v1', rules, write=False)
+    calculate_tariffs_cached(entries(['73041910'], ['Germany']), *indexes, theirs, 'v1', rules)
+    ours.flush()
+    assert PartCache(str(tmp_path)).stats()['entries'] == 2
+
+
+def test_least_recently_used_entries_are_dropped(tmp_path, indexes, rules):
+    cache = PartCache(str(tmp_path), limit=2)
+    for code, country in [('84818000', 'China'), ('73041910', 'Germany'), ('76061100', 'Canada')]:
+        calculate_tariffs_cached(entries([code], [country]), *indexes, cache, 'v1', rules)
+    assert cache.stats()['entries'] == 2
+    assert calculate_tariffs_cached(entries(['84818000'], ['China']), *indexes, cache, 'v1', rules).attrs['cached_parts'] == 0
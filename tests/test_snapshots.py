@@ -0,0 +1,91 @@
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tariff_snapshots
+from tariff_snapshots import add_snapshot, calculate_tariffs_as_of, catalog_path, diff_snapshots, list_snapshots, snapshot_data
+
+
+def schedule(general_rate, steel=0.0, extra=()):
+    codes = ['84818000', '73041910'] + [code for code, _ in extra]
+    return pd.DataFrame({
+        'HTS_Code': codes,
+        'General_Rate_of_Duty': [general_rate, '2%'] + [rate for _, rate in extra],
+        'China Duties': [0.25, 0.0] + [0.0] * len(extra),
+        'Aluminum': [0.0] * len(codes),
+        'Steel': [0.0, steel] + [0.0] * len(extra),
+        'ADD/CVD': [np.nan] * len(codes),
+    })
+
+
+def save(store_dir, merged, effective_date, content):
+    return add_snapshot([io.BytesIO(content)], effective_date, store_dir=str(store_dir), build=lambda: merged)
+
+
+def test_lines_are_costed_against_the_snapshot_in_force(tmp_path, rules):
+    assert save(tmp_path, schedule('5%'), '2024-01-01', b'2024') == 1
+    assert save(tmp_path, schedule('10%'), '2025-01-01', b'2025') == 2
+    lines = pd.DataFrame({
+        'SLB Part Number': ['P1', 'P2', 'P3', 'P4'],
+        'US HTS': ['84818000'] * 4,
+        'COO': ['Germany'] * 4,
+        'Value': [1000.0] * 4,
+        'Weight': [1.0] * 4,
+        'MOT': ['AIR'] * 4,
+        'Entry Date': ['2024-06-30', '2025-01-01', '2023-12-31', '2024-12-31'],
+    })
+    result = calculate_tariffs_as_of(lines, str(tmp_path), rules)
+    assert result['Snapshot Version'].tolist() == [1, 2, 0, 1]
+    assert result['Tariffs to be Paid (USD)'].tolist()[:2] == pytest.approx([50.0, 100.0])
+    assert result.loc[3, 'Tariffs to be Paid (USD)'] == pytest.approx(50.0)
+    # Before the first snapshot the duties are blank with the reason, the fees are still charged
+    assert np.isnan(result.loc[2, 'Tariffs to be Paid (USD)'])
+    assert result.loc[2, 'Rate Error'] == "No tariff snapshot was in force on the entry date"
+    assert result.loc[2, 'CBP Merchandise Processing Fee'] > 0
+
+
+def test_saving_the_same_files_again_keeps_the_version(tmp_path):
+    assert save(tmp_path, schedule('5%'), '2024-01-01', b'2024') == 1
+    assert save(tmp_path, schedule('5%'), '2024-01-01', b'2024') == 1
+    assert save(tmp_path, schedule('5%'), '2025-01-01', b'2024') == 2
+    assert list_snapshots(str(tmp_path))['version'].tolist() == [1, 2]
+
+
+def test_concurrent_saves_get_distinct_versions(tmp_path):
+    versions = []
+    threads = [threading.Thread(target=lambda n=n: versions.append(save(tmp_path, schedule(f"{n}%"), f"202{n}-01-01", bytes([n]))))
+               for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(versions) == list(range(1, 9))
+    assert sorted(list_snapshots(str(tmp_path))['version']) == list(range(1, 9))
+    assert not os.path.exists(f"{catalog_path(str(tmp_path))}.lock")
+
+
+def test_held_catalog_lock_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(tariff_snapshots, 'CATALOG_LOCK_TIMEOUT', 0.1)
+    lock = f"{catalog_path(str(tmp_path))}.lock"
+    open(lock, 'w').close()
+    with pytest.raises(TimeoutError):
+        save(tmp_path, schedule('5%'), '2024-01-01', b'2024')
+    # A lock older than CATALOG_LOCK_STALE was left by a process that died, it is taken over
+    os.utime(lock, (0, 0))
+    assert save(tmp_path, schedule('5%'), '2024-01-01', b'2024') == 1
+
+
+def test_diff_lists_added_removed_and_changed_fields(tmp_path):
+    save(tmp_path, schedule('5%', extra=[('0101', 'Free')]), '2024-01-01', b'2024')
+    save(tmp_path, schedule('10%', steel=0.25, extra=[('0202', '3%')]), '2025-01-01', b'2025')
+    diff = diff_snapshots(snapshot_data(1, str(tmp_path)), snapshot_data(2, str(tmp_path)))
+    rows = diff.fillna('').astype(str).values.tolist()
+    assert ['0101', 'removed', '', '', ''] in rows
+    assert ['0202', 'added', '', '', ''] in rows
+    assert ['84818000', 'changed', 'General_Rate_of_Duty', '5%', '10%'] in rows
+    assert ['73041910', 'changed', 'Steel', '0.0', '0.25'] in rows
+    assert len(rows) == 4
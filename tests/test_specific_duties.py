@@ -0,0 +1,72 @@
+import openpyxl
+import pandas as pd
+import pytest
+
+from tariff_engine import build_prefix_index, build_tariff_index, calculate_tariffs
+from tariff_ingest import load_workbook, merge_workbooks
+
+CODE = '8481.80.00'
+
+
+def write_workbook(path, sheet, rows):
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = sheet
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(path)
+    return path
+
+
+@pytest.fixture
+def schedules(tmp_path):
+    return {
+        'general': write_workbook(tmp_path / 'general.xlsx', 'Sheet1',
+                                  [['HTS Number', 'General Rate of Duty'], [CODE, '5%'], ['7304.19.10', '2%']]),
+        'china': write_workbook(tmp_path / 'china.xlsx', 'China', [['HTS', 'China'], [CODE, 0.25]]),
+        'aluminum': write_workbook(tmp_path / 'aluminum.xlsx', 'Aluminum', [['HTS', 'Aluminum'], [CODE, 0.1]]),
+        'steel': write_workbook(tmp_path / 'steel.xlsx', 'Steel', [['HTS', 'Steel'], [CODE, 0.5]]),
+        'addcvd': write_workbook(tmp_path / 'addcvd.xlsx', 'ADD', [['HSCODE'], ['7304.19.10']]),
+    }
+
+
+def cost(files, coo='China'):
+    merged = merge_workbooks([load_workbook(file) for file in files])
+    tariff_index = build_tariff_index(merged)
+    entries = pd.DataFrame({'SLB Part Number': ['P1'], 'US HTS': ['84818000'], 'COO': [coo],
+                            'Value': [1000.0], 'Weight': [10.0], 'MOT': ['AIR']})
+    return merged, calculate_tariffs(entries, tariff_index, build_prefix_index(tariff_index)).iloc[0]
+
+
+def test_each_sheet_fills_its_own_schedule_column(schedules):
+    merged, _ = cost(schedules.values())
+    row = merged.set_index('HTS_Code').loc['84818000']
+    assert row['China Duties'] == pytest.approx(0.25)
+    assert row['Aluminum'] == pytest.approx(0.1)
+    assert row['Steel'] == pytest.approx(0.5)
+    assert 'Specific_Rate_of_Duty' not in merged.columns
+    assert row['Tariff'] == '5% + 0.5 + 0.1 + 0.25'
+
+
+@pytest.mark.parametrize('schedule, column, expected', [
+    ('china', 'COO China Tariff', 25.0),
+    ('aluminum', 'Aluminum Tariff', 0.1),
+    ('steel', 'Steel Tariff', 0.5),
+])
+def test_each_specific_duty_upload_changes_the_duty(schedules, schedule, column, expected):
+    _, without = cost([schedules['general']])
+    _, with_schedule = cost([schedules['general'], schedules[schedule]])
+    assert without[column] == 0
+    assert with_schedule[column] == pytest.approx(expected)
+    assert with_schedule['Tariffs to be Paid (USD)'] > without['Tariffs to be Paid (USD)']
+
+
+def test_china_duties_only_apply_to_china_origin(schedules):
+    _, line = cost([schedules['general'], schedules['china']], coo='Germany')
+    assert line['COO China Tariff'] == 0
+
+
+def test_codes_outside_the_case_list_keep_their_general_rate(schedules):
+    _, line = cost([schedules['addcvd'], schedules['china'], schedules['general']])
+    assert line['General Tariff Percentage'] > 0
+    assert line['COO China Tariff'] == pytest.approx(25.0)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tariff_engine import OUTCOME_COLUMNS, calculate_tariffs
+
+# Fee rules of the rules fixture in conftest.py
+MPF_RATE, MPF_MINIMUM, MPF_MAXIMUM, HMF_RATE = 0.003464, 32.71, 634.62, 0.00125
+
+
+def entries(rows):
+    return pd.DataFrame(rows, columns=['SLB Part Number', 'US HTS', 'COO', 'Value', 'Weight', 'MOT'])
+
+
+def test_hand_computed_lines(indexes, rules):
+    lines = entries([
+        ['P1', '84818000', 'China', 1000.0, 10.0, 'AIR'],
+        ['P2', '73041910', 'Germany', 2000.0, 100.0, 'OCEAN'],
+        ['P3', '76061100', 'Canada', 200000.0, 500.0, 'TRUCK'],
+        ['P4', '8481800010', 'Germany', 100.0, 1.0, 'AIR'],
+    ])
+    result = calculate_tariffs(lines, *indexes, rules=rules).set_index('SLB Part Number')
+
+    # P1: 5% general and 25% Section 301 on 1,000, MPF 3.46 raised to the minimum
+    assert result.loc['P1', 'General Tariff Percentage'] == pytest.approx(0.05 * 10000)
+    assert result.loc['P1', 'COO China Tariff'] == pytest.approx(25.0)
+    assert result.loc['P1', 'Tariffs to be Paid (USD)'] == pytest.approx(50 + 250)
+    assert result.loc['P1', 'CBP Merchandise Processing Fee'] == pytest.approx(MPF_MINIMUM)
+    assert result.loc['P1', 'CBP Harbor Maintenance Fee'] == pytest.approx(0.0)
+    assert result.loc['P1', 'Tariffs & Fees to be Paid (USD)'] == pytest.approx(300 + MPF_MINIMUM)
+
+    # P2: $1.035/kg on 100 kg plus 2% of 2,000, 25% steel, HMF by ocean, ADD flagged
+    assert result.loc['P2', 'Tariffs to be Paid (USD)'] == pytest.approx(103.5 + 40 + 500)
+    assert result.loc['P2', 'COO China Tariff'] == pytest.approx(0.0)
+    assert result.loc['P2', 'Steel Tariff'] == pytest.approx(0.25)
+    assert result.loc['P2', 'CBP Harbor Maintenance Fee'] == pytest.approx(2000 * HMF_RATE)
+    assert result.loc['P2', 'Potential ADD/CVD Flag'] == 'ADD'
+    assert result.loc['P2', 'Tariffs & Fees to be Paid (%)'] == pytest.approx((643.5 + MPF_MINIMUM + 2.5) / 2000 * 100)
+
+    # P3: free, 10% aluminum, the China duty does not apply to Canada, MPF capped at the maximum
+    assert result.loc['P3', 'Tariffs to be Paid (USD)'] == pytest.approx(20000.0)
+    assert result.loc['P3', 'CBP Merchandise Processing Fee'] == pytest.approx(MPF_MAXIMUM)
+
+    # P4: not listed, costed at its 8 digit tariff line
+    assert result.loc['P4', 'HTS Match Level'] == 8
+    assert result.loc['P4', 'Tariffs to be Paid (USD)'] == pytest.approx(5.0)
+
+
+def test_unparsed_rates_and_blank_codes_are_left_blank(indexes, rules):
+    lines = entries([
+        ['P1', '99999999', 'Germany', 1000.0, 10.0, 'AIR'],
+        ['P2', '', 'Germany', 1000.0, 10.0, 'AIR'],
+    ])
+    result = calculate_tariffs(lines, *indexes, rules=rules)
+    assert np.isnan(result.loc[0, 'Tariffs to be Paid (USD)'])
+    assert 'See heading 9903' in result.loc[0, 'Rate Error']
+    assert result.attrs['unparsed_rates'] == [result.loc[0, 'Rate Error']]
+    assert result.loc[1, OUTCOME_COLUMNS].isna().all()
+
+
+def test_entry_numbers_share_the_mpf_limits(indexes, rules):
+    lines = entries([['P1', '84818000', 'Germany', 5000.0, 1.0, 'AIR'], ['P2', '84818000', 'Germany', 5000.0, 1.0, 'AIR']])
+    lines['Entry Number'] = ['E1', 'E1']
+    result = calculate_tariffs(lines, *indexes, rules=rules)
+    assert result['CBP Merchandise Processing Fee'].tolist() == pytest.approx([5000 * MPF_RATE] * 2)
@@ -0,0 +1,56 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+import tariff_store
+from tariff_store import load_merged, read_merged, store_key, write_merged
+
+
+def schedules(*contents):
+    return [io.BytesIO(content) for content in contents]
+
+
+def merged_table():
+    return pd.DataFrame({
+        'HTS_Code': ['8481800000', '7304190000', '0101'],
+        'General_Rate_of_Duty': ['5%', 0.065, np.nan],
+        'Steel': [np.nan, 0.25, np.nan],
+    })
+
+
+def test_written_table_reads_back(tmp_path):
+    key = store_key(schedules(b'general', b'china'))
+    assert read_merged(key, str(tmp_path)) is None
+    write_merged(merged_table(), key, str(tmp_path))
+    stored = read_merged(key, str(tmp_path))
+    assert stored['HTS_Code'].tolist() == ['8481800000', '7304190000', '0101']
+    # Mixed numbers and text are stored as text, blanks stay blank
+    assert stored['General_Rate_of_Duty'].tolist()[:2] == ['5%', '0.065']
+    assert pd.isna(stored.loc[2, 'General_Rate_of_Duty'])
+    assert stored['Steel'].tolist()[1] == 0.25
+
+
+def test_same_bytes_hit_the_store(tmp_path):
+    builds = []
+    build = lambda: builds.append(1) or merged_table()
+    first = load_merged(schedules(b'general', b'china'), str(tmp_path), build)
+    again = load_merged(schedules(b'general', b'china'), str(tmp_path), build)
+    assert len(builds) == 1
+    assert store_key(schedules(b'general', b'china')) == store_key(schedules(b'general', b'china'))
+    pd.testing.assert_frame_equal(again, read_merged(store_key(schedules(b'general', b'china')), str(tmp_path)))
+    assert first['HTS_Code'].tolist() == again['HTS_Code'].tolist()
+
+
+def test_key_changes_with_the_bytes_order_and_format(monkeypatch):
+    key = store_key(schedules(b'general', b'china'))
+    assert store_key(schedules(b'general', b'china ')) != key
+    assert store_key(schedules(b'china', b'general')) != key
+    monkeypatch.setattr(tariff_store, 'STORE_FORMAT', tariff_store.STORE_FORMAT + 1)
+    assert store_key(schedules(b'general', b'china')) != key
+
+
+def test_paths_and_buffers_share_a_key(tmp_path):
+    path = tmp_path / 'general.xlsx'
+    path.write_bytes(b'general')
+    assert store_key([str(path)]) == store_key(schedules(b'general'))